@@ -7,6 +7,8 @@ from datetime import datetime, timezone
 import hashlib
 import base64
 
+from detection_utils import ImageSource, hash_image_source
+
 # Intentar importar c2pa (opcional)
 try:
     import c2pa
@@ -54,7 +56,7 @@ def _read_png_metadata(image_path: str) -> Dict[str, Any]:
 
 
 def _generate_c2pa_manifest(
-    image_path: str,
+    image_path: ImageSource,
     prompt: str,
     model: str,
     author: str = "AI System",
@@ -62,13 +64,12 @@ def _generate_c2pa_manifest(
 ) -> Dict[str, Any]:
     """
     Genera un manifest compatible con C2PA v1.3 con estructura completa.
+    `image_path` puede ser una ruta, los bytes de la imagen o un stream abierto.
     """
     timestamp = datetime.now(timezone.utc).isoformat()
     
-    # Calcular hash de la imagen
-    with open(image_path, "rb") as f:
-        image_data = f.read()
-        image_hash = hashlib.sha256(image_data).hexdigest()
+    # Calcular hash de la imagen por bloques (memoria acotada)
+    image_hash = hash_image_source(image_path)
     
     manifest = {
         "claim_generator": "PMC-C2PA/1.0",
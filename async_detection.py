@@ -0,0 +1,223 @@
+"""
+Fachada asyncio de la detección y el marcado.
+
+detection_utils es E/S de archivos bloqueante más trabajo de CPU; llamado
+directamente desde un servicio aiohttp/FastAPI bloquea el bucle de eventos.
+Estas funciones hacen lo mismo en un executor acotado:
+
+- adetect_image_status_c2pa / amark_image_as_ai: una imagen.
+- adetect_many / amark_many: lotes, con los resultados según terminan.
+
+Las lecturas de la imagen también ocurren en el executor (el bucle nunca
+toca el disco). Un semáforo por bucle de eventos limita las operaciones en
+vuelo: se pueden lanzar miles de detecciones sin crear un hilo por cada
+una ni llenar la cola del executor. Cada plaza se libera cuando el worker
+termina de verdad, aunque la corrutina que esperaba se haya cancelado.
+
+Con hilos (por defecto) las etapas de metrics cuentan en la petición en
+curso, porque el contexto se copia al hilo; con procesos se evita el GIL
+en los lotes grandes pero solo cada proceso ve sus métricas.
+
+Configuración por variables de entorno:
+    PMC_ASYNC_EXECUTOR     "thread" (por defecto) o "process"
+    PMC_ASYNC_WORKERS      Hilos o procesos del executor (por defecto
+                           nº de CPUs + 4 con hilos, como mucho 32; nº de CPUs con procesos)
+    PMC_ASYNC_CONCURRENCY  Operaciones en vuelo por bucle de eventos (por defecto 64)
+
+Uso:
+    result = await adetect_image_status_c2pa("foto.png", detail="summary")
+    async for result in adetect_many(rutas):
+        ...
+"""
+import os
+import asyncio
+import threading
+import functools
+import contextvars
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, AsyncIterator, Callable, Iterable
+
+from detection_utils import ImageSource, detect_image_status_c2pa, mark_image_as_ai
+from batch_detect import detect_named
+from batch_mark import MARK_FIELDS
+
+DEFAULT_CONCURRENCY = 64
+
+EXECUTOR_KINDS = ("thread", "process")
+
+_END = object()
+
+
+def _mark_one(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Marca una fila (path, prompt, model, author) sin propagar excepciones.
+    A diferencia de batch_mark no redirige stdout: sys.stdout es global y
+    los hilos se pisarían la redirección.
+    """
+    if row.get("error"):
+        result = {"success": False, "error": row["error"]}
+    elif not row.get("path"):
+        result = {"success": False, "error": "Fila sin 'path'"}
+    else:
+        try:
+            result = mark_image_as_ai(row["path"], **{k: row[k] for k in MARK_FIELDS if k in row})
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+    result["path"] = row.get("path", "")
+    if "line" in row:
+        result["line"] = row["line"]
+    return result
+
+
+class AsyncDetector:
+    """Ejecuta detección y marcado desde asyncio en un executor acotado"""
+
+    def __init__(self, workers: int = None, concurrency: int = DEFAULT_CONCURRENCY, kind: str = "thread"):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Executor desconocido: {kind} (opciones: {', '.join(EXECUTOR_KINDS)})")
+        cpus = os.cpu_count() or 1
+        self.kind = kind
+        self.workers = workers or (min(32, cpus + 4) if kind == "thread" else cpus)
+        self.concurrency = max(1, concurrency)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # Un semáforo por bucle: los de asyncio no se pueden compartir entre bucles
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _get_executor(self) -> Executor:
+        # El pool se crea en el proceso que lo usa (nunca antes de un fork)
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self.kind == "thread":
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pmc-async")
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta fn(*args, **kwargs) en el executor y espera su resultado sin
+        bloquear el bucle. Como mucho `concurrency` llamadas a la vez.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(loop)
+        await semaphore.acquire()
+        call = functools.partial(fn, *args, **kwargs)
+        if self.kind == "thread":
+            call = functools.partial(contextvars.copy_context().run, call)
+        try:
+            future = self._get_executor().submit(call)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def release(_) -> None:
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # El bucle ya se cerró: nadie más espera en su semáforo
+                pass
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def detect(self, image_path: ImageSource, name: str = None, detail: str = "full") -> Dict[str, Any]:
+        """detect_image_status_c2pa sin bloquear el bucle"""
+        return await self.run(detect_image_status_c2pa, image_path, name, detail)
+
+    async def mark(self, image_path: str, *args, **kwargs) -> Dict[str, Any]:
+        """mark_image_as_ai (mismos argumentos) sin bloquear el bucle"""
+        return await self.run(mark_image_as_ai, image_path, *args, **kwargs)
+
+    async def _map_unordered(self, fn: Callable[[Any], Any], items: Iterable[Any]) -> AsyncIterator[Any]:
+        # Como imap_unordered_bounded: nunca más de `concurrency` tareas creadas
+        iterator = iter(items)
+        pending = set()
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    item = next(iterator, _END)
+                    if item is _END:
+                        break
+                    pending.add(asyncio.ensure_future(self.run(fn, item)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def detect_many(self, sources: Iterable[ImageSource], detail: str = "full") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Detecta muchas imágenes (rutas o bytes) y devuelve los resultados
+        según van terminando, cada uno con su "index" en la entrada. Una
+        imagen que falla lleva "error" en lugar de abortar el lote.
+        """
+        items = (
+            (index, os.path.basename(source) if isinstance(source, (str, os.PathLike)) else None, source)
+            for index, source in enumerate(sources)
+        )
+        async for result in self._map_unordered(functools.partial(detect_named, detail=detail), items):
+            yield result
+
+    async def mark_many(self, rows: Iterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Marca filas (path, prompt, model, author, como las de
+        batch_mark.load_mark_rows) y devuelve cada resultado según termina.
+        """
+        async for result in self._map_unordered(_mark_one, rows):
+            yield result
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+_default_detector = None
+
+
+def get_async_detector() -> AsyncDetector:
+    """Detector configurado por PMC_ASYNC_EXECUTOR / PMC_ASYNC_WORKERS / PMC_ASYNC_CONCURRENCY"""
+    global _default_detector
+    if _default_detector is None:
+        _default_detector = AsyncDetector(
+            workers=int(os.getenv("PMC_ASYNC_WORKERS", "0")) or None,
+            concurrency=int(os.getenv("PMC_ASYNC_CONCURRENCY", str(DEFAULT_CONCURRENCY))),
+            kind=os.getenv("PMC_ASYNC_EXECUTOR", "thread").strip().lower(),
+        )
+    return _default_detector
+
+
+async def adetect_image_status_c2pa(image_path: ImageSource, name: str = None, detail: str = "full") -> Dict[str, Any]:
+    """Versión asyncio de detect_image_status_c2pa"""
+    return await get_async_detector().detect(image_path, name, detail)
+
+
+async def amark_image_as_ai(image_path: str, *args, **kwargs) -> Dict[str, Any]:
+    """Versión asyncio de mark_image_as_ai (mismos argumentos)"""
+    return await get_async_detector().mark(image_path, *args, **kwargs)
+
+
+def adetect_many(sources: Iterable[ImageSource], detail: str = "full") -> AsyncIterator[Dict[str, Any]]:
+    """Detección por lotes con el detector por defecto (ver AsyncDetector.detect_many)"""
+    return get_async_detector().detect_many(sources, detail)
+
+
+def amark_many(rows: Iterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """Marcado por lotes con el detector por defecto (ver AsyncDetector.mark_many)"""
+    return get_async_detector().mark_many(rows)
@@ -0,0 +1,177 @@
+"""
+Detección por lotes sobre árboles de directorios.
+
+Reparte detect_image_status_c2pa en un pool de procesos y emite los
+resultados (NDJSON) a medida que terminan.
+
+Uso:
+    python batch_detect.py <directorio> [--workers N] [--output resultados.ndjson] [--index]
+
+Con --index los resultados de IA se guardan también en el índice de
+búsqueda de procedencia (PMC_SEARCH_DB).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Callable, Tuple
+
+from detection_utils import detect_image_status_c2pa
+from provenance_search import get_search_index, index_path
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+# Rutas por tarea: amortiza el coste de IPC del pool con imágenes pequeñas
+DEFAULT_CHUNK_SIZE = 16
+
+# Resultados por transacción al llenar el índice de búsqueda
+INDEX_BATCH_SIZE = 500
+
+
+def iter_image_paths(root: str, extensions=IMAGE_EXTENSIONS) -> Iterator[str]:
+    """Recorre `root` recursivamente y devuelve las rutas de imágenes soportadas"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield os.path.join(dirpath, name)
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_unordered_bounded(
+    executor,
+    fn: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_in_flight: int
+) -> Iterator[Any]:
+    """
+    Como executor.map pero sin orden y con un máximo de tareas pendientes,
+    para no encolar millones de futures al recorrer un directorio enorme
+    (y aplicar back-pressure si el consumidor es lento).
+    """
+    iterator = iter(items)
+    pending = set()
+    for item in islice(iterator, max_in_flight):
+        pending.add(executor.submit(fn, item))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+            for item in islice(iterator, 1):
+                pending.add(executor.submit(fn, item))
+
+
+def _detect_one(image_path: str) -> Dict[str, Any]:
+    """Detecta una imagen sin propagar excepciones (aislamiento por archivo)"""
+    try:
+        result = detect_image_status_c2pa(image_path)
+    except Exception as e:
+        result = {"image": os.path.basename(image_path), "error": str(e)}
+    result["path"] = image_path
+    return result
+
+
+def detect_named(item: Tuple[int, str, Any], detail: str = "full") -> Dict[str, Any]:
+    """
+    Detecta una imagen identificada por (índice, nombre, origen), donde el
+    origen es una ruta o los bytes de la imagen. Nunca lanza excepciones.
+    """
+    index, name, source = item
+    try:
+        result = detect_image_status_c2pa(source, name, detail)
+    except Exception as e:
+        result = {"image": name, "error": str(e)}
+    result["index"] = index
+    return result
+
+
+def _detect_chunk(paths: List[str]) -> List[Dict[str, Any]]:
+    return [_detect_one(p) for p in paths]
+
+
+def detect_many(
+    paths: Iterable[str],
+    workers: int = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """
+    Detecta muchas imágenes en paralelo y devuelve los resultados según
+    van terminando (no en el orden de entrada). Cada resultado incluye
+    "path"; si una imagen falla, lleva "error" en lugar de abortar el lote.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for path in paths:
+            yield _detect_one(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = _chunks(paths, chunk_size)
+        for results in imap_unordered_bounded(executor, _detect_chunk, chunks, workers * 2):
+            yield from results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Detección C2PA/IA por lotes (salida NDJSON)")
+    parser.add_argument("root", help="Directorio a escanear recursivamente")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: nº de CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Imágenes por tarea del pool")
+    parser.add_argument("--output", "-o", default=None, help="Archivo NDJSON de salida (por defecto stdout)")
+    parser.add_argument("--index", action="store_true", help="Guardar los resultados de IA en el índice de búsqueda (PMC_SEARCH_DB)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f"❌ Directorio no encontrado: {args.root}", file=sys.stderr)
+        return 1
+
+    index = get_search_index() if args.index else None
+    if args.index and index is None:
+        print("❌ --index requiere la variable de entorno PMC_SEARCH_DB", file=sys.stderr)
+        return 1
+    pending = []
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    total = ai_count = errors = 0
+    start = time.perf_counter()
+    try:
+        for result in detect_many(iter_image_paths(args.root), args.workers, args.chunk_size):
+            out.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            total += 1
+            ai_count += bool(result.get("ai_generated"))
+            errors += "error" in result
+            if index is not None and result.get("ai_generated"):
+                # La salida conserva la ruta relativa; el índice usa la canónica
+                pending.append(dict(result, path=index_path(result["path"])))
+                if len(pending) >= INDEX_BATCH_SIZE:
+                    index.ingest_many(pending)
+                    pending.clear()
+        if index is not None:
+            index.ingest_many(pending)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(
+        f"✓ {total} imágenes en {elapsed:.2f}s ({rate:.1f} img/s) · "
+        f"IA: {ai_count} · errores: {errors}",
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
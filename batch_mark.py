@@ -0,0 +1,204 @@
+"""
+Marcado por lotes a partir de un manifest CSV o JSONL.
+
+Cada fila indica path, prompt, model y author (solo path es obligatorio).
+Las imágenes se marcan en un pool de procesos; un archivo (o una fila mal
+formada) que falla se reporta y el resto del lote continúa, también si un
+proceso del pool muere.
+
+Uso:
+    python batch_mark.py filas.csv [--workers N] [--output resultados.ndjson]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+from typing import Dict, Any, Iterable, Iterator, List, TextIO
+
+from detection_utils import mark_image_as_ai
+
+MARK_FIELDS = ("prompt", "model", "author")
+
+
+def load_mark_rows(manifest_path: str) -> Iterator[Dict[str, str]]:
+    """
+    Lee las filas (path, prompt, model, author) de un CSV con cabecera o de
+    un JSONL. Las rutas relativas se resuelven respecto al manifest.
+
+    Una línea JSONL que no es un objeto JSON válido no aborta la lectura:
+    se devuelve como fila con "error" (y su "line"), que se reporta como fallo.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    is_jsonl = os.path.splitext(manifest_path)[1].lower() in (".jsonl", ".ndjson")
+
+    with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+        if is_jsonl:
+            rows = _jsonl_rows(f)
+        else:
+            rows = enumerate(csv.DictReader(f), start=1)
+        for line_no, row in rows:
+            if isinstance(row, str):
+                yield {"line": line_no, "path": "", "error": row}
+                continue
+            path = (row.get("path") or "").strip()
+            entry = {"line": line_no, "path": os.path.join(base_dir, path) if path else ""}
+            for field in MARK_FIELDS:
+                value = row.get(field)
+                if value:
+                    entry[field] = str(value)
+            yield entry
+
+
+def _jsonl_rows(f: TextIO) -> Iterator[tuple]:
+    """(número de línea, fila) de un JSONL; si la línea no es válida, el error en lugar de la fila"""
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"JSON inválido: {e}"
+            continue
+        yield line_no, row if isinstance(row, dict) else "La fila no es un objeto JSON"
+
+
+def _mark_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Marca una fila sin propagar excepciones (aislamiento por archivo)"""
+    start = time.perf_counter()
+    if row.get("error"):
+        result = {"success": False, "error": row["error"]}
+    elif not row.get("path"):
+        result = {"success": False, "error": "Fila sin 'path'"}
+    else:
+        try:
+            kwargs = {k: row[k] for k in MARK_FIELDS if k in row}
+            # Los avisos de firma van a stderr para no mezclarse con el NDJSON
+            with redirect_stdout(sys.stderr):
+                result = mark_image_as_ai(row["path"], **kwargs)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+    result["path"] = row.get("path", "")
+    result["line"] = row.get("line")
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def mark_many(rows: Iterable[Dict[str, Any]], workers: int = None) -> Iterator[Dict[str, Any]]:
+    """Marca las filas en paralelo y devuelve cada resultado según termina"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for row in rows:
+            yield _mark_row(row)
+        return
+
+    # Como batch_detect.imap_unordered_bounded, pero recordando la fila de
+    # cada future: si un proceso del pool muere (BrokenProcessPool), las
+    # filas en curso se reportan como fallidas y el resto sigue en otro pool.
+    iterator = iter(rows)
+    while True:
+        unsent = []
+        broken = False
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def submit(batch):
+                for row in batch:
+                    if broken or unsent:
+                        unsent.append(row)
+                        continue
+                    try:
+                        pending[executor.submit(_mark_row, row)] = row
+                    except BrokenProcessPool:
+                        unsent.append(row)
+
+            submit(islice(iterator, workers * 2))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        result = _pool_failure(row, e)
+                    yield result
+                    submit(islice(iterator, 1))
+        if not broken and not unsent:
+            return
+        iterator = chain(unsent, iterator)
+
+
+def _pool_failure(row: Dict[str, Any], error: BaseException) -> Dict[str, Any]:
+    """Resultado de una fila cuyo proceso del pool murió durante el marcado"""
+    return {
+        "success": False,
+        "error": f"El proceso que marcaba la imagen terminó de forma abrupta: {error}",
+        "path": row.get("path", ""),
+        "line": row.get("line"),
+        "elapsed_ms": None,
+    }
+
+
+def mark_batch(
+    rows: Iterable[Dict[str, Any]],
+    workers: int = None,
+    output: TextIO = None
+) -> Dict[str, Any]:
+    """
+    Ejecuta el lote completo y devuelve estadísticas (éxitos, fallos y
+    rendimiento). Si se pasa `output`, escribe cada resultado como NDJSON.
+    """
+    stats = {"total": 0, "succeeded": 0, "failed": 0, "failures": []}
+    start = time.perf_counter()
+    for result in mark_many(rows, workers):
+        stats["total"] += 1
+        if result.get("success"):
+            stats["succeeded"] += 1
+        else:
+            stats["failed"] += 1
+            stats["failures"].append({"path": result["path"], "line": result.get("line"), "error": result.get("error")})
+        if output is not None:
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 3)
+    stats["images_per_s"] = round(stats["total"] / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Marcado C2PA por lotes desde CSV/JSONL")
+    parser.add_argument("manifest", help="CSV con cabecera o JSONL con path, prompt, model, author")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: nº de CPUs)")
+    parser.add_argument("--output", "-o", default=None, help="Archivo NDJSON con el resultado por imagen (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.manifest):
+        print(f"❌ Manifest no encontrado: {args.manifest}", file=sys.stderr)
+        return 1
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        stats = mark_batch(load_mark_rows(args.manifest), args.workers, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(
+        f"✓ {stats['succeeded']}/{stats['total']} imágenes marcadas en {stats['elapsed_s']}s "
+        f"({stats['images_per_s']} img/s) · fallos: {stats['failed']}",
+        file=sys.stderr
+    )
+    for failure in stats["failures"]:
+        print(f"  ❌ {failure['path'] or 'línea ' + str(failure['line'])}: {failure['error']}", file=sys.stderr)
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Verificación de firmas C2PA por lotes (auditoría de archivos grandes).
+
+Reparte verify_c2pa_manifest en un pool de procesos por bloques de rutas.
+Cada proceso mantiene su propia caché de cadenas de certificados, así que
+la validación de la cadena se hace una vez por certificado y proceso, y el
+resto del coste por imagen es leer la cabecera y comprobar una firma.
+
+Uso:
+    python batch_verify.py <directorio> [--workers N] [--output resultados.ndjson]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List
+
+from detection_utils import SIGNATURE_UNTRUSTED, verify_c2pa_manifest
+from batch_detect import DEFAULT_CHUNK_SIZE, iter_image_paths, imap_unordered_bounded, _chunks
+
+
+def _verify_one(image_path: str) -> Dict[str, Any]:
+    """Verifica una imagen sin propagar excepciones (aislamiento por archivo)"""
+    try:
+        result = verify_c2pa_manifest(image_path)
+    except Exception as e:
+        result = {"valid": False, "reason": f"Error: {e}"}
+    # El manifest completo no hace falta en un informe de auditoría
+    result.pop("manifest", None)
+    result["path"] = image_path
+    return result
+
+
+def _verify_chunk(paths: List[str]) -> List[Dict[str, Any]]:
+    return [_verify_one(p) for p in paths]
+
+
+def verify_many(
+    paths: Iterable[str],
+    workers: int = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """
+    Verifica las firmas de muchas imágenes en paralelo y devuelve cada
+    resultado ("valid", "status", "reason" o "signer"/"trusted", y "path") según
+    termina, sin respetar el orden de entrada.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for path in paths:
+            yield _verify_one(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = _chunks(paths, chunk_size)
+        for results in imap_unordered_bounded(executor, _verify_chunk, chunks, workers * 2):
+            yield from results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verificación de firmas C2PA por lotes (salida NDJSON)")
+    parser.add_argument("root", help="Directorio a escanear recursivamente")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: nº de CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Imágenes por tarea del pool")
+    parser.add_argument("--output", "-o", default=None, help="Archivo NDJSON de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f"❌ Directorio no encontrado: {args.root}", file=sys.stderr)
+        return 1
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    total = valid = untrusted = 0
+    start = time.perf_counter()
+    try:
+        for result in verify_many(iter_image_paths(args.root), args.workers, args.chunk_size):
+            out.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            total += 1
+            valid += bool(result.get("valid"))
+            untrusted += result.get("status") == SIGNATURE_UNTRUSTED
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(
+        f"✓ {total} imágenes en {elapsed:.2f}s ({rate:.1f} img/s) · "
+        f"firmas válidas y de confianza: {valid} · correctas sin confianza: {untrusted}",
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""
+Benchmark de las rutas críticas de detección y marcado.
+
+Genera localmente un corpus sintético de PNG/JPEG en varios tamaños y
+estados de metadatos (clean, basic, c2pa, sidecar) y mide:
+
+    read_image_metadata, verify_c2pa_manifest, detect_image_status_c2pa,
+    mark_image_as_ai, POST /detect y POST /mark-as-ai (Flask test_client)
+
+Cada caso se ejecuta en un proceso nuevo (spawn), así el pico de RSS es
+el de ese caso y no el del proceso que generó el corpus. La caché de
+detección se desactiva (PMC_CACHE_SIZE=0) para medir el trabajo real.
+Las imágenes son ruido determinista (semilla fija): el peor caso para la
+compresión y el mismo corpus en cada ejecución.
+
+Salida JSON con p50/p99, media, throughput y pico de RSS por caso. Con
+--baseline se compara con una ejecución anterior y se termina con código 1
+si algún p50 empeora más que la tolerancia.
+
+Uso:
+    python bench.py [--sizes 100KB,1MB,10MB,50MB] [-n 20] [--corpus DIR] [-o bench_output.txt]
+    python bench.py --baseline bench_anterior.json --tolerance 0.25
+"""
+import os
+import io
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Tuple
+
+from PIL import Image
+
+from detection_utils import (
+    create_sidecar_manifest,
+    detect_image_status_c2pa,
+    embed_basic_metadata_jpeg,
+    embed_basic_metadata_png,
+    manifest_path_for,
+    mark_image_as_ai,
+    read_image_metadata,
+    verify_c2pa_manifest,
+)
+
+# Pico de RSS (no disponible en Windows)
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+DEFAULT_SIZES = "100KB,1MB,10MB,50MB"
+FORMATS = ("png", "jpeg")
+STATES = ("clean", "basic", "c2pa", "sidecar")
+SEED = 20240601
+
+PROMPT = "Benchmark sintético"
+MODEL = "PMC Bench"
+AUTHOR = "bench"
+
+# Operaciones por estado: el marcado solo se mide sobre imágenes limpias
+READ_OPS = ("read_image_metadata", "verify_c2pa_manifest", "detect_image_status_c2pa", "POST /detect")
+MARK_OPS = ("mark_image_as_ai", "POST /mark-as-ai")
+
+# Variables que cambian el trabajo medido; se copian en el informe
+_CONFIG_ENV = (
+    "C2PA_PRIVATE_KEY", "PMC_MANIFEST_STORE", "PMC_PHASH_DB", "PMC_SEARCH_DB",
+)
+
+# Diferencias de p50 por debajo de esto son ruido de medición, no regresiones
+MIN_REGRESSION_MS = 0.5
+
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    """'100KB' -> 102400"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?B)?\s*", text.upper())
+    if not match:
+        raise ValueError(f"Tamaño no válido: {text}")
+    return int(float(match.group(1)) * _UNITS[match.group(2) or "B"])
+
+
+def _noise(width: int, height: int, seed: int) -> Image.Image:
+    return Image.frombytes("RGB", (width, height), random.Random(seed).randbytes(width * height * 3))
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png":
+        img.save(buf, "PNG", compress_level=1)
+    else:
+        img.save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+
+def _synthetic_image(fmt: str, target: int, seed: int) -> bytes:
+    """Imagen de ruido de aproximadamente `target` bytes"""
+    # Bytes por píxel medidos en una muestra (el ruido apenas se comprime)
+    sample = 128
+    bytes_per_pixel = len(_encode(_noise(sample, sample, seed), fmt)) / (sample * sample)
+    side = max(8, int(math.sqrt(target / bytes_per_pixel)))
+    return _encode(_noise(side, side, seed), fmt)
+
+
+def build_corpus(corpus_dir: str, sizes: List[str]) -> List[Dict[str, Any]]:
+    """
+    Genera (o reutiliza) el corpus y devuelve sus entradas: formato,
+    tamaño, estado y ruta. Las imágenes ya existentes no se regeneran.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    entries = []
+    for fmt in FORMATS:
+        ext = "png" if fmt == "png" else "jpg"
+        embed_basic = embed_basic_metadata_png if fmt == "png" else embed_basic_metadata_jpeg
+        for label in sizes:
+            paths = {state: os.path.join(corpus_dir, f"{fmt}_{label}_{state}.{ext}") for state in STATES}
+            if not all(os.path.exists(p) for p in paths.values()):
+                data = _synthetic_image(fmt, parse_size(label), SEED + parse_size(label))
+                for path in paths.values():
+                    with open(path, "wb") as f:
+                        f.write(data)
+                embed_basic(paths["basic"], PROMPT, MODEL)
+                with redirect_stdout(io.StringIO()):
+                    mark_image_as_ai(paths["c2pa"], PROMPT, MODEL, AUTHOR)
+                # Solo el manifest incrustado: el sidecar es otro estado
+                if os.path.exists(manifest_path_for(paths["c2pa"])):
+                    os.remove(manifest_path_for(paths["c2pa"]))
+                create_sidecar_manifest(paths["sidecar"], PROMPT, MODEL)
+            for state, path in paths.items():
+                entries.append({
+                    "format": fmt,
+                    "size": label,
+                    "size_bytes": os.path.getsize(path),
+                    "state": state,
+                    "path": path,
+                })
+    return entries
+
+
+def _peak_rss_mb() -> float:
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def _operation(op: str, path: str, scratch: str):
+    """Función sin argumentos que ejecuta una vez la operación medida"""
+    if op == "read_image_metadata":
+        return lambda: read_image_metadata(path)
+    if op == "verify_c2pa_manifest":
+        return lambda: verify_c2pa_manifest(path)
+    if op == "detect_image_status_c2pa":
+        return lambda: detect_image_status_c2pa(path)
+    if op == "mark_image_as_ai":
+        # Se re-marca siempre la misma copia: el marcado reemplaza lo anterior
+        copy = os.path.join(scratch, os.path.basename(path))
+        shutil.copyfile(path, copy)
+        return lambda: mark_image_as_ai(copy, PROMPT, MODEL, AUTHOR)
+
+    # Flask solo se importa en los casos que miden un endpoint
+    from web_app import create_app
+    # Sin límite de subida: el corpus supera el PMC_MAX_UPLOAD_MB por defecto
+    client = create_app({"UPLOAD_FOLDER": scratch, "TESTING": True, "MAX_CONTENT_LENGTH": None}).test_client()
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(path)
+    endpoint = {"POST /detect": "/detect", "POST /mark-as-ai": "/mark-as-ai"}[op]
+
+    def post():
+        response = client.post(endpoint, data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint} respondió {response.status_code}")
+    return post
+
+
+def _run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta un caso en el proceso actual (un proceso nuevo por caso)"""
+    with tempfile.TemporaryDirectory(prefix="pmc_bench_") as scratch, redirect_stdout(io.StringIO()):
+        fn = _operation(case["op"], case["path"], scratch)
+        fn()  # calentamiento: importaciones, cachés de claves, etc.
+        baseline_rss = _peak_rss_mb()
+        samples = []
+        start = time.perf_counter()
+        for _ in range(case["iterations"]):
+            t0 = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+
+    samples.sort()
+    result = {k: v for k, v in case.items() if k != "path"}
+    result.update({
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "throughput_ops": round(len(samples) / elapsed, 2),
+        "throughput_mb_s": round(len(samples) * case["size_bytes"] / elapsed / 1024 ** 2, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_after_warmup_mb": baseline_rss,
+    })
+    return result
+
+
+def _cases(entries: List[Dict[str, Any]], iterations: int, ops: List[str]) -> List[Dict[str, Any]]:
+    cases = []
+    for entry in entries:
+        state_ops = READ_OPS + MARK_OPS if entry["state"] == "clean" else READ_OPS
+        for op in state_ops:
+            if op in ops:
+                cases.append(dict(entry, op=op, iterations=iterations))
+    return cases
+
+
+def run_benchmark(
+    corpus_dir: str,
+    sizes: List[str],
+    iterations: int = 20,
+    ops: List[str] = READ_OPS + MARK_OPS
+) -> Dict[str, Any]:
+    """Genera el corpus y mide cada caso en un proceso propio"""
+    # Se hereda en los procesos hijos (spawn) antes de importar la caché
+    os.environ["PMC_CACHE_SIZE"] = "0"
+    entries = build_corpus(corpus_dir, sizes)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in _cases(entries, iterations, ops):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(_run_case, case).result()
+        results.append(result)
+        print(
+            f"✓ {result['op']:<26} {result['format']:<4} {result['size']:>6} {result['state']:<7} "
+            f"p50 {result['p50_ms']:>9.2f} ms · p99 {result['p99_ms']:>9.2f} ms · RSS {result['peak_rss_mb']} MB",
+            file=sys.stderr
+        )
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "iterations": iterations,
+        "config": {name: bool(os.getenv(name)) for name in _CONFIG_ENV},
+        "results": results,
+    }
+
+
+def _case_key(result: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    return result["op"], result["format"], result["size"], result["state"]
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Casos cuyo p50 empeora más que `tolerance` (0.25 = 25 %) respecto a la referencia"""
+    previous = {_case_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(_case_key(result))
+        if (
+            old
+            and result["p50_ms"] > old["p50_ms"] * (1 + tolerance)
+            and result["p50_ms"] - old["p50_ms"] > MIN_REGRESSION_MS
+        ):
+            regressions.append(
+                f"{' '.join(_case_key(result))}: p50 {old['p50_ms']} → {result['p50_ms']} ms"
+            )
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de detección y marcado (salida JSON)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Tamaños del corpus (por defecto {DEFAULT_SIZES})")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="Repeticiones medidas por caso")
+    parser.add_argument("--ops", default=None, help="Operaciones a medir, separadas por comas (por defecto todas)")
+    parser.add_argument("--corpus", default=None, help="Directorio del corpus (se reutiliza si ya existe)")
+    parser.add_argument("--output", "-o", default=None, help="Archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON de una ejecución anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Empeoramiento de p50 tolerado (0.25 = 25 %%)")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    ops = [o.strip() for o in args.ops.split(",")] if args.ops else list(READ_OPS + MARK_OPS)
+    unknown = set(ops) - set(READ_OPS + MARK_OPS)
+    if unknown:
+        print(f"❌ Operaciones desconocidas: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 1
+    try:
+        for size in sizes:
+            parse_size(size)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix="pmc_corpus_")
+    try:
+        report = run_benchmark(corpus_dir, sizes, args.iterations, ops)
+    finally:
+        if not args.corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    content = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(content + "\n")
+    else:
+        print(content)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"❌ Regresión: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✓ Sin regresiones respecto a la referencia", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
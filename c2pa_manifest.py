@@ -0,0 +1,214 @@
+"""
+Manifest C2PA con serialización canónica memoizada.
+
+C2PAManifest es un dict que calcula una sola vez sus bytes canónicos (claim
+sin "signature": JSON UTF-8, claves ordenadas, separadores compactos) y los
+reutilizan la firma, la incrustación, el sidecar y la verificación.
+
+Formato en disco ("sobre" firmado): los bytes canónicos del claim con el
+miembro "signature" añadido al final:
+
+    {"assertions":[...],...,"title":"..."}           <- bytes firmados
+    {"assertions":[...],...,"title":"...","signature":{...}}
+
+Así la verificación recorta los bytes exactos que se firmaron en lugar de
+volver a serializar el JSON. Los manifests antiguos (sin sobre) se siguen
+verificando re-serializando el claim.
+
+Los bytes firmados siempre se generan con json estándar: orjson no
+serializa igual algunos valores (1e16 frente a 1e+16) y la firma no puede
+depender del backend instalado. Si orjson está instalado solo se usa para
+leer manifests.
+"""
+import json
+from typing import Dict, Any, Optional, Union
+
+# Intentar importar orjson (más rápido que json al parsear)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Identificador de la codificación canónica guardado junto a la firma
+CANONICALIZATION = "json-c14n-v1"
+
+_SIGNATURE_MEMBER = b',"signature":'
+
+
+def _dumps(obj: Any) -> bytes:
+    """
+    Codificación canónica (CANONICALIZATION): JSON compacto, UTF-8, con
+    claves ordenadas y sin NaN/Infinity, que no tienen forma JSON estándar.
+    """
+    return json.dumps(
+        obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+    ).encode("utf-8")
+
+
+def _loads(raw: Union[bytes, str]) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def canonical_manifest_bytes(manifest: Dict[str, Any]) -> bytes:
+    """
+    Codificación canónica con json estándar (sin el miembro "signature").
+    Es la que usan los manifests firmados antes del formato con sobre.
+    """
+    claim = {k: v for k, v in manifest.items() if k != "signature"}
+    return json.dumps(
+        claim, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def legacy_manifest_bytes(manifest: Dict[str, Any]) -> bytes:
+    """Serialización usada por las firmas simuladas antiguas"""
+    claim = {k: v for k, v in manifest.items() if k != "signature"}
+    return json.dumps(claim, sort_keys=True, ensure_ascii=False).encode()
+
+
+class C2PAManifest(dict):
+    """
+    Manifest C2PA (dict) que memoiza sus bytes canónicos.
+
+    Cualquier cambio de primer nivel (m["x"] = ..., update, pop...) invalida
+    la memoria; si se modifica un valor anidado hay que llamar a invalidate().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.invalidate()
+
+    @classmethod
+    def from_json(cls, raw: Union[bytes, str]) -> "C2PAManifest":
+        """Parsea un manifest conservando los bytes leídos (para verificarlo)"""
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        data = _loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("El manifest C2PA no es un objeto JSON")
+        manifest = cls(data)
+        manifest._raw = raw
+        return manifest
+
+    @classmethod
+    def coerce(cls, manifest: Dict[str, Any]) -> "C2PAManifest":
+        """Devuelve el mismo objeto si ya es C2PAManifest, o lo envuelve"""
+        return manifest if isinstance(manifest, cls) else cls(manifest)
+
+    def invalidate(self) -> None:
+        """Descarta los bytes memoizados"""
+        self._claim_bytes: Optional[bytes] = None
+        self._raw: Optional[bytes] = None
+        self._signed_bytes: Optional[bytes] = None
+
+    @property
+    def claim(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.items() if k != "signature"}
+
+    @property
+    def claim_bytes(self) -> bytes:
+        """Bytes canónicos del claim (sin "signature"), calculados una vez"""
+        if self._claim_bytes is None:
+            self._claim_bytes = _dumps(self.claim)
+        return self._claim_bytes
+
+    @property
+    def signed_bytes(self) -> bytes:
+        """
+        Bytes cubiertos por la firma. Si el manifest se leyó con formato de
+        sobre se recortan de los bytes originales; si no, se serializa el
+        claim de forma canónica (manifests antiguos, creados en memoria o
+        leídos de JUMBF, que los reconstruye campo a campo sin pérdidas).
+        """
+        if self._signed_bytes is None:
+            sliced = self._slice_envelope() if self._raw is not None else None
+            if sliced is not None:
+                self._signed_bytes = sliced
+            elif self._raw is not None:
+                self._signed_bytes = canonical_manifest_bytes(self)
+            else:
+                self._signed_bytes = self.claim_bytes
+        return self._signed_bytes
+
+    def _slice_envelope(self) -> Optional[bytes]:
+        if "signature" not in self:
+            return None
+        raw = self._raw.rstrip()
+        if not raw.endswith(b"}"):
+            return None
+        # Puede haber claves "signature" anidadas: probar de derecha a izquierda
+        end = len(raw)
+        while True:
+            pos = raw.rfind(_SIGNATURE_MEMBER, 0, end)
+            if pos < 0:
+                return None
+            try:
+                if _loads(raw[pos + len(_SIGNATURE_MEMBER):-1]) == self["signature"]:
+                    return raw[:pos] + b"}"
+            except ValueError:
+                pass
+            end = pos
+
+    def with_signature(self, signature: Dict[str, Any]) -> "C2PAManifest":
+        """Copia del manifest con la firma dada, reutilizando los bytes del claim"""
+        signed = C2PAManifest(self.claim)
+        signed["signature"] = signature
+        signed._claim_bytes = self.claim_bytes
+        signed._signed_bytes = self.claim_bytes
+        return signed
+
+    def to_bytes(self) -> bytes:
+        """Serialización para incrustar o guardar (formato de sobre)"""
+        if self._raw is None:
+            claim_bytes = self.claim_bytes
+            if "signature" not in self:
+                self._raw = claim_bytes
+            elif claim_bytes == b"{}":
+                self._raw = b'{"signature":' + _dumps(self["signature"]) + b"}"
+            else:
+                self._raw = claim_bytes[:-1] + _SIGNATURE_MEMBER + _dumps(self["signature"]) + b"}"
+        return self._raw
+
+    def to_json(self) -> str:
+        return self.to_bytes().decode("utf-8")
+
+    # Los cambios de primer nivel invalidan los bytes memoizados
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.invalidate()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self.invalidate()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.invalidate()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.invalidate()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self.invalidate()
+        return result
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self.invalidate()
+        return result
+
+    def clear(self):
+        super().clear()
+        self.invalidate()
@@ -0,0 +1,486 @@
+"""
+Firma y verificación criptográfica de manifests C2PA con `cryptography`.
+
+La clave privada (C2PA_PRIVATE_KEY) y el certificado (C2PA_CERTIFICATE) se
+leen y parsean una sola vez por proceso; las firmas posteriores reutilizan
+el objeto de clave. Si el archivo cambia en disco se vuelve a cargar.
+
+Al verificar, cada cadena de certificados distinta se valida una sola vez
+(caché por huella SHA-256) y solo se comprueba la firma de cada manifest.
+Las anclas de confianza opcionales se leen de C2PA_TRUST_ANCHORS (PEM).
+
+Sin certificado (solo C2PA_PRIVATE_KEY) la firma lleva la clave pública
+(SubjectPublicKeyInfo): se puede verificar, pero nunca es de confianza.
+
+El resultado de verificar lleva un "status": "verified" (firma correcta y
+de confianza), "untrusted" (firma correcta sin ancla de confianza) o
+"invalid". "valid" solo es True en el primer caso.
+
+Algoritmos:
+    PS256  RSA-PSS con SHA-256 (claves RSA)
+    ES256  ECDSA P-256 con SHA-256 (claves EC), firma en formato r||s
+
+Uso:
+    python c2pa_signing.py --bench [-n 500]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import hashlib
+import threading
+import statistics
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+
+from c2pa_manifest import CANONICALIZATION, C2PAManifest
+
+# Curvas EC soportadas -> (algoritmo, hash, bytes por coordenada)
+_EC_ALGORITHMS = {
+    "secp256r1": ("ES256", hashes.SHA256, 32),
+    "secp384r1": ("ES384", hashes.SHA384, 48),
+}
+_EC_BY_ALGORITHM = {alg: (curve, hash_cls, size) for curve, (alg, hash_cls, size) in _EC_ALGORITHMS.items()}
+
+# Cadenas de certificados ya validadas, por huella (ver _validated_chain)
+_MAX_CACHED_CHAINS = 1024
+
+
+class ManifestSigner:
+    """Clave privada ya parseada más su cadena de certificados"""
+
+    def __init__(self, private_key, certificates: List[x509.Certificate] = None, key_name: str = None):
+        self.private_key = private_key
+        self.certificates = certificates or []
+        self.key_name = key_name
+
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            self.algorithm = "PS256"
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey):
+            if private_key.curve.name not in _EC_ALGORITHMS:
+                raise ValueError(f"Curva EC no soportada: {private_key.curve.name}")
+            self.algorithm = _EC_ALGORITHMS[private_key.curve.name][0]
+        else:
+            raise ValueError(f"Tipo de clave no soportado: {type(private_key).__name__}")
+
+        if self.certificates and not _same_public_key(self.certificates[0].public_key(), private_key.public_key()):
+            raise ValueError("El certificado no corresponde a la clave privada")
+
+        # La cadena se serializa una vez: es igual en todas las firmas
+        self._chain_b64 = [
+            base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode("ascii")
+            for cert in self.certificates
+        ]
+        self._public_key_b64 = base64.b64encode(_public_key_der(private_key.public_key())).decode("ascii")
+
+    def sign(self, data: bytes) -> bytes:
+        """Firma `data` con el algoritmo de la clave"""
+        if self.algorithm == "PS256":
+            return self.private_key.sign(
+                data,
+                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=32),
+                hashes.SHA256(),
+            )
+        _, hash_cls, size = _EC_ALGORITHMS[self.private_key.curve.name]
+        r, s = decode_dss_signature(self.private_key.sign(data, ec.ECDSA(hash_cls())))
+        return r.to_bytes(size, "big") + s.to_bytes(size, "big")
+
+    def sign_manifest(self, manifest: Dict[str, Any]) -> C2PAManifest:
+        """Devuelve una copia del manifest con el miembro "signature" firmado"""
+        manifest = C2PAManifest.coerce(manifest)
+        signature = {
+            "type": "C2PA",
+            "signed": True,
+            "algorithm": self.algorithm,
+            "canonicalization": CANONICALIZATION,
+            "value": base64.b64encode(self.sign(manifest.claim_bytes)).decode("ascii"),
+        }
+        if self.key_name:
+            signature["key_used"] = self.key_name
+        if self._chain_b64:
+            signature["certificate_chain"] = list(self._chain_b64)
+        else:
+            # Sin certificado: la clave pública permite verificar la firma
+            signature["public_key"] = self._public_key_b64
+        return manifest.with_signature(signature)
+
+
+def _public_key_der(public_key) -> bytes:
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def _same_public_key(a, b) -> bool:
+    return _public_key_der(a) == _public_key_der(b)
+
+
+def _mtime_ns(path: Optional[str]) -> int:
+    if not path:
+        return 0
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _read_certificates(cert_path: str) -> List[x509.Certificate]:
+    with open(cert_path, "rb") as f:
+        data = f.read()
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_certificates(data)
+    return [x509.load_der_x509_certificate(data)]
+
+
+def _read_private_key(key_path: str):
+    with open(key_path, "rb") as f:
+        data = f.read()
+    password = os.getenv("C2PA_PRIVATE_KEY_PASSWORD")
+    password = password.encode() if password else None
+    if b"-----BEGIN" in data:
+        return serialization.load_pem_private_key(data, password=password)
+    return serialization.load_der_private_key(data, password=password)
+
+
+@lru_cache(maxsize=8)
+def _load_signer_cached(key_path: str, cert_path: Optional[str], key_mtime: int, cert_mtime: int) -> ManifestSigner:
+    # mtime forma parte de la clave: rotar la clave en disco invalida la caché
+    certificates = _read_certificates(cert_path) if cert_path and os.path.exists(cert_path) else []
+    return ManifestSigner(_read_private_key(key_path), certificates, os.path.basename(key_path))
+
+
+def load_signer(key_path: str, cert_path: str = None) -> ManifestSigner:
+    """
+    Devuelve el firmante para `key_path` (y su certificado), parseando los
+    archivos solo la primera vez o cuando cambian en disco.
+    """
+    key_path = os.path.abspath(key_path)
+    cert_path = os.path.abspath(cert_path) if cert_path else None
+    return _load_signer_cached(key_path, cert_path, _mtime_ns(key_path), _mtime_ns(cert_path))
+
+
+# --- Verificación --------------------------------------------------------------
+
+SIGNATURE_VERIFIED = "verified"
+SIGNATURE_UNTRUSTED = "untrusted"
+SIGNATURE_INVALID = "invalid"
+
+class _ChainInfo:
+    """Resultado (cacheado) de validar una cadena de certificados"""
+
+    __slots__ = ("public_key", "subject", "not_before", "not_after", "trusted", "error")
+
+    def __init__(self, public_key=None, subject=None, not_before=None, not_after=None, trusted=False, error=None):
+        self.public_key = public_key
+        self.subject = subject
+        self.not_before = not_before
+        self.not_after = not_after
+        self.trusted = trusted
+        self.error = error
+
+
+_chain_cache: Dict[tuple, _ChainInfo] = {}
+_chain_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4)
+def _load_trust_anchors(path: str, mtime: int) -> tuple:
+    return tuple(_read_certificates(path))
+
+
+def _trust_anchors() -> tuple:
+    """(anclas, clave de versión) según C2PA_TRUST_ANCHORS; ((), None) si no hay"""
+    path = os.getenv("C2PA_TRUST_ANCHORS")
+    if not path or not os.path.exists(path):
+        return (), None
+    path = os.path.abspath(path)
+    version = (path, _mtime_ns(path))
+    return _load_trust_anchors(*version), version
+
+
+def _issued_by(cert: x509.Certificate, issuer: x509.Certificate) -> bool:
+    try:
+        cert.verify_directly_issued_by(issuer)
+        return True
+    except (ValueError, TypeError, InvalidSignature):
+        return False
+
+
+def _extension(cert: x509.Certificate, extension_class):
+    try:
+        return cert.extensions.get_extension_for_class(extension_class).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+def _issuer_error(issuer: x509.Certificate, intermediates_below: int) -> Optional[str]:
+    """Motivo por el que `issuer` no puede emitir el certificado de debajo, o None"""
+    name = issuer.subject.rfc4514_string()
+    constraints = _extension(issuer, x509.BasicConstraints)
+    if constraints is None or not constraints.ca:
+        return f"{name} no es una CA (BasicConstraints ca=True) y no puede emitir certificados"
+    if constraints.path_length is not None and intermediates_below > constraints.path_length:
+        return f"{name} no admite {intermediates_below} CA intermedias (pathLen={constraints.path_length})"
+    key_usage = _extension(issuer, x509.KeyUsage)
+    if key_usage is None or not key_usage.key_cert_sign:
+        return f"{name} no tiene el uso de clave keyCertSign"
+    return None
+
+
+def _check_chain(chain_der: List[bytes], anchors: tuple) -> _ChainInfo:
+    try:
+        certs = [x509.load_der_x509_certificate(der) for der in chain_der]
+    except ValueError as e:
+        return _ChainInfo(error=f"Certificado inválido: {e}")
+
+    # El certificado firmante debe admitir firmas digitales
+    key_usage = _extension(certs[0], x509.KeyUsage)
+    if key_usage is not None and not key_usage.digital_signature:
+        return _ChainInfo(error=f"{certs[0].subject.rfc4514_string()} no tiene el uso de clave digitalSignature")
+
+    # Cada certificado debe estar emitido por el siguiente de la cadena, y
+    # cada emisor debe ser una CA que respete su longitud de ruta
+    for position, (cert, issuer) in enumerate(zip(certs, certs[1:])):
+        if not _issued_by(cert, issuer):
+            return _ChainInfo(error=f"Cadena rota: {cert.subject.rfc4514_string()} no está emitido por {issuer.subject.rfc4514_string()}")
+        error = _issuer_error(issuer, position)
+        if error:
+            return _ChainInfo(error=error)
+
+    last = certs[-1]
+    trusted = False
+    for anchor in anchors:
+        if last == anchor:
+            trusted = True
+        elif _issued_by(last, anchor):
+            # El ancla emite el último certificado: también es un emisor
+            error = _issuer_error(anchor, len(certs) - 1)
+            if error:
+                return _ChainInfo(error=error)
+            trusted = True
+        if trusted:
+            break
+    if anchors and not trusted:
+        return _ChainInfo(error="La cadena no termina en un ancla de confianza")
+
+    return _ChainInfo(
+        public_key=certs[0].public_key(),
+        subject=certs[0].subject.rfc4514_string(),
+        not_before=max(c.not_valid_before_utc for c in certs),
+        not_after=min(c.not_valid_after_utc for c in certs),
+        trusted=trusted,
+    )
+
+
+def _validated_chain(chain_b64: List[str]) -> _ChainInfo:
+    """
+    Valida la cadena una sola vez por huella; las siguientes imágenes con el
+    mismo certificado solo pagan el hash de la cadena y un acceso al dict.
+    """
+    chain_der = [base64.b64decode(c) for c in chain_b64]
+    anchors, anchors_version = _trust_anchors()
+    fingerprint = hashlib.sha256(b"".join(chain_der)).hexdigest()
+    key = (fingerprint, anchors_version)
+    with _chain_lock:
+        info = _chain_cache.get(key)
+    if info is None:
+        info = _check_chain(chain_der, anchors)
+        with _chain_lock:
+            if len(_chain_cache) >= _MAX_CACHED_CHAINS:
+                _chain_cache.clear()
+            _chain_cache[key] = info
+    return info
+
+
+@lru_cache(maxsize=256)
+def _load_public_key(public_key_b64: str) -> tuple:
+    """(clave, descripción del firmante) de una firma sin certificado"""
+    der = base64.b64decode(public_key_b64)
+    public_key = serialization.load_der_public_key(der)
+    return public_key, f"Clave sin certificado (sha256:{hashlib.sha256(der).hexdigest()[:16]})"
+
+
+def _verify_raw(public_key, algorithm: str, signature: bytes, data: bytes) -> None:
+    """Comprueba la firma; lanza InvalidSignature/ValueError si no es válida"""
+    if algorithm == "PS256":
+        if not isinstance(public_key, rsa.RSAPublicKey):
+            raise ValueError("PS256 requiere una clave RSA")
+        public_key.verify(
+            signature,
+            data,
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=32),
+            hashes.SHA256(),
+        )
+        return
+    if algorithm not in _EC_BY_ALGORITHM:
+        raise ValueError(f"Algoritmo no soportado: {algorithm}")
+    curve, hash_cls, size = _EC_BY_ALGORITHM[algorithm]
+    if not isinstance(public_key, ec.EllipticCurvePublicKey) or public_key.curve.name != curve:
+        raise ValueError(f"{algorithm} requiere una clave EC {curve}")
+    if len(signature) != 2 * size:
+        raise InvalidSignature()
+    r = int.from_bytes(signature[:size], "big")
+    s = int.from_bytes(signature[size:], "big")
+    public_key.verify(encode_dss_signature(r, s), data, ec.ECDSA(hash_cls()))
+
+
+def verify_manifest_signature(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Verifica la firma PS256/ES256 de un manifest contra el certificado que
+    la acompaña (o, sin certificado, contra su clave pública). "trusted"
+    indica si la cadena termina en un ancla de C2PA_TRUST_ANCHORS (si hay
+    anclas configuradas, es obligatorio); una clave suelta nunca lo es.
+
+    "status" es SIGNATURE_VERIFIED, SIGNATURE_UNTRUSTED o SIGNATURE_INVALID;
+    "valid" solo es True para una firma correcta y de confianza.
+    """
+    signature = manifest.get("signature") or {}
+    value = signature.get("value")
+    chain = signature.get("certificate_chain")
+    if not value:
+        return _invalid("Firma C2PA sin valor")
+    if not chain and not signature.get("public_key"):
+        return _invalid("Firma C2PA sin certificado ni clave pública")
+    if signature.get("canonicalization", CANONICALIZATION) != CANONICALIZATION:
+        return _invalid(f"Canonicalización desconocida: {signature.get('canonicalization')}")
+
+    if chain:
+        try:
+            info = _validated_chain(chain)
+        except ValueError as e:
+            return _invalid(f"Certificado inválido: {e}")
+        if info.error:
+            return _invalid(info.error)
+
+        now = datetime.now(timezone.utc)
+        if not info.not_before <= now <= info.not_after:
+            return _invalid("Certificado fuera de su periodo de validez")
+        public_key, signer, trusted = info.public_key, info.subject, info.trusted
+        untrusted_reason = "La cadena de certificados no termina en un ancla de confianza (C2PA_TRUST_ANCHORS)"
+    else:
+        try:
+            public_key, signer = _load_public_key(signature["public_key"])
+        except ValueError as e:
+            return _invalid(f"Clave pública inválida: {e}")
+        trusted = False
+        untrusted_reason = "Firma con una clave sin certificado"
+
+    algorithm = signature.get("algorithm", "")
+    try:
+        _verify_raw(public_key, algorithm, base64.b64decode(value), C2PAManifest.coerce(manifest).signed_bytes)
+    except InvalidSignature:
+        return _invalid("La firma no coincide con el manifest")
+    except ValueError as e:
+        return _invalid(str(e))
+
+    result = {
+        "valid": trusted,
+        "status": SIGNATURE_VERIFIED if trusted else SIGNATURE_UNTRUSTED,
+        "algorithm": algorithm,
+        "signer": signer,
+        "trusted": trusted,
+    }
+    if not trusted:
+        result["reason"] = untrusted_reason
+    return result
+
+
+def _invalid(reason: str) -> Dict[str, Any]:
+    return {"valid": False, "status": SIGNATURE_INVALID, "reason": reason}
+
+
+# --- Benchmark ---------------------------------------------------------------
+
+def _sample_manifest() -> Dict[str, Any]:
+    return {
+        "claim_generator": "PMC-Detector/1.0",
+        "title": "AI Generated Image",
+        "format": "image/png",
+        "instance_id": "xmp:iid:" + "0" * 64,
+        "assertions": [
+            {"label": "c2pa.actions", "data": {"actions": [{"action": "c2pa.created"}]}},
+            {"label": "stds.schema-org.CreativeWork", "data": {"author": [{"name": "Bench"}]}},
+        ],
+    }
+
+
+def _time_us(fn, iterations: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.fmean(samples), 1),
+        "p50_us": round(samples[len(samples) // 2], 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+    }
+
+
+def _bench_key(label: str, private_key, key_pem: bytes, iterations: int, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    signer = ManifestSigner(private_key, key_name=label)
+    return {
+        "algorithm": signer.algorithm,
+        # Coste que antes se pagaba en cada llamada: parsear la clave
+        "key_load": _time_us(lambda: serialization.load_pem_private_key(key_pem, password=None), max(1, iterations // 10)),
+        "sign": _time_us(lambda: signer.sign_manifest(manifest), iterations),
+    }
+
+
+def run_benchmark(iterations: int = 500) -> Dict[str, Any]:
+    """Mide el coste por firma (y el de cargar la clave) para PS256 y ES256"""
+    manifest = _sample_manifest()
+    results = {
+        "iterations": iterations,
+        "canonicalize": _time_us(lambda: C2PAManifest(manifest).claim_bytes, iterations),
+    }
+
+    key_path = os.getenv("C2PA_PRIVATE_KEY")
+    if key_path and os.path.exists(key_path):
+        cert_path = os.getenv("C2PA_CERTIFICATE")
+        load_signer(key_path, cert_path)
+        signer = load_signer(key_path, cert_path)
+        results["configured"] = {
+            "algorithm": signer.algorithm,
+            "cached_load": _time_us(lambda: load_signer(key_path, cert_path), iterations),
+            "sign": _time_us(lambda: signer.sign_manifest(manifest), iterations),
+        }
+
+    pem = serialization.PrivateFormat.PKCS8
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    for label, key in (("rsa-2048", rsa_key), ("ec-p256", ec_key)):
+        key_pem = key.private_bytes(serialization.Encoding.PEM, pem, serialization.NoEncryption())
+        results[label] = _bench_key(label, key, key_pem, iterations, manifest)
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Firma C2PA (PS256/ES256)")
+    parser.add_argument("--bench", action="store_true", help="Mide el coste por firma")
+    parser.add_argument("-n", "--iterations", type=int, default=500, help="Firmas por algoritmo")
+    args = parser.parse_args(argv)
+
+    if not args.bench:
+        parser.print_help()
+        return 1
+
+    results = run_benchmark(args.iterations)
+    print(json.dumps(results, indent=2))
+    for label in ("configured", "rsa-2048", "ec-p256"):
+        if label in results:
+            entry = results[label]
+            print(f"✓ {label} ({entry['algorithm']}): {entry['sign']['p50_us']} µs/firma (p50)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
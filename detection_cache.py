@@ -0,0 +1,255 @@
+"""
+Caché de resultados de detección.
+
+Las entradas se indexan por el SHA-256 del contenido (subidas en memoria)
+o por ruta+mtime+tamaño (archivos locales), con un nivel en memoria LRU con
+TTL y un nivel persistente opcional en SQLite. Las claves llevan además la
+generación del almacén de manifests SQLite y del índice pHash: al marcar
+una imagen, un "none" cacheado deja de valer sin esperar al TTL.
+
+Configuración por variables de entorno:
+    PMC_CACHE_SIZE  Entradas máximas en memoria (por defecto 1024, 0 = desactivada)
+    PMC_CACHE_TTL   Segundos de validez de cada entrada (por defecto 300)
+    PMC_CACHE_DB    Ruta del archivo SQLite para el nivel persistente (opcional)
+"""
+import os
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import metrics
+from detection_utils import ImageSource, detect_image_status_c2pa, manifest_path_for
+from manifest_store import get_manifest_store
+from phash_index import get_default_index
+
+
+class DetectionCache:
+    """Caché LRU con TTL y nivel persistente opcional en SQLite"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, disk_path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._disk_hits = 0
+        self._evictions = 0
+        self.disk_path = disk_path
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """
+        Conexión SQLite del nivel persistente, abierta de forma perezosa y
+        reabierta tras un fork (las conexiones no deben cruzar procesos).
+        """
+        if not self.disk_path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS detection_cache "
+                "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or bool(self.disk_path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve una copia superficial del resultado cacheado, o None. Los
+        valores anidados se comparten con la caché: no deben modificarse.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return dict(result)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, result FROM detection_cache WHERE key = ?", (key,)
+                ).fetchone()
+                # El nivel persistente usa tiempo de pared (sobrevive reinicios)
+                if row is not None and time.time() - row[0] <= self.ttl:
+                    result = json.loads(row[1])
+                    self._disk_hits += 1
+                    self._hits += 1
+                    self._store_memory(key, result, now)
+                    return dict(result)
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """Guarda una copia del resultado"""
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._store_memory(key, result, time.monotonic())
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO detection_cache (key, stored_at, result) VALUES (?, ?, ?)",
+                    (key, time.time(), json.dumps(result, ensure_ascii=False, default=str))
+                )
+                self._db.commit()
+
+    def _store_memory(self, key: str, result: Dict[str, Any], now: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (now, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+            metrics.inc("pmc_cache_evictions_total")
+        metrics.set_gauge("pmc_cache_entries", len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            metrics.set_gauge("pmc_cache_entries", 0)
+            if self._db is not None:
+                self._db.execute("DELETE FROM detection_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos de la caché"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "disk_hits": self._disk_hits,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self.disk_path),
+            }
+
+
+def content_cache_key(data: bytes) -> str:
+    """Clave de caché a partir del contenido de la imagen"""
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def file_cache_key(image_path: str) -> Optional[str]:
+    """
+    Clave de caché a partir de ruta, mtime y tamaño. Incluye el estado del
+    sidecar, ya que también influye en el resultado. None si no existe.
+    """
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    try:
+        sidecar = os.stat(manifest_path_for(image_path)).st_mtime_ns
+    except OSError:
+        sidecar = 0
+    return f"stat:{os.path.abspath(image_path)}:{st.st_mtime_ns}:{st.st_size}:{sidecar}"
+
+
+def _db_generation(db_path: str) -> str:
+    """
+    Cambia con cada escritura en una base SQLite en modo WAL: las
+    transacciones van al -wal y los checkpoints a la base.
+    """
+    parts = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns}.{st.st_size}")
+        except OSError:
+            parts.append("0")
+    return "-".join(parts)
+
+
+def stores_generation() -> str:
+    """
+    Estado de los almacenes que deciden una detección además de la propia
+    imagen: el almacén de manifests SQLite y el índice pHash (el sidecar ya
+    va en la clave de archivo). Vacío si ninguno está configurado.
+    """
+    parts = []
+    store = get_manifest_store()
+    if getattr(store, "db_path", None):
+        parts.append(_db_generation(store.db_path))
+    index = get_default_index()
+    if index is not None:
+        parts.append(_db_generation(index.db_path))
+    return ":".join(parts)
+
+
+def _cache_from_env() -> DetectionCache:
+    return DetectionCache(
+        max_entries=int(os.getenv("PMC_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("PMC_CACHE_TTL", "300")),
+        disk_path=os.getenv("PMC_CACHE_DB") or None,
+    )
+
+
+default_cache = _cache_from_env()
+
+
+def detect_cached(
+    source: ImageSource,
+    name: str = None,
+    cache: DetectionCache = None,
+    detail: str = "full"
+) -> Dict[str, Any]:
+    """
+    detect_image_status_c2pa con caché delante. Para imágenes en memoria
+    (bytes) la clave es su SHA-256; para rutas, ruta+mtime+tamaño. En ambos
+    casos se añade la generación de los almacenes (stores_generation). Cada
+    nivel de detalle se cachea aparte, así un acierto de "summary" solo
+    copia el resultado reducido.
+    """
+    cache = cache or default_cache
+    if not cache.enabled:
+        return detect_image_status_c2pa(source, name, detail)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        with metrics.stage("cache_key"):
+            key = content_cache_key(source)
+        name = name or "upload"
+    elif isinstance(source, (str, os.PathLike)):
+        key = file_cache_key(source)
+        name = name or os.path.basename(source)
+    else:
+        key = None
+    if key is None:
+        return detect_image_status_c2pa(source, name, detail)
+    generation = stores_generation()
+    if generation:
+        key = f"{key}@{generation}"
+    if detail != "full":
+        # Las claves de "full" no cambian: siguen valiendo las ya persistidas
+        key = f"{key}|{detail}"
+
+    with metrics.stage("cache_lookup"):
+        result = cache.get(key)
+    metrics.inc("pmc_cache_lookups_total", result="miss" if result is None else "hit")
+    if result is None:
+        result = detect_image_status_c2pa(source, name, detail)
+        cache.put(key, result)
+    # El mismo contenido puede llegar con otro nombre
+    result["image"] = name
+    return result
@@ -1,12 +1,35 @@
 import os
+import io
 import json
-from typing import Dict, Any
-from PIL import Image, PngImagePlugin
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, BinaryIO, Iterator, List, Optional, Sequence, Tuple, Union
+from PIL import Image
 from PIL.ExifTags import TAGS
 from datetime import datetime, timezone
 import hashlib
 import base64
 
+from image_container import (
+    EXIF_HEADER,
+    probe_image_header,
+    scan_image_header,
+    sniff_format,
+    parse_exif_ifd0,
+    png_set_text,
+    jpeg_set_exif,
+    read_jpeg_exif,
+    png_embed_chunks,
+    jpeg_embed_jumbf,
+    PNG_JUMBF_CHUNK,
+)
+from phash_index import compute_phash, get_default_index
+from provenance_search import get_search_index, index_path
+from jumbf import build_manifest_store, find_manifest_store, is_manifest_store, read_manifest_store
+from c2pa_manifest import CANONICALIZATION, C2PAManifest, legacy_manifest_bytes
+import metrics
+from manifest_store import atomic_write_bytes, get_manifest_store, manifest_path_for, sidecar_bytes
+
 # Intentar importar c2pa
 try:
     import c2pa
@@ -14,145 +37,432 @@ try:
 except ImportError:
     C2PA_AVAILABLE = False
 
+# Firma real PS256/ES256 (requiere cryptography)
+try:
+    from c2pa_signing import SIGNATURE_INVALID, SIGNATURE_UNTRUSTED, load_signer, verify_manifest_signature
+    SIGNING_AVAILABLE = True
+except ImportError:
+    SIGNING_AVAILABLE = False
+    SIGNATURE_INVALID, SIGNATURE_UNTRUSTED = "invalid", "untrusted"
+
 # Configuración de clave privada C2PA
 C2PA_PRIVATE_KEY = os.getenv("C2PA_PRIVATE_KEY", None)  # Ruta al archivo .pem
 C2PA_CERTIFICATE = os.getenv("C2PA_CERTIFICATE", None)  # Ruta al certificado .crt
 
+# Tamaño de bloque para hashear imágenes sin cargarlas enteras en memoria
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Generador que figura en los manifests creados aquí
+CLAIM_GENERATOR = "PMC-C2PA/1.0"
+
+# Aserción de enlace duro (hash del contenido excluyendo el manifest)
+HASH_ASSERTION_LABEL = "c2pa.hash.data"
+
+# Rondas máximas para fijar el rango de exclusión (normalmente bastan 2)
+_MAX_BINDING_ROUNDS = 4
+
+# Una imagen puede llegar como ruta, bytes en memoria o stream abierto
+# Fallos no fatales (índices auxiliares); sin configurar, los WARNING van a stderr
+index_log = logging.getLogger("pmc.detection")
 
-def get_image_format(image_path: str) -> str:
+ImageSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+# Tag EXIF UserComment, donde se guarda el manifest en JPEG
+EXIF_USER_COMMENT = next(tag_id for tag_id, name in TAGS.items() if name == "UserComment")
+
+# Niveles de detalle del resultado de detección, de menor a mayor
+DETAIL_LEVELS = ("summary", "assertions", "full")
+
+# Campos que conserva el nivel "summary" (tamaño acotado)
+_SUMMARY_DETAILS = ("model", "AI-Model", "created_date", "claim_generator")
+_SUMMARY_C2PA_INFO = ("valid", "status", "signature_type", "hash_binding", "trusted")
+
+
+@contextmanager
+def open_image_source(source: ImageSource) -> Iterator[BinaryIO]:
+    """
+    Abre una imagen dada como ruta, bytes en memoria o stream binario y
+    entrega un stream posicionado al inicio. Los streams ajenos no se cierran.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    else:
+        source.seek(0)
+        yield source
+
+
+def get_image_format(image_path: ImageSource) -> str:
     """Detecta el formato de la imagen"""
     try:
-        with Image.open(image_path) as img:
-            return img.format.lower() if img.format else "unknown"
+        with open_image_source(image_path) as f:
+            img_format = sniff_format(f.read(16))
+            if img_format != "unknown":
+                return img_format
+            # Formatos sin firma conocida: delegar en Pillow
+            f.seek(0)
+            with Image.open(f) as img:
+                return img.format.lower() if img.format else "unknown"
     except Exception:
         return "unknown"
 
 
-def read_image_metadata(image_path: str) -> Dict[str, Any]:
+class DetectionContext:
+    """
+    Abre la imagen una sola vez y cachea formato, info, EXIF y el manifest
+    parseado para que todas las etapas de detección los compartan.
+    """
+
+    def __init__(self, source: ImageSource, name: str = None):
+        self.source = source
+        # Solo las imágenes en disco tienen ruta (y por tanto sidecar)
+        self.image_path = source if isinstance(source, (str, os.PathLike)) else None
+        if self.image_path is not None:
+            self.exists = os.path.exists(self.image_path)
+            self.name = name or os.path.basename(self.image_path)
+        else:
+            self.exists = True
+            self.name = name or "upload"
+        self._probe = None
+        self._probed = False
+        self._loaded = False
+        self._format = "unknown"
+        self._info: Dict[str, Any] = {}
+        self._exif: Dict[int, Any] = {}
+        self._jumbf = []
+        self._metadata = None
+        self._manifest = None
+        self._manifest_error = None
+        self._manifest_parsed = False
+
+    def _run_probe(self) -> Optional[Dict[str, Any]]:
+        if not self._probed:
+            self._probed = True
+            if self.exists:
+                try:
+                    with metrics.stage("probe"), open_image_source(self.source) as f:
+                        self._probe = probe_image_header(f)
+                        metrics.inc("pmc_bytes_read_total", f.tell(), stage="header")
+                except OSError:
+                    pass
+        return self._probe
+
+    @property
+    def marked(self) -> bool:
+        """
+        False solo si la cabecera no tiene ninguna marca de IA/C2PA, según
+        una lectura acotada sin parsear EXIF, texto ni manifests.
+        """
+        probe = self._run_probe()
+        return probe is None or probe["marked"]
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.exists:
+            return
+        probe = self._run_probe()
+        try:
+            with metrics.stage("header_scan"):
+                if probe is not None and probe["header"] is not None:
+                    # La sonda ya leyó la cabecera completa: no volver al archivo
+                    header = scan_image_header(io.BytesIO(probe["header"]))
+                else:
+                    with open_image_source(self.source) as f:
+                        header = scan_image_header(f)
+                        metrics.inc("pmc_bytes_read_total", f.tell(), stage="header")
+        except OSError:
+            return
+        self._format = header["format"]
+        if self._format == "unknown":
+            self._format = get_image_format(self.source)
+        self._info = header["text"]
+        self._jumbf = header["jumbf"]
+        if header["exif"]:
+            with metrics.stage("exif"):
+                self._exif = parse_exif_ifd0(header["exif"])
+
+    @property
+    def format(self) -> str:
+        probe = self._run_probe()
+        if probe is not None and probe["format"] != "unknown" and not self._loaded:
+            return probe["format"]
+        self._load()
+        return self._format
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        self._load()
+        return self._info
+
+    @property
+    def exif(self) -> Dict[int, Any]:
+        self._load()
+        return self._exif
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Metadatos con la misma forma que devuelve read_image_metadata"""
+        if self._metadata is None:
+            if self.format == "png":
+                self._metadata = _png_metadata_from_info(self.info)
+            elif self.format in ["jpeg", "jpg"]:
+                self._metadata = _jpeg_metadata_from_exif(self.exif)
+            else:
+                self._metadata = {}
+        return self._metadata
+
+    @property
+    def manifest(self) -> Any:
+        """Manifest C2PA incrustado ya parseado (None si no hay o es inválido)"""
+        if not self._manifest_parsed:
+            self._manifest_parsed = True
+            self._load()
+            with metrics.stage("manifest_parse"):
+                self._parse_manifest()
+        return self._manifest
+
+    def _parse_manifest(self) -> None:
+        # Almacén JUMBF (APP11/caBX); si no hay, el formato de texto antiguo
+        store = find_manifest_store(self._jumbf)
+        if store is not None:
+            try:
+                self._manifest = C2PAManifest(read_manifest_store(store))
+            except (ValueError, TypeError, UnicodeDecodeError):
+                self._manifest_error = "Invalid JUMBF C2PA manifest store"
+            return
+        manifest_str = self.metadata.get("C2PA-Manifest", "")
+        if manifest_str:
+            try:
+                self._manifest = C2PAManifest.from_json(manifest_str)
+            except ValueError:
+                self._manifest_error = "Invalid JSON in C2PA manifest"
+
+    @property
+    def manifest_error(self) -> Any:
+        self.manifest
+        return self._manifest_error
+
+
+def read_image_metadata(image_path: ImageSource) -> Dict[str, Any]:
     """Lee metadatos de una imagen (PNG o JPEG)"""
-    img_format = get_image_format(image_path)
-    
-    if img_format == "png":
-        return read_png_metadata(image_path)
-    elif img_format in ["jpeg", "jpg"]:
-        return read_jpeg_metadata(image_path)
-    else:
-        return {}
+    return DetectionContext(image_path).metadata
 
 
-def read_png_metadata(image_path: str) -> Dict[str, Any]:
+def read_png_metadata(image_path: ImageSource) -> Dict[str, Any]:
     """Lee metadatos tEXt/iTXt de un PNG"""
     try:
-        with Image.open(image_path) as img:
-            info = img.info or {}
-            return {str(k): (str(v) if not isinstance(v, str) else v) for k, v in info.items()}
+        with open_image_source(image_path) as f:
+            header = scan_image_header(f)
+        return _png_metadata_from_info(header["text"])
     except Exception:
         return {}
 
 
-def read_jpeg_metadata(image_path: str) -> Dict[str, Any]:
+def read_jpeg_metadata(image_path: ImageSource) -> Dict[str, Any]:
     """Lee metadatos EXIF de un JPEG"""
     try:
-        with Image.open(image_path) as img:
-            exif_data = img.getexif()
-            if not exif_data:
-                return {}
-            
-            metadata = {}
-            for tag_id, value in exif_data.items():
-                tag = TAGS.get(tag_id, tag_id)
-                # Convertir bytes a string si es necesario
-                if isinstance(value, bytes):
-                    try:
-                        value = value.decode('utf-8', errors='ignore')
-                    except:
-                        value = str(value)
-                metadata[str(tag)] = str(value)
-            
-            # Buscar en UserComment que es donde guardamos C2PA
-            if 'UserComment' in metadata:
-                try:
-                    # Intentar parsear como JSON
-                    user_comment = metadata['UserComment']
-                    if user_comment.startswith('{'):
-                        c2pa_data = json.loads(user_comment)
-                        # Agregar el manifest completo como C2PA-Manifest
-                        metadata['C2PA-Manifest'] = user_comment
-                        metadata['C2PA-Version'] = '1.3'
-                        metadata['C2PA-Signed'] = 'true' if 'signature' in c2pa_data else 'false'
-                        # También expandir los campos del manifest
-                        metadata.update(c2pa_data)
-                except Exception as e:
-                    # Si falla el parseo, al menos mantener el UserComment
-                    pass
-            
-            # Verificar si ImageDescription tiene la marca de IA
-            if 'ImageDescription' in metadata:
-                img_desc = metadata['ImageDescription']
-                if 'AI-Generated' in img_desc and 'true' in img_desc:
-                    metadata['AI-Generated'] = 'true'
-            
-            return metadata
+        with open_image_source(image_path) as f:
+            header = scan_image_header(f)
+        if not header["exif"]:
+            return {}
+        return _jpeg_metadata_from_exif(parse_exif_ifd0(header["exif"]))
     except Exception:
         return {}
 
 
-def manifest_path_for(image_path: str) -> str:
-    """Retorna la ruta del manifest sidecar para una imagen"""
-    base, _ = os.path.splitext(image_path)
-    return f"{base}_manifest.json"
+def _png_metadata_from_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte img.info de un PNG en un dict plano de strings"""
+    return {str(k): (str(v) if not isinstance(v, str) else v) for k, v in info.items()}
 
 
-def verify_c2pa_manifest(image_path: str) -> Dict[str, Any]:
+def _jpeg_metadata_from_exif(exif_data: Dict[int, Any]) -> Dict[str, Any]:
+    """Convierte los tags EXIF de un JPEG en un dict plano"""
+    if not exif_data:
+        return {}
+    
+    metadata = {}
+    for tag_id, value in exif_data.items():
+        tag = TAGS.get(tag_id, tag_id)
+        # Convertir bytes a string si es necesario
+        if isinstance(value, bytes):
+            try:
+                value = value.decode('utf-8', errors='ignore')
+            except:
+                value = str(value)
+        metadata[str(tag)] = str(value)
+    
+    # Buscar en UserComment que es donde guardamos C2PA
+    if 'UserComment' in metadata:
+        try:
+            # Intentar parsear como JSON
+            user_comment = metadata['UserComment']
+            if user_comment.startswith('{'):
+                c2pa_data = json.loads(user_comment)
+                # Agregar el manifest completo como C2PA-Manifest
+                metadata['C2PA-Manifest'] = user_comment
+                metadata['C2PA-Version'] = '1.3'
+                metadata['C2PA-Signed'] = 'true' if 'signature' in c2pa_data else 'false'
+                # También expandir los campos del manifest
+                metadata.update(c2pa_data)
+        except Exception as e:
+            # Si falla el parseo, al menos mantener el UserComment
+            pass
+    
+    # Verificar si ImageDescription tiene la marca de IA
+    if 'ImageDescription' in metadata:
+        img_desc = metadata['ImageDescription']
+        if 'AI-Generated' in img_desc and 'true' in img_desc:
+            metadata['AI-Generated'] = 'true'
+    
+    return metadata
+
+
+def verify_c2pa_manifest(image_path: ImageSource, ctx: DetectionContext = None) -> Dict[str, Any]:
     """Verifica el manifest C2PA incrustado en la imagen (PNG o JPEG)"""
-    meta = read_image_metadata(image_path)
-    manifest_str = meta.get("C2PA-Manifest", "")
+    ctx = ctx or DetectionContext(image_path)
+    if not ctx.marked:
+        # La sonda no vio ninguna marca: no hay manifest que parsear
+        return {"valid": False, "reason": "No C2PA manifest found"}
+    manifest = ctx.manifest
     
-    if not manifest_str:
+    if manifest is None:
+        if ctx.manifest_error:
+            return {"valid": False, "reason": ctx.manifest_error}
         return {"valid": False, "reason": "No C2PA manifest found"}
     
     try:
-        manifest = json.loads(manifest_str)
         signature = manifest.get("signature", {})
         
         if signature.get("type") == "simulated":
-            # Verificar firma simulada
-            temp_manifest = {k: v for k, v in manifest.items() if k != "signature"}
-            expected_hash = hashlib.sha256(
-                json.dumps(temp_manifest, sort_keys=True, ensure_ascii=False).encode()
-            ).hexdigest()
-            
-            if signature.get("hash") == expected_hash:
-                return {
-                    "valid": True,
-                    "type": "simulated",
-                    "note": "Firma simulada verificada",
-                    "manifest": manifest
-                }
+            # Verificar firma simulada: sobre los bytes firmados o, en
+            # manifests antiguos, sobre el claim re-serializado
+            if signature.get("canonicalization") == CANONICALIZATION:
+                signed_bytes = manifest.signed_bytes
             else:
+                signed_bytes = legacy_manifest_bytes(manifest)
+            with metrics.stage("signature"):
+                expected_hash = hashlib.sha256(signed_bytes).hexdigest()
+            
+            if signature.get("hash") != expected_hash:
                 return {"valid": False, "reason": "Simulated signature mismatch"}
-        
-        elif C2PA_AVAILABLE and signature.get("type") == "C2PA":
-            return {
+            result = {
                 "valid": True,
+                "status": "simulated",
+                "type": "simulated",
+                "note": "Firma simulada verificada",
+            }
+        
+        elif signature.get("type") == "C2PA" and "value" in signature:
+            # Firma real: se comprueba contra la cadena de certificados. Una
+            # firma correcta sin ancla de confianza sigue siendo un manifest
+            # C2PA, pero con "valid" False y status "untrusted"
+            if not SIGNING_AVAILABLE:
+                return {"valid": False, "reason": "cryptography no disponible para verificar la firma"}
+            with metrics.stage("signature"):
+                signature_result = verify_manifest_signature(manifest)
+            if signature_result["status"] == SIGNATURE_INVALID:
+                return signature_result
+            result = {
+                "valid": signature_result["valid"],
+                "status": signature_result["status"],
                 "type": "C2PA",
-                "manifest": manifest
+                "algorithm": signature_result["algorithm"],
+                "signer": signature_result["signer"],
+                "trusted": signature_result["trusted"],
             }
+            if "reason" in signature_result:
+                result["note"] = signature_result["reason"]
         
-        return {"valid": False, "reason": "Unknown signature type"}
+        elif signature.get("type") == "C2PA":
+            # Marca antigua sin valor de firma: no hay nada que verificar
+            return {"valid": False, "reason": "C2PA signature without value"}
+        
+        else:
+            return {"valid": False, "reason": "Unknown signature type"}
+        
+        # Enlace duro: la imagen no debe haber cambiado desde la firma
+        with metrics.stage("hash_binding"):
+            binding = verify_hash_binding(ctx.source, manifest)
+        if binding is False:
+            return {
+                "valid": False,
+                "status": SIGNATURE_INVALID,
+                "reason": "Hash binding mismatch (image modified after signing)",
+                "hash_binding": "mismatch"
+            }
+        result["hash_binding"] = "verified" if binding else "unbound"
+        result["manifest"] = manifest
+        return result
         
-    except json.JSONDecodeError:
-        return {"valid": False, "reason": "Invalid JSON in C2PA manifest"}
     except Exception as e:
         return {"valid": False, "reason": f"Error: {str(e)}"}
 
 
-def detect_image_status_c2pa(image_path: str) -> dict:
-    """Detecta si una imagen fue generada por IA, con soporte C2PA completo (PNG y JPEG)"""
+def detect_image_status_c2pa(image_path: ImageSource, name: str = None, detail: str = "full") -> dict:
+    """
+    Detecta si una imagen fue generada por IA, con soporte C2PA completo (PNG y JPEG).
+    Acepta una ruta o la imagen en memoria (bytes o stream); `name` es el
+    nombre que se reporta en el resultado.
+
+    `detail` (ver DETAIL_LEVELS) decide qué se devuelve:
+      - "summary": veredicto, origen, modelo/fecha y estado de la firma
+      - "assertions": además los detalles completos y las assertions del
+        manifest (sin el resto de metadatos ni el manifest entero)
+      - "full": el manifest completo y todos los metadatos en "metadata"
+    """
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"Nivel de detalle desconocido: {detail} (opciones: {', '.join(DETAIL_LEVELS)})")
+    with metrics.stage("detect"):
+        result = _detect_image_status(image_path, name)
+    metrics.inc("pmc_detections_total", source=result["source"] or "missing")
+    return result if detail == "full" else _reduce_detail(result, detail)
+
+
+def _manifest_assertions(result: dict) -> List[Dict[str, Any]]:
+    """Assertions del manifest C2PA que decidió la detección (si lo hay)"""
+    if result["source"] == "c2pa_manifest":
+        manifest = result["metadata"]
+    elif result["source"] == "sidecar_manifest":
+        manifest = result["details"].get("c2pa_manifest")
+    else:
+        manifest = None
+    if not isinstance(manifest, dict):
+        return []
+    return list(manifest.get("assertions", []))
+
+
+def _reduce_detail(result: dict, detail: str) -> dict:
+    """
+    Resultado recortado al nivel pedido. No copia el manifest ni los
+    metadatos completos, que son la mayor parte del JSON de respuesta.
+    """
+    reduced = {k: result[k] for k in ("image", "exists", "format", "ai_generated", "source")}
+    details = result["details"] or {}
+    c2pa_info = result["c2pa_info"]
+    if detail == "summary":
+        reduced["details"] = {k: details[k] for k in _SUMMARY_DETAILS if k in details}
+        if c2pa_info is not None:
+            c2pa_info = {k: c2pa_info[k] for k in _SUMMARY_C2PA_INFO if k in c2pa_info}
+        reduced["c2pa_info"] = c2pa_info
+        return reduced
+    # "assertions": el sidecar lleva una copia del manifest firmado en sus
+    # detalles; sus assertions ya van aparte
+    reduced["details"] = {k: v for k, v in details.items() if k != "c2pa_manifest"}
+    reduced["c2pa_info"] = c2pa_info
+    reduced["assertions"] = _manifest_assertions(result)
+    return reduced
+
+
+def _detect_image_status(image_path: ImageSource, name: str = None) -> dict:
+    ctx = DetectionContext(image_path, name)
     result = {
-        "image": os.path.basename(image_path),
-        "exists": os.path.exists(image_path),
-        "format": get_image_format(image_path) if os.path.exists(image_path) else "unknown",
+        "image": ctx.name,
+        "exists": ctx.exists,
+        "format": ctx.format,
         "ai_generated": False,
         "source": None,
         "details": {},
@@ -163,42 +473,65 @@ def detect_image_status_c2pa(image_path: str) -> dict:
     if not result["exists"]:
         return result
 
+    # 1-2. Solo si la sonda vio alguna marca (C2PA o AI-Generated) en la
+    # cabecera; una imagen sin marcas pasa directamente al almacén y al pHash
+    if ctx.marked and _detect_embedded(image_path, ctx, result):
+        return result
+
+    # 3. Buscar el manifest en el almacén (sidecar, o SQLite por ruta y por
+    # hash). El almacén guarda el hash de la imagen ya marcada: si la sonda
+    # no vio marcas, ese hash no puede coincidir y no se calcula.
+    content_hash = (lambda: hash_image_source(ctx.source)) if ctx.marked else None
+    with metrics.stage("manifest_store"):
+        manifest = get_manifest_store().lookup(ctx.image_path, content_hash)
+    if manifest is not None:
+        if bool(manifest.get("ai_generated", False)):
+            result["ai_generated"] = True
+            result["source"] = "sidecar_manifest"
+            result["details"] = manifest
+            result["metadata"] = manifest
+            return result
+
+    # 4. Buscar por contenido visual (imágenes sin metadatos o recodificadas)
+    match = _phash_lookup(ctx)
+    if match is not None:
+        result["ai_generated"] = True
+        result["source"] = "phash_index"
+        result["details"] = match
+        return result
+
+    result["source"] = "none"
+    return result
+
+
+def _detect_embedded(image_path: ImageSource, ctx: DetectionContext, result: dict) -> bool:
+    """Etapas 1 (manifest C2PA) y 2 (metadatos básicos); True si deciden"""
     # 1. Verificar manifest C2PA primero
-    c2pa_result = verify_c2pa_manifest(image_path)
+    c2pa_result = verify_c2pa_manifest(image_path, ctx)
     
-    if c2pa_result.get("valid"):
+    if c2pa_result.get("valid") or c2pa_result.get("status") == SIGNATURE_UNTRUSTED:
         result["ai_generated"] = True
         result["source"] = "c2pa_manifest"
         result["c2pa_info"] = {
-            "valid": True,
+            "valid": c2pa_result["valid"],
+            "status": c2pa_result.get("status"),
             "signature_type": c2pa_result.get("type"),
             "note": c2pa_result.get("note", "")
         }
+        if "hash_binding" in c2pa_result:
+            result["c2pa_info"]["hash_binding"] = c2pa_result["hash_binding"]
+        if "signer" in c2pa_result:
+            result["c2pa_info"]["algorithm"] = c2pa_result["algorithm"]
+            result["c2pa_info"]["signer"] = c2pa_result["signer"]
+            result["c2pa_info"]["trusted"] = c2pa_result["trusted"]
         
         manifest = c2pa_result.get("manifest", {})
-        result["details"] = {
-            "title": manifest.get("title", "N/A"),
-            "format": manifest.get("format", "N/A"),
-            "claim_generator": manifest.get("claim_generator", "N/A")
-        }
-        
-        # Extraer información de IA de las assertions
-        for assertion in manifest.get("assertions", []):
-            if assertion.get("label") == "c2pa.actions":
-                actions = assertion.get("data", {}).get("actions", [])
-                for action in actions:
-                    if action.get("action") == "c2pa.created":
-                        params = action.get("parameters", {})
-                        result["details"]["model"] = action.get("softwareAgent", "N/A")
-                        result["details"]["prompt"] = params.get("prompt", "N/A")
-                        result["details"]["created_date"] = action.get("when", "N/A")
-                        result["details"]["ai_generated"] = params.get("ai_generated", False)
-        
+        result["details"] = _c2pa_details(manifest)
         result["metadata"] = manifest
-        return result
+        return True
 
     # 2. Comprobar metadatos básicos (PNG tEXt o JPEG EXIF)
-    meta = read_image_metadata(image_path)
+    meta = ctx.metadata
     ai_flag = str(meta.get("AI-Generated", "")).lower() == "true"
     
     if ai_flag:
@@ -206,43 +539,206 @@ def detect_image_status_c2pa(image_path: str) -> dict:
         result["source"] = f"{result['format']}_metadata"
         result["details"] = {k: v for k, v in meta.items() if k.startswith("AI-")}
         result["metadata"] = meta
-        return result
+        return True
+    return False
 
-    # 3. Buscar manifest sidecar
-    mpath = manifest_path_for(image_path)
-    if os.path.exists(mpath):
-        with open(mpath, "r", encoding="utf-8") as f:
-            manifest = json.load(f)
-        if bool(manifest.get("ai_generated", False)):
-            result["ai_generated"] = True
-            result["source"] = "sidecar_manifest"
-            result["details"] = manifest
-            result["metadata"] = manifest
-            return result
 
-    result["source"] = "none"
-    return result
+def _c2pa_details(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Claim y datos de IA (acción c2pa.created) de un manifest C2PA"""
+    details = {
+        "title": manifest.get("title", "N/A"),
+        "format": manifest.get("format", "N/A"),
+        "claim_generator": manifest.get("claim_generator", "N/A")
+    }
+    
+    # Extraer información de IA de las assertions
+    for assertion in manifest.get("assertions", []):
+        if assertion.get("label") == "c2pa.actions":
+            actions = assertion.get("data", {}).get("actions", [])
+            for action in actions:
+                if action.get("action") == "c2pa.created":
+                    params = action.get("parameters", {})
+                    details["model"] = action.get("softwareAgent", "N/A")
+                    details["prompt"] = params.get("prompt", "N/A")
+                    details["created_date"] = action.get("when", "N/A")
+                    details["ai_generated"] = params.get("ai_generated", False)
+    return details
+
+
+def _phash_lookup(ctx: DetectionContext) -> Optional[Dict[str, Any]]:
+    """Coincidencia en el índice pHash, si está configurado (PMC_PHASH_DB)"""
+    index = get_default_index()
+    if index is None:
+        return None
+    try:
+        with metrics.stage("phash"), open_image_source(ctx.source) as f:
+            phash = compute_phash(f)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    # Una imagen casi uniforme coincidiría con cualquier otra: no se busca
+    return index.query(phash) if phash is not None else None
+
+
+def _index_phash(image_path: str, data: bytes, manifest: Dict[str, Any], model: str, author: str) -> None:
+    """Registra la imagen marcada en el índice pHash, si está configurado"""
+    index = get_default_index()
+    if index is None:
+        return
+    try:
+        phash = compute_phash(data)
+        if phash is None:
+            return
+        index.add(
+            phash,
+            image=os.path.basename(image_path),
+            instance_id=manifest.get("instance_id"),
+            model=model,
+            author=author,
+        )
+    except Exception as e:
+        # El índice es auxiliar: un fallo no invalida el marcado
+        index_log.warning("No se pudo indexar el pHash de %s: %s", image_path, e)
+        metrics.inc("pmc_index_errors_total", index="phash")
+
+
+def _index_provenance(image_path: str, manifest: Dict[str, Any]) -> None:
+    """Registra la imagen marcada en el índice de búsqueda, si está configurado"""
+    index = get_search_index()
+    if index is None:
+        return
+    try:
+        index.ingest({
+            "image": os.path.basename(image_path),
+            "path": index_path(image_path),
+            "ai_generated": True,
+            "source": "c2pa_manifest",
+            "details": _c2pa_details(manifest),
+            "c2pa_info": {"signature_type": manifest.get("signature", {}).get("type")},
+            "metadata": manifest,
+        })
+    except Exception as e:
+        # Igual que el índice pHash: un fallo no invalida el marcado
+        index_log.warning("No se pudo indexar la procedencia de %s: %s", image_path, e)
+        metrics.inc("pmc_index_errors_total", index="provenance")
+
+
+def hash_image_source(
+    source: ImageSource,
+    chunk_size: int = HASH_CHUNK_SIZE,
+    exclusions: Sequence[Tuple[int, int]] = ()
+) -> str:
+    """
+    Calcula el SHA-256 (hex) de una imagen leyendo por bloques.
+    Acepta una ruta, bytes/memoryview o un stream binario ya abierto; en este
+    último caso se hashea desde el inicio y se restaura la posición original.
+    Los rangos (inicio, longitud) de `exclusions` no entran en el hash.
+    """
+    exclusions = sorted(exclusions)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256()
+        _update_excluding(digest, memoryview(source), 0, exclusions)
+        return digest.hexdigest()
+    
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _hash_stream(f, chunk_size, exclusions)
+    
+    seekable = getattr(source, "seekable", None)
+    position = source.tell() if seekable and seekable() else None
+    if position is not None:
+        source.seek(0)
+    try:
+        return _hash_stream(source, chunk_size, exclusions)
+    finally:
+        if position is not None:
+            source.seek(position)
+
+
+def _update_excluding(digest, view: memoryview, offset: int, exclusions: List[Tuple[int, int]]) -> None:
+    """Añade al hash el bloque `view` (que empieza en `offset`) salvo las exclusiones"""
+    if not exclusions:
+        digest.update(view)
+        return
+    cursor = 0
+    for start, length in exclusions:
+        skip_from = max(start - offset, 0)
+        skip_to = min(start + length - offset, len(view))
+        if skip_to <= 0 or skip_from >= len(view):
+            continue
+        if skip_from > cursor:
+            digest.update(view[cursor:skip_from])
+        cursor = max(cursor, skip_to)
+    if cursor < len(view):
+        digest.update(view[cursor:])
+
+
+def _hash_stream(stream: BinaryIO, chunk_size: int, exclusions: List[Tuple[int, int]] = ()) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    readinto = getattr(stream, "readinto", None)
+    offset = 0
+    while True:
+        if readinto is not None:
+            n = readinto(buffer)
+            if not n:
+                break
+            chunk = view[:n]
+        else:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            chunk = memoryview(chunk)
+        _update_excluding(digest, chunk, offset, exclusions)
+        offset += len(chunk)
+    metrics.inc("pmc_bytes_read_total", offset, stage="hash")
+    return digest.hexdigest()
+
+
+def _source_format(source: ImageSource) -> str:
+    """Formato de una imagen dada como ruta, bytes o stream"""
+    if isinstance(source, (str, os.PathLike)):
+        return get_image_format(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return sniff_format(bytes(source[:16]))
+    position = source.tell()
+    source.seek(0)
+    head = source.read(16)
+    source.seek(position)
+    return sniff_format(head)
 
 
 def generate_c2pa_manifest(
-    image_path: str,
+    image_path: ImageSource,
     prompt: str,
     model: str,
     author: str = "AI System"
 ) -> Dict[str, Any]:
-    """Genera un manifest compatible con C2PA v1.3"""
-    timestamp = datetime.now(timezone.utc).isoformat()
-    img_format = get_image_format(image_path)
+    """
+    Genera un manifest compatible con C2PA v1.3.
+    `image_path` puede ser una ruta, los bytes de la imagen o un stream abierto.
+    """
+    img_format = _source_format(image_path)
     
-    # Calcular hash de la imagen
-    with open(image_path, "rb") as f:
-        image_data = f.read()
-        image_hash = hashlib.sha256(image_data).hexdigest()
+    # Calcular hash de la imagen por bloques (memoria acotada)
+    image_hash = hash_image_source(image_path)
     
+    return _build_c2pa_manifest(image_hash, img_format, prompt, model, author)
+
+
+def _build_c2pa_manifest(
+    image_hash: str,
+    img_format: str,
+    prompt: str,
+    model: str,
+    author: str
+) -> Dict[str, Any]:
+    """Construye el manifest C2PA a partir del hash SHA-256 (hex) de la imagen"""
+    timestamp = datetime.now(timezone.utc).isoformat()
     mime_type = f"image/{img_format}" if img_format != "unknown" else "image/png"
     
     manifest = {
-        "claim_generator": "PMC-C2PA/1.0",
+        "claim_generator": CLAIM_GENERATOR,
         "title": "AI Generated Image",
         "format": mime_type,
         "instance_id": f"xmp:iid:{image_hash[:16]}",
@@ -309,107 +805,219 @@ def generate_c2pa_manifest(
 def sign_c2pa_manifest(manifest: Dict[str, Any], private_key_path: str = None) -> Dict[str, Any]:
     """
     Firma el manifest C2PA usando criptografía.
-    Si c2pa-python está disponible y hay claves, usa la librería oficial.
+    Si hay clave privada configurada, firma (PS256/ES256) la codificación
+    canónica del manifest; la clave se carga una sola vez por proceso.
     De lo contrario, simula la firma con un hash.
     """
-    manifest_str = json.dumps(manifest, sort_keys=True, ensure_ascii=False)
-    
+    signed_manifest, messages = _sign_manifest(manifest, private_key_path)
+    for message in messages:
+        print(message)
+    return signed_manifest
+
+
+def _sign_manifest(manifest: Dict[str, Any], private_key_path: str = None) -> Tuple[C2PAManifest, List[str]]:
+    """Firma el manifest y devuelve los avisos en lugar de imprimirlos"""
+    messages = []
     # Usar la clave privada configurada si no se proporciona una específica
     key_path = private_key_path or C2PA_PRIVATE_KEY
     
-    if C2PA_AVAILABLE and key_path and os.path.exists(key_path):
+    if SIGNING_AVAILABLE and key_path and os.path.exists(key_path):
         try:
-            # Intentar usar c2pa-python para firma real
-            # Nota: La API exacta puede variar según la versión
-            signed_manifest = manifest.copy()
-            signed_manifest["signature"] = {
-                "type": "C2PA",
-                "signed": True,
-                "algorithm": "PS256",
-                "key_used": os.path.basename(key_path)
-            }
-            print(f"✓ Usando clave privada C2PA: {key_path}")
-            return signed_manifest
+            signed_manifest = load_signer(key_path, C2PA_CERTIFICATE).sign_manifest(manifest)
+            messages.append(f"✓ Usando clave privada C2PA: {key_path}")
+            if not (C2PA_CERTIFICATE and os.path.exists(C2PA_CERTIFICATE)):
+                messages.append(
+                    "⚠ Sin C2PA_CERTIFICATE: la firma incluye solo la clave pública "
+                    "y se verificará como no confiable"
+                )
+            return signed_manifest, messages
         except Exception as e:
-            print(f"⚠ Error al firmar con c2pa: {e}. Usando firma simulada.")
+            messages.append(f"⚠ Error al firmar con la clave C2PA: {e}. Usando firma simulada.")
     
-    # Fallback: firma simulada con hash SHA-256
-    signature_hash = hashlib.sha256(manifest_str.encode()).hexdigest()
-    signed_manifest = manifest.copy()
-    signed_manifest["signature"] = {
+    # Fallback: firma simulada con hash SHA-256 de los bytes canónicos
+    manifest = C2PAManifest.coerce(manifest)
+    signed_manifest = manifest.with_signature({
         "type": "simulated",
-        "hash": signature_hash,
+        "hash": hashlib.sha256(manifest.claim_bytes).hexdigest(),
+        "canonicalization": CANONICALIZATION,
         "note": "Firma simulada. Para firmas C2PA reales, configure C2PA_PRIVATE_KEY"
-    }
+    })
     
     if not key_path:
-        print("⚠ No se encontró C2PA_PRIVATE_KEY. Usando firma simulada.")
+        messages.append("⚠ No se encontró C2PA_PRIVATE_KEY. Usando firma simulada.")
     elif not os.path.exists(key_path):
-        print(f"⚠ Clave privada no encontrada en: {key_path}")
+        messages.append(f"⚠ Clave privada no encontrada en: {key_path}")
     
-    return signed_manifest
+    return signed_manifest, messages
+
+
+def _read_image_bytes(image_path: str) -> bytes:
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def _update_jpeg_exif(data: bytes, tags: Dict[int, Any], remove=None) -> bytes:
+    """
+    Actualiza tags del IFD0 EXIF de un JPEG en memoria, sin recodificar.
+    `remove(tag_id, valor)` decide qué tags existentes se eliminan.
+    """
+    exif = Image.Exif()
+    existing = read_jpeg_exif(data)
+    if existing:
+        exif.load(EXIF_HEADER + existing)
+    if remove is not None:
+        for tag_id in [t for t, v in exif.items() if remove(t, v)]:
+            del exif[tag_id]
+    for tag_id, value in tags.items():
+        exif[tag_id] = value
+    return jpeg_set_exif(data, exif.tobytes())
+
+
+def _is_legacy_manifest_comment(tag_id: int, value: Any) -> bool:
+    """UserComment con un manifest JSON del formato anterior a JUMBF"""
+    return tag_id == EXIF_USER_COMMENT and isinstance(value, bytes) and value.startswith(b"{")
+
+
+def _c2pa_marker_bytes(data: bytes, img_format: str, claim_generator: str = CLAIM_GENERATOR) -> bytes:
+    """
+    Escribe los marcadores C2PA de texto/EXIF y elimina el almacén JUMBF
+    anterior y las copias del manifest en el formato de texto antiguo.
+    """
+    if img_format == "png":
+        data = png_set_text(data, {
+            "C2PA-Version": "1.3",
+            "C2PA-Signed": "true",
+        }, remove=("C2PA-Manifest",))
+        return png_embed_chunks(data, PNG_JUMBF_CHUNK, [])[0]
+    elif img_format in ["jpeg", "jpg"]:
+        data = _update_jpeg_exif(data, {
+            # Guardar marcadores adicionales en otros campos EXIF
+            270: "AI-Generated: true",  # ImageDescription
+            305: claim_generator,  # Software
+        }, remove=_is_legacy_manifest_comment)
+        return jpeg_embed_jumbf(data, b"", replace=is_manifest_store)[0]
+    raise ValueError(f"Formato de imagen no soportado: {img_format}")
+
+
+def _embed_manifest_store(data: bytes, img_format: str, manifest: Dict[str, Any]) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    Inserta el almacén JUMBF (caBX en PNG, APP11 en JPEG) y devuelve la
+    imagen y el rango (inicio, longitud) que ocupa.
+    """
+    store = build_manifest_store(manifest)
+    if img_format == "png":
+        return png_embed_chunks(data, PNG_JUMBF_CHUNK, [store])
+    return jpeg_embed_jumbf(data, store, replace=is_manifest_store)
+
+
+def _c2pa_png_bytes(data: bytes, manifest: Dict[str, Any]) -> bytes:
+    """Añade el almacén JUMBF C2PA (chunk caBX) al PNG en memoria"""
+    data = _c2pa_marker_bytes(data, "png", manifest.get("claim_generator", CLAIM_GENERATOR))
+    return _embed_manifest_store(data, "png", manifest)[0]
+
+
+def _c2pa_jpeg_bytes(data: bytes, manifest: Dict[str, Any]) -> bytes:
+    """Añade el almacén JUMBF C2PA (segmentos APP11) al JPEG en memoria"""
+    data = _c2pa_marker_bytes(data, "jpeg", manifest.get("claim_generator", CLAIM_GENERATOR))
+    return _embed_manifest_store(data, "jpeg", manifest)[0]
+
+
+def _c2pa_image_bytes(data: bytes, img_format: str, manifest: Dict[str, Any]) -> bytes:
+    if img_format == "png":
+        return _c2pa_png_bytes(data, manifest)
+    elif img_format in ["jpeg", "jpg"]:
+        return _c2pa_jpeg_bytes(data, manifest)
+    raise ValueError(f"Formato de imagen no soportado: {img_format}")
+
+
+def _hash_assertion(manifest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Datos de la aserción c2pa.hash.data del manifest (o None)"""
+    for assertion in manifest.get("assertions") or []:
+        if isinstance(assertion, dict) and assertion.get("label") == HASH_ASSERTION_LABEL:
+            return assertion.get("data")
+    return None
+
+
+def _bind_and_embed(
+    data: bytes,
+    img_format: str,
+    manifest: Dict[str, Any],
+    private_key_path: str = None
+) -> Tuple[C2PAManifest, bytes]:
+    """
+    Firma el manifest con su enlace duro e incrusta el almacén JUMBF.
+
+    `data` es la imagen final sin almacén y c2pa.hash.data ya contiene su
+    SHA-256, que es el hash del resultado excluyendo el rango del manifest.
+    Ese rango depende del tamaño del propio manifest, así que se itera
+    hasta que deja de cambiar.
+    """
+    hash_data = _hash_assertion(manifest)
+    if hash_data is None:
+        raise ValueError(f"El manifest no tiene aserción {HASH_ASSERTION_LABEL}")
+
+    exclusion = (0, 0)
+    for _ in range(_MAX_BINDING_ROUNDS):
+        hash_data["exclusions"] = [{"start": exclusion[0], "length": exclusion[1]}]
+        signed_manifest, messages = _sign_manifest(manifest, private_key_path)
+        output, embedded_range = _embed_manifest_store(data, img_format, signed_manifest)
+        if embedded_range == exclusion:
+            for message in messages:
+                print(message)
+            return signed_manifest, output
+        exclusion = embedded_range
+    raise ValueError("No se pudo fijar el rango de exclusión del manifest")
+
+
+def verify_hash_binding(source: ImageSource, manifest: Dict[str, Any]) -> Optional[bool]:
+    """
+    Recalcula el hash de la imagen en una sola lectura secuencial saltando
+    los rangos excluidos y lo compara con c2pa.hash.data. Devuelve None si
+    el manifest no tiene enlace con exclusiones (formato anterior).
+    """
+    hash_data = _hash_assertion(manifest)
+    if not hash_data or "exclusions" not in hash_data or hash_data.get("alg", "sha256") != "sha256":
+        return None
+    exclusions = [(int(e["start"]), int(e["length"])) for e in hash_data["exclusions"]]
+    digest = bytes.fromhex(hash_image_source(source, exclusions=exclusions))
+    return base64.b64encode(digest).decode() == hash_data.get("hash")
+
+
+def _basic_metadata_bytes(data: bytes, img_format: str, prompt: str, model: str) -> bytes:
+    """Añade los metadatos básicos de IA a la imagen en memoria"""
+    if img_format == "png":
+        return png_set_text(data, {
+            "AI-Generated": "true",
+            "AI-Model": model,
+            "AI-Prompt": prompt,
+        })
+    elif img_format in ["jpeg", "jpg"]:
+        # Usar campos EXIF estándar
+        return _update_jpeg_exif(data, {
+            270: f"AI-Generated: true | AI-Model: {model} | AI-Prompt: {prompt}",  # ImageDescription
+            305: model,  # Software
+            315: "AI System",  # Artist
+        })
+    return data
 
 
 def embed_c2pa_in_png(image_path: str, manifest: Dict[str, Any]) -> None:
-    """Incrusta el manifest C2PA en el PNG"""
-    manifest_json = json.dumps(manifest, ensure_ascii=False)
-    
-    with Image.open(image_path) as img:
-        png_info = PngImagePlugin.PngInfo()
-        
-        # Preservar metadatos existentes
-        existing_info = img.info or {}
-        for key, value in existing_info.items():
-            if isinstance(value, str) and key not in ["C2PA-Manifest", "C2PA-Version", "C2PA-Signed"]:
-                png_info.add_text(key, value)
-        
-        # Añadir manifest C2PA
-        png_info.add_text("C2PA-Manifest", manifest_json)
-        png_info.add_text("C2PA-Version", "1.3")
-        png_info.add_text("C2PA-Signed", "true" if "signature" in manifest else "false")
-        
-        img.save(image_path, pnginfo=png_info)
+    """Incrusta el manifest C2PA en el PNG sin recodificar los píxeles"""
+    data = _read_image_bytes(image_path)
+    atomic_write_bytes(image_path, _c2pa_png_bytes(data, manifest))
 
 
 def embed_c2pa_in_jpeg(image_path: str, manifest: Dict[str, Any]) -> None:
-    """Incrusta el manifest C2PA en JPEG usando EXIF UserComment"""
-    manifest_json = json.dumps(manifest, ensure_ascii=False)
-    
-    from PIL.ExifTags import TAGS
-    # Encontrar el tag ID para UserComment
-    user_comment_tag = None
-    for tag_id, tag_name in TAGS.items():
-        if tag_name == "UserComment":
-            user_comment_tag = tag_id
-            break
-    
-    with Image.open(image_path) as img:
-        # Obtener EXIF existente o crear nuevo
-        exif = img.getexif()
-        
-        # Guardar manifest en UserComment
-        if user_comment_tag:
-            exif[user_comment_tag] = manifest_json.encode('utf-8')
-        
-        # Guardar marcadores adicionales en otros campos EXIF
-        # ImageDescription para marca básica
-        exif[270] = "AI-Generated: true"  # ImageDescription
-        exif[305] = manifest.get("claim_generator", "PMC-C2PA/1.0")  # Software
-        
-        # Guardar imagen con nuevo EXIF
-        img.save(image_path, exif=exif, quality=95)
+    """Incrusta el manifest C2PA en JPEG como segmentos APP11 JUMBF (sin recomprimir)"""
+    data = _read_image_bytes(image_path)
+    atomic_write_bytes(image_path, _c2pa_jpeg_bytes(data, manifest))
 
 
 def embed_c2pa_in_image(image_path: str, manifest: Dict[str, Any]) -> None:
     """Incrusta el manifest C2PA en la imagen (PNG o JPEG)"""
     img_format = get_image_format(image_path)
-    
-    if img_format == "png":
-        embed_c2pa_in_png(image_path, manifest)
-    elif img_format in ["jpeg", "jpg"]:
-        embed_c2pa_in_jpeg(image_path, manifest)
-    else:
-        raise ValueError(f"Formato de imagen no soportado: {img_format}")
+    data = _read_image_bytes(image_path)
+    atomic_write_bytes(image_path, _c2pa_image_bytes(data, img_format, manifest))
 
 
 def embed_basic_metadata(image_path: str, prompt: str, model: str) -> None:
@@ -424,43 +1032,23 @@ def embed_basic_metadata(image_path: str, prompt: str, model: str) -> None:
 
 def embed_basic_metadata_png(image_path: str, prompt: str, model: str) -> None:
     """Inserta metadatos básicos en un PNG"""
-    with Image.open(image_path) as img:
-        png_info = PngImagePlugin.PngInfo()
-        
-        # Preservar metadatos existentes
-        existing_info = img.info or {}
-        for key, value in existing_info.items():
-            if isinstance(value, str):
-                png_info.add_text(key, value)
-        
-        # Añadir metadatos básicos
-        png_info.add_text("AI-Generated", "true")
-        png_info.add_text("AI-Model", model)
-        png_info.add_text("AI-Prompt", prompt)
-        
-        img.save(image_path, pnginfo=png_info)
+    data = _read_image_bytes(image_path)
+    atomic_write_bytes(image_path, _basic_metadata_bytes(data, "png", prompt, model))
 
 
 def embed_basic_metadata_jpeg(image_path: str, prompt: str, model: str) -> None:
     """Inserta metadatos básicos en un JPEG usando EXIF"""
-    with Image.open(image_path) as img:
-        exif = img.getexif()
-        
-        # Usar campos EXIF estándar
-        exif[270] = f"AI-Generated: true | AI-Model: {model} | AI-Prompt: {prompt}"  # ImageDescription
-        exif[305] = model  # Software
-        exif[315] = "AI System"  # Artist
-        
-        img.save(image_path, exif=exif, quality=95)
+    data = _read_image_bytes(image_path)
+    atomic_write_bytes(image_path, _basic_metadata_bytes(data, "jpeg", prompt, model))
 
 
-def create_sidecar_manifest(
-    image_path: str, 
-    prompt: str, 
-    model: str, 
+def _sidecar_record(
+    image_path: str,
+    prompt: str,
+    model: str,
     extra: Dict[str, Any] = None
-) -> str:
-    """Crea un manifest sidecar JSON"""
+) -> Dict[str, Any]:
+    """Contenido del manifest sidecar de una imagen"""
     manifest = {
         "ai_generated": True,
         "model": model,
@@ -479,10 +1067,18 @@ def create_sidecar_manifest(
     }
     if extra:
         manifest.update(extra)
+    return manifest
 
+
+def create_sidecar_manifest(
+    image_path: str, 
+    prompt: str, 
+    model: str, 
+    extra: Dict[str, Any] = None
+) -> str:
+    """Crea un manifest sidecar JSON"""
     manifest_path = manifest_path_for(image_path)
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    atomic_write_bytes(manifest_path, sidecar_bytes(_sidecar_record(image_path, prompt, model, extra)))
     return manifest_path
 
 
@@ -497,27 +1093,43 @@ def mark_image_as_ai(
         if not os.path.exists(image_path):
             return {"success": False, "error": "Imagen no encontrada"}
         
-        img_format = get_image_format(image_path)
+        # Todo el pipeline trabaja en memoria: una lectura y una escritura
+        with metrics.stage("mark_read"):
+            data = _read_image_bytes(image_path)
+        metrics.inc("pmc_bytes_read_total", len(data), stage="mark")
+        img_format = sniff_format(data[:16])
         if img_format not in ["png", "jpeg", "jpg"]:
             return {"success": False, "error": f"Formato no soportado: {img_format}"}
         
-        # 1. Metadatos básicos
-        embed_basic_metadata(image_path, prompt, model)
+        # 1. Metadatos básicos y marcadores C2PA de texto/EXIF
+        with metrics.stage("mark_metadata"):
+            data = _basic_metadata_bytes(data, img_format, prompt, model)
+            data = _c2pa_marker_bytes(data, img_format)
         
-        # 2. Manifest C2PA
-        c2pa_manifest = generate_c2pa_manifest(image_path, prompt, model, author)
-        signed_manifest = sign_c2pa_manifest(c2pa_manifest)
+        # 2. Manifest C2PA con enlace duro (hash de todo salvo el propio manifest)
+        with metrics.stage("mark_sign"):
+            c2pa_manifest = _build_c2pa_manifest(
+                hash_image_source(data), img_format, prompt, model, author
+            )
+            signed_manifest, data = _bind_and_embed(data, img_format, c2pa_manifest)
         
-        # 3. Incrustar C2PA
-        embed_c2pa_in_image(image_path, signed_manifest)
+        # 3. Escribir la imagen de forma atómica
+        with metrics.stage("mark_write"):
+            atomic_write_bytes(image_path, data)
+        with metrics.stage("mark_index"):
+            _index_phash(image_path, data, signed_manifest, model, author)
+            _index_provenance(image_path, signed_manifest)
         
-        # 4. Sidecar
-        manifest_path = create_sidecar_manifest(
-            image_path, 
-            prompt, 
-            model,
-            extra={"c2pa_manifest": signed_manifest}
-        )
+        # 4. Manifest en el almacén configurado (sidecar por defecto)
+        with metrics.stage("mark_manifest_store"):
+            manifest_path = get_manifest_store().save(
+                image_path,
+                _sidecar_record(image_path, prompt, model, extra={"c2pa_manifest": signed_manifest}),
+                hashlib.sha256(data).hexdigest(),
+                instance_id=signed_manifest.get("instance_id"),
+                model=model,
+                author=author,
+            )
         
         return {
             "success": True,
@@ -0,0 +1,74 @@
+"""
+Configuración de gunicorn para servir web_app en producción.
+
+Variables de entorno:
+    PMC_BIND             Dirección de escucha (por defecto 0.0.0.0:5000)
+    PMC_WORKERS          Procesos worker (por defecto: nº de CPUs)
+    PMC_THREADS          Hilos por worker (por defecto 1)
+    PMC_WORKER_CLASS     Clase de worker de gunicorn (por defecto gthread)
+    PMC_TIMEOUT          Segundos sin latido antes de reiniciar un worker colgado (por defecto 60)
+    PMC_MAX_REQUESTS     Peticiones antes de reciclar un worker (por defecto 1000, 0 = nunca)
+    PMC_MAX_UPLOAD_MB    Tamaño máximo de subida, leído por la aplicación (por defecto 16)
+"""
+import os
+import multiprocessing
+
+bind = os.getenv("PMC_BIND", "0.0.0.0:5000")
+
+# La detección y el marcado son CPU-bound: se escala con procesos, no con
+# hilos, para que una subida lenta o pesada no bloquee al resto (GIL).
+workers = int(os.getenv("PMC_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("PMC_THREADS", "1"))
+# gthread también con un solo hilo: el latido del worker no depende de la
+# petición en curso, así que una respuesta larga (el streaming de
+# /detect/batch) no se corta al llegar a `timeout`, como ocurre con "sync".
+# Con "sync", `timeout` limita la duración total de cada petición.
+worker_class = os.getenv("PMC_WORKER_CLASS", "gthread")
+
+timeout = int(os.getenv("PMC_TIMEOUT", "60"))
+graceful_timeout = timeout
+keepalive = 5
+
+# Reciclar workers periódicamente (con jitter para no reiniciarlos a la vez)
+max_requests = int(os.getenv("PMC_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+# Cargar la aplicación (y detection_utils) antes de hacer fork para
+# compartir memoria entre workers y no pagar el import en cada uno
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Las métricas volcadas por una ejecución anterior no se suman a las nuevas
+    import metrics
+    from web_app import config_from_env
+    db_path = config_from_env()["METRICS_DB"]
+    # En el entorno del master: lo heredan los workers y sus pools
+    metrics.configure(db_path or None)
+    if db_path:
+        metrics.clear_shared(db_path)
+
+
+def worker_exit(server, worker):
+    # El worker que sale (reciclado o apagado) pasa sus métricas a los
+    # totales retirados: siguen sumando en /metrics aunque se reutilice su pid
+    import metrics
+    metrics.retire()
+
+
+def child_exit(server, worker):
+    # Lo mismo para un worker que murió sin llegar a worker_exit; sus gauges
+    # dejan de exponerse
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Cada worker arranca su despachador de trabajos: los que dejó a medias
+    # un worker reciclado o caído se retoman sin esperar a una petición
+    from web_app import config_from_env
+    from job_queue import get_job_queue
+    get_job_queue(os.path.join(config_from_env()["UPLOAD_FOLDER"], "jobs.sqlite3")).start()
@@ -0,0 +1,589 @@
+"""
+Escáner de contenedores PNG/JPEG que trabaja directamente sobre los bytes.
+
+Recorre los chunks PNG (tEXt/iTXt/zTXt, JUMBF en caBX) y los marcadores
+APPn de JPEG (EXIF en APP1, JUMBF en APP11) y se detiene en IDAT/SOS, de
+modo que nunca lee ni decodifica los datos de píxeles.
+
+También permite reescribir esos metadatos insertando chunks/segmentos en el
+flujo original y copiando los datos comprimidos de la imagen sin cambios.
+"""
+import struct
+import zlib
+from typing import Dict, Any, BinaryIO, List, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOI = b"\xff\xd8"
+EXIF_HEADER = b"Exif\x00\x00"
+
+# Firmas para los formatos que no recorremos pero sí identificamos
+_MAGIC_FORMATS = [
+    (PNG_SIGNATURE, "png"),
+    (JPEG_SOI, "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+]
+
+PNG_TEXT_CHUNKS = {b"tEXt", b"iTXt", b"zTXt"}
+
+# Chunk PNG que contiene la caja JUMBF de C2PA
+PNG_JUMBF_CHUNK = b"caBX"
+
+# Segmento APP11 con JUMBF: "JP" + instancia de caja (2 bytes) + secuencia (4 bytes)
+JPEG_APP11 = 0xEB
+JPEG_JUMBF_CI = b"JP"
+_APP11_HEADER = 8
+
+# Marcadores JPEG sin campo de longitud (TEM y RSTn)
+_JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD8))
+
+# Subcadenas que aparecen en cualquier marca de IA o C2PA legible: claves
+# "AI-Generated", "C2PA-Manifest"/"C2PA-Version" y etiquetas "c2pa" de JUMBF
+MARKER_TOKENS = (b"AI-Generated", b"C2PA", b"c2pa")
+
+# Cabecera máxima que lee la sonda; si es mayor se hace el escaneo completo
+PROBE_LIMIT = 1024 * 1024
+
+# Tamaño en bytes de cada tipo TIFF
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+_TIFF_STRUCT_CODES = {3: "H", 4: "L", 6: "b", 8: "h", 9: "l", 11: "f", 12: "d", 13: "L"}
+
+
+def sniff_format(head: bytes) -> str:
+    """Identifica el formato a partir de los primeros bytes del archivo"""
+    for magic, fmt in _MAGIC_FORMATS:
+        if head.startswith(magic):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return "unknown"
+
+
+def scan_image_header(fp: BinaryIO) -> Dict[str, Any]:
+    """
+    Escanea la cabecera del contenedor sin tocar los píxeles.
+
+    Devuelve un dict con:
+      - format: "png", "jpeg", u otro formato identificado por firma
+      - text: chunks de texto PNG (clave -> valor)
+      - exif: bloque TIFF del segmento EXIF APP1 (bytes) o None
+      - jumbf: cajas JUMBF completas (chunks caBX de PNG o segmentos APP11
+        de JPEG ya reensamblados)
+      - data_offset: posición de IDAT/SOS (None si no se encontró)
+    """
+    head = fp.read(16)
+    result = {
+        "format": sniff_format(head),
+        "text": {},
+        "exif": None,
+        "jumbf": [],
+        "data_offset": None,
+    }
+    try:
+        if result["format"] == "png":
+            fp.seek(len(PNG_SIGNATURE))
+            _scan_png(fp, result)
+        elif result["format"] == "jpeg":
+            fp.seek(len(JPEG_SOI))
+            _scan_jpeg(fp, result)
+    except (struct.error, zlib.error, ValueError):
+        # Contenedor truncado o corrupto: devolver lo que se haya leído
+        pass
+    return result
+
+
+def probe_image_header(fp: BinaryIO, limit: int = PROBE_LIMIT) -> Dict[str, Any]:
+    """
+    Sonda rápida: lee la cabecera (hasta IDAT/SOS, como mucho `limit`
+    bytes) sin decodificar nada y busca MARKER_TOKENS en los bytes crudos.
+
+    Devuelve un dict con:
+      - format: como en scan_image_header
+      - marked: False solo si es seguro que no hay marcas de IA/C2PA (el
+        texto comprimido, un formato no recorrido o una cabecera demasiado
+        grande cuentan como posibles marcas)
+      - header: bytes leídos, que scan_image_header puede recorrer sin
+        volver al archivo (None si la cabecera no se leyó entera)
+    """
+    head = fp.read(16)
+    result = {"format": sniff_format(head), "marked": True, "header": None}
+    try:
+        if result["format"] == "png":
+            fp.seek(len(PNG_SIGNATURE))
+            header, opaque = _probe_png(fp, limit)
+        elif result["format"] == "jpeg":
+            fp.seek(len(JPEG_SOI))
+            header, opaque = _probe_jpeg(fp, limit)
+        else:
+            return result
+    except (struct.error, ValueError):
+        return result
+    if header is None:
+        return result
+    result["header"] = bytes(header)
+    result["marked"] = opaque or any(token in header for token in MARKER_TOKENS)
+    return result
+
+
+def _probe_png(fp: BinaryIO, limit: int):
+    header = bytearray(PNG_SIGNATURE)
+    opaque = False
+    while len(header) <= limit:
+        chunk_header = fp.read(8)
+        header += chunk_header
+        if len(chunk_header) < 8:
+            return header, opaque
+        length, chunk_type = struct.unpack(">I4s", chunk_header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            return header, opaque
+        if len(header) + length > limit:
+            break
+        data = fp.read(length + 4)
+        header += data
+        # El texto comprimido no se puede inspeccionar sin descomprimir
+        if chunk_type == b"zTXt":
+            opaque = True
+        elif chunk_type == b"iTXt":
+            # iTXt: clave\0 flag_de_compresión ...
+            opaque = opaque or data[:length].partition(b"\x00")[2][:1] == b"\x01"
+    return None, opaque
+
+
+def _probe_jpeg(fp: BinaryIO, limit: int):
+    header = bytearray(JPEG_SOI)
+    while len(header) <= limit:
+        marker = fp.read(2)
+        header += marker
+        if len(marker) < 2:
+            return header, False
+        if marker[0] != 0xFF or marker[1] in (0x00, 0xFF):
+            # Relleno o basura entre segmentos: que decida el escaneo completo
+            raise ValueError("Estructura JPEG inesperada")
+        code = marker[1]
+        if code in (0xDA, 0xD9):  # SOS / EOI
+            return header, False
+        if code in _JPEG_STANDALONE:
+            continue
+        length_bytes = fp.read(2)
+        header += length_bytes
+        if len(length_bytes) < 2:
+            return header, False
+        header += fp.read(_jpeg_segment_length(length_bytes) - 2)
+    return None, False
+
+
+def _jpeg_segment_length(length_bytes: bytes) -> int:
+    """
+    Longitud de un segmento JPEG (incluye los 2 bytes del propio campo). Un
+    valor menor que 2 es un archivo corrupto: leer length - 2 bytes leería
+    el resto del archivo y un seek retrocedería.
+    """
+    length = struct.unpack(">H", length_bytes)[0]
+    if length < 2:
+        raise ValueError(f"Longitud de segmento JPEG no válida: {length}")
+    return length
+
+
+def _scan_png(fp: BinaryIO, result: Dict[str, Any]) -> None:
+    """Recorre los chunks PNG hasta el primer IDAT"""
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            result["data_offset"] = fp.tell() - 8
+            return
+        if chunk_type in PNG_TEXT_CHUNKS:
+            data = fp.read(length)
+            fp.seek(4, 1)  # CRC
+            key, value = _decode_png_text(chunk_type, data)
+            if key and key not in result["text"]:
+                result["text"][key] = value
+        elif chunk_type == PNG_JUMBF_CHUNK:
+            result["jumbf"].append(fp.read(length))
+            fp.seek(4, 1)  # CRC
+        else:
+            fp.seek(length + 4, 1)
+
+
+def _decode_png_text(chunk_type: bytes, data: bytes):
+    """Decodifica un chunk tEXt/zTXt/iTXt en (clave, valor)"""
+    if chunk_type == b"tEXt":
+        key, _, value = data.partition(b"\x00")
+        return key.decode("latin-1"), value.decode("latin-1", "replace")
+
+    if chunk_type == b"zTXt":
+        key, _, rest = data.partition(b"\x00")
+        # rest[0] es el método de compresión (siempre 0 = zlib)
+        return key.decode("latin-1"), zlib.decompress(rest[1:]).decode("latin-1", "replace")
+
+    # iTXt: clave\0 flag método idioma\0 clave_traducida\0 texto
+    key, _, rest = data.partition(b"\x00")
+    if len(rest) < 2:
+        return None, None
+    compressed, rest = rest[0], rest[2:]
+    _lang, _, rest = rest.partition(b"\x00")
+    _translated, _, text = rest.partition(b"\x00")
+    if compressed:
+        text = zlib.decompress(text)
+    return key.decode("latin-1"), text.decode("utf-8", "replace")
+
+
+def _scan_jpeg(fp: BinaryIO, result: Dict[str, Any]) -> None:
+    """Recorre los segmentos JPEG hasta SOS"""
+    app11: List[bytes] = []
+    try:
+        _scan_jpeg_segments(fp, result, app11)
+    finally:
+        result["jumbf"] = reassemble_app11_jumbf(app11)
+
+
+def _scan_jpeg_segments(fp: BinaryIO, result: Dict[str, Any], app11: List[bytes]) -> None:
+    while True:
+        byte = fp.read(1)
+        if not byte:
+            return
+        if byte != b"\xff":
+            continue
+        marker = fp.read(1)
+        # Saltar bytes de relleno 0xFF
+        while marker == b"\xff":
+            marker = fp.read(1)
+        if not marker:
+            return
+        code = marker[0]
+        if code in _JPEG_STANDALONE or code == 0x00:
+            continue
+        if code in (0xDA, 0xD9):  # SOS / EOI
+            result["data_offset"] = fp.tell() - 2
+            return
+        length_bytes = fp.read(2)
+        if len(length_bytes) < 2:
+            return
+        length = _jpeg_segment_length(length_bytes)
+        if code == 0xE1 and result["exif"] is None:
+            data = fp.read(length - 2)
+            if data.startswith(EXIF_HEADER):
+                result["exif"] = data[len(EXIF_HEADER):]
+        elif code == JPEG_APP11:
+            app11.append(fp.read(length - 2))
+        else:
+            fp.seek(length - 2, 1)
+
+
+def parse_exif_ifd0(tiff: bytes) -> Dict[int, Any]:
+    """
+    Decodifica las entradas del IFD0 de un bloque TIFF/EXIF.
+    Los valores siguen las mismas convenciones que Image.getexif():
+    ASCII -> str, BYTE/UNDEFINED -> bytes, un solo número -> escalar.
+    """
+    if len(tiff) < 8:
+        return {}
+    order = tiff[:2]
+    if order == b"II":
+        endian = "<"
+    elif order == b"MM":
+        endian = ">"
+    else:
+        return {}
+
+    ifd_offset = struct.unpack(endian + "L", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return {}
+    count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+
+    tags: Dict[int, Any] = {}
+    pos = ifd_offset + 2
+    for _ in range(count):
+        entry = tiff[pos:pos + 12]
+        pos += 12
+        if len(entry) < 12:
+            break
+        tag, typ, n = struct.unpack(endian + "HHL", entry[:8])
+        size = _TIFF_TYPE_SIZES.get(typ)
+        if size is None:
+            continue
+        total = size * n
+        if total <= 4:
+            raw = entry[8:8 + total]
+        else:
+            offset = struct.unpack(endian + "L", entry[8:12])[0]
+            raw = tiff[offset:offset + total]
+            if len(raw) < total:
+                continue
+        tags[tag] = _decode_tiff_value(endian, typ, n, raw)
+    return tags
+
+
+def _decode_tiff_value(endian: str, typ: int, n: int, raw: bytes) -> Any:
+    """Convierte el valor crudo de una entrada TIFF a un tipo Python"""
+    if typ == 2:
+        if raw.endswith(b"\x00"):
+            raw = raw[:-1]
+        return raw.decode("latin-1", "replace")
+    if typ in (1, 7):
+        return raw
+    if typ in (5, 10):
+        code = "L" if typ == 5 else "l"
+        nums = struct.unpack(endian + code * (2 * n), raw)
+        values: List[Any] = [
+            (nums[i] / nums[i + 1]) if nums[i + 1] else float("nan")
+            for i in range(0, len(nums), 2)
+        ]
+    else:
+        values = list(struct.unpack(endian + _TIFF_STRUCT_CODES[typ] * n, raw))
+    return values[0] if n == 1 else tuple(values)
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Serializa un chunk PNG con su CRC"""
+    crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def _png_text_chunk(key: str, value: str) -> bytes:
+    """Crea un chunk tEXt, o iTXt si el texto no cabe en latin-1"""
+    try:
+        return _png_chunk(b"tEXt", key.encode("latin-1") + b"\x00" + value.encode("latin-1"))
+    except UnicodeEncodeError:
+        data = key.encode("latin-1") + b"\x00\x00\x00" + b"\x00\x00" + value.encode("utf-8")
+        return _png_chunk(b"iTXt", data)
+
+
+def _iter_png_chunks(data: bytes):
+    """Itera (offset, tamaño_total, tipo, contenido) de cada chunk PNG"""
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        total = length + 12
+        yield pos, total, chunk_type, data[pos + 8:pos + 8 + length]
+        pos += total
+
+
+def png_set_text(data: bytes, items: Dict[str, str], remove=()) -> bytes:
+    """
+    Reescribe los chunks de texto de un PNG sin recodificar los píxeles.
+    Los chunks con las mismas claves (o en `remove`) se sustituyen; los
+    nuevos se insertan justo antes del primer IDAT.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("No es un PNG válido")
+    drop = set(items) | set(remove)
+    out = [PNG_SIGNATURE]
+    inserted = False
+    for pos, total, chunk_type, content in _iter_png_chunks(data):
+        if chunk_type == b"IDAT" and not inserted:
+            out.extend(_png_text_chunk(k, v) for k, v in items.items())
+            inserted = True
+            # El resto del archivo (píxeles comprimidos) se copia tal cual
+            out.append(data[pos:])
+            break
+        if chunk_type in PNG_TEXT_CHUNKS:
+            key = content.partition(b"\x00")[0].decode("latin-1")
+            if key in drop:
+                continue
+        out.append(data[pos:pos + total])
+    if not inserted:
+        raise ValueError("PNG sin chunk IDAT")
+    return b"".join(out)
+
+
+def _iter_jpeg_segments(data: bytes):
+    """Itera (offset, marcador, tamaño_total) de cada segmento JPEG hasta SOS"""
+    pos = len(JPEG_SOI)
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Estructura JPEG inválida")
+        code = data[pos + 1]
+        if code == 0xFF:
+            pos += 1
+            continue
+        if code in (0xDA, 0xD9):
+            yield pos, code, None
+            return
+        if code in _JPEG_STANDALONE:
+            pos += 2
+            continue
+        length = _jpeg_segment_length(data[pos + 2:pos + 4])
+        yield pos, code, length + 2
+        pos += length + 2
+
+
+def _jpeg_segment(code: int, payload: bytes) -> bytes:
+    """Serializa un segmento JPEG con marcador y longitud"""
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError("Segmento JPEG demasiado grande")
+    return bytes((0xFF, code)) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def jpeg_replace_segments(data: bytes, code: int, new_segments: List[bytes], keep=None) -> bytes:
+    """
+    Sustituye los segmentos APPn `code` de un JPEG por `new_segments`
+    (ya serializados) sin tocar los datos de escaneo.
+
+    `keep(payload)` decide qué segmentos existentes del mismo tipo se
+    conservan; por defecto se eliminan todos. Los nuevos se insertan tras
+    SOI/APP0 (JFIF), que es donde los lectores esperan el EXIF.
+    """
+    return _jpeg_replace_segments(data, code, new_segments, keep)[0]
+
+
+def _jpeg_replace_segments(data: bytes, code: int, new_segments: List[bytes], keep=None) -> Tuple[bytes, int]:
+    """Como jpeg_replace_segments, devolviendo también el offset de inserción"""
+    if not data.startswith(JPEG_SOI):
+        raise ValueError("No es un JPEG válido")
+    out = [JPEG_SOI]
+    size = len(JPEG_SOI)
+    insert_at = None
+    for pos, seg_code, total in _iter_jpeg_segments(data):
+        if insert_at is None and seg_code != 0xE0:
+            insert_at = size
+            out.extend(new_segments)
+            size += sum(len(segment) for segment in new_segments)
+        if total is None:
+            # SOS/EOI: el resto del archivo se copia tal cual
+            out.append(data[pos:])
+            return b"".join(out), insert_at
+        segment = data[pos:pos + total]
+        if seg_code == code and not (keep and keep(segment[4:])):
+            continue
+        out.append(segment)
+        size += total
+    raise ValueError("JPEG sin segmento SOS")
+
+
+def _group_app11_jumbf(payloads: List[bytes]) -> Dict[int, bytes]:
+    """
+    Reconstruye, por número de instancia, las cajas JUMBF repartidas en
+    segmentos APP11. Cada segmento lleva "JP", la instancia de caja y su
+    número de secuencia; a partir del segundo se repite la cabecera
+    LBox/TBox de la caja, que se descarta.
+    """
+    groups: Dict[int, List[tuple]] = {}
+    for payload in payloads:
+        if len(payload) < _APP11_HEADER + 8 or not payload.startswith(JPEG_JUMBF_CI):
+            continue
+        instance, sequence = struct.unpack(">HL", payload[2:_APP11_HEADER])
+        groups.setdefault(instance, []).append((sequence, payload[_APP11_HEADER:]))
+    boxes = {}
+    for instance in sorted(groups):
+        parts = sorted(groups[instance], key=lambda part: part[0])
+        boxes[instance] = parts[0][1] + b"".join(part[8:] for _, part in parts[1:])
+    return boxes
+
+
+def reassemble_app11_jumbf(payloads: List[bytes]) -> List[bytes]:
+    """Cajas JUMBF completas a partir de los payloads APP11 de un JPEG"""
+    return list(_group_app11_jumbf(payloads).values())
+
+
+def _app11_instances(data: bytes) -> Dict[int, bytes]:
+    """Cajas JUMBF de un JPEG en memoria, por número de instancia"""
+    payloads = []
+    for pos, code, total in _iter_jpeg_segments(data):
+        if total is None:
+            break
+        if code == JPEG_APP11:
+            payloads.append(data[pos + 4:pos + total])
+    return _group_app11_jumbf(payloads)
+
+
+def jpeg_set_jumbf(data: bytes, box: bytes, replace=None) -> bytes:
+    """
+    Inserta una caja JUMBF en segmentos APP11 (troceándola si supera el
+    tamaño máximo de segmento) sin recodificar la imagen.
+
+    `replace(caja)` decide qué cajas JUMBF existentes se sustituyen; por
+    defecto se eliminan todas. Las demás se conservan tal cual. Con una
+    caja vacía solo se eliminan.
+    """
+    return jpeg_embed_jumbf(data, box, replace)[0]
+
+
+def jpeg_embed_jumbf(data: bytes, box: bytes, replace=None) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    Como jpeg_set_jumbf, devolviendo también el rango (inicio, longitud)
+    que ocupan los segmentos APP11 insertados en el resultado.
+    """
+    existing = _app11_instances(data)
+    drop = {inst for inst, old in existing.items() if replace is None or replace(old)}
+    kept = set(existing) - drop
+    instance = 1
+    while instance in kept:
+        instance += 1
+
+    max_chunk = 0xFFFF - 2 - _APP11_HEADER
+    header = box[:8]
+    segments = []
+    pos, sequence = 0, 1
+    while pos < len(box):
+        # A partir del segundo segmento se repite la cabecera de la caja
+        room = max_chunk if sequence == 1 else max_chunk - len(header)
+        chunk = box[pos:pos + room]
+        prefix = JPEG_JUMBF_CI + struct.pack(">HL", instance, sequence)
+        segments.append(_jpeg_segment(JPEG_APP11, prefix + (chunk if sequence == 1 else header + chunk)))
+        pos += room
+        sequence += 1
+
+    def keep(payload: bytes) -> bool:
+        if not payload.startswith(JPEG_JUMBF_CI) or len(payload) < _APP11_HEADER:
+            return True
+        return struct.unpack(">H", payload[2:4])[0] not in drop
+
+    out, insert_at = _jpeg_replace_segments(data, JPEG_APP11, segments, keep=keep)
+    return out, (insert_at, sum(len(segment) for segment in segments))
+
+
+def png_set_chunks(data: bytes, chunk_type: bytes, payloads: List[bytes]) -> bytes:
+    """
+    Sustituye todos los chunks `chunk_type` de un PNG por los de `payloads`,
+    insertados antes del primer IDAT, sin recodificar los píxeles.
+    """
+    return png_embed_chunks(data, chunk_type, payloads)[0]
+
+
+def png_embed_chunks(data: bytes, chunk_type: bytes, payloads: List[bytes]) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    Como png_set_chunks, devolviendo también el rango (inicio, longitud)
+    que ocupan los chunks insertados en el resultado.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("No es un PNG válido")
+    out = [PNG_SIGNATURE]
+    size = len(PNG_SIGNATURE)
+    for pos, total, ctype, content in _iter_png_chunks(data):
+        if ctype == b"IDAT":
+            chunks = [_png_chunk(chunk_type, payload) for payload in payloads]
+            out.extend(chunks)
+            out.append(data[pos:])
+            return b"".join(out), (size, sum(len(chunk) for chunk in chunks))
+        if ctype != chunk_type:
+            out.append(data[pos:pos + total])
+            size += total
+    raise ValueError("PNG sin chunk IDAT")
+
+
+def jpeg_set_exif(data: bytes, exif_bytes: bytes) -> bytes:
+    """Sustituye el segmento EXIF (APP1) de un JPEG sin recodificar"""
+    if not exif_bytes.startswith(EXIF_HEADER):
+        exif_bytes = EXIF_HEADER + exif_bytes
+    return jpeg_replace_segments(
+        data,
+        0xE1,
+        [_jpeg_segment(0xE1, exif_bytes)],
+        keep=lambda payload: not payload.startswith(EXIF_HEADER),
+    )
+
+
+def read_jpeg_exif(data: bytes) -> Any:
+    """Devuelve el bloque TIFF del EXIF de un JPEG en memoria (o None)"""
+    for pos, code, total in _iter_jpeg_segments(data):
+        if total is None:
+            return None
+        if code == 0xE1 and data[pos + 4:pos + 10] == EXIF_HEADER:
+            return data[pos + 10:pos + total]
+    return None
@@ -0,0 +1,388 @@
+"""
+Cola de trabajos asíncronos para el marcado de imágenes.
+
+Los trabajos viven en SQLite, no en memoria: cada proceso del servidor
+tiene un despachador que reclama trabajos pendientes de la base y los
+ejecuta en un pool de procesos local. Así un trabajo no depende del worker
+que lo recibió: si gunicorn recicla o mata ese worker (o se cae), otro
+despachador lo retoma cuando vence su plazo.
+
+Cada reclamación fija un plazo (PMC_JOB_TIMEOUT). Un trabajo cuyo plazo
+vence se vuelve a intentar hasta PMC_JOB_ATTEMPTS veces y después queda
+como fallido, de modo que ningún cliente espera para siempre. Cada
+ejecución solo registra su resultado si el trabajo sigue siendo suyo.
+
+Configuración por variables de entorno:
+    PMC_JOBS_DB       Ruta del archivo SQLite de trabajos (por defecto uploads/jobs.sqlite3)
+    PMC_JOB_WORKERS   Procesos para ejecutar trabajos en cada worker del
+                      servidor (por defecto: nº de CPUs / PMC_WORKERS, mínimo 1)
+    PMC_JOB_TIMEOUT   Segundos máximos por intento (por defecto 300)
+    PMC_JOB_ATTEMPTS  Intentos antes de dar un trabajo por fallido (por defecto 2)
+"""
+import os
+import json
+import time
+import logging
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional
+
+from detection_utils import mark_image_as_ai
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+DEFAULT_TIMEOUT = 300.0
+DEFAULT_ATTEMPTS = 2
+
+# Cada cuánto revisa la base el despachador si nadie lo despierta
+POLL_INTERVAL = 1.0
+
+# El despachador corre en un hilo: sus errores van al log, no a stdout
+dispatch_log = logging.getLogger("pmc.jobs")
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads", "jobs.sqlite3")
+
+_COLUMNS = "id, kind, status, created_at, updated_at, params, result, error, attempts"
+
+
+def default_job_workers() -> int:
+    """
+    Procesos de trabajos por worker del servidor: los CPUs repartidos entre
+    los workers de gunicorn, para que el total no sea workers x CPUs.
+    """
+    cpus = os.cpu_count() or 1
+    server_workers = int(os.getenv("PMC_WORKERS", str(cpus))) or 1
+    return max(1, cpus // server_workers)
+
+
+class JobStore:
+    """Estado de los trabajos en SQLite (compartido entre procesos)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Conexión perezosa, reabierta tras un fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "params TEXT, result TEXT, error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL, claim TEXT)"
+            )
+            # Bases creadas antes de que los trabajos se reclamaran desde SQLite
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, ddl in (
+                ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+                ("lease_until", "REAL"),
+                ("claim", "TEXT"),
+            ):
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn.commit()
+        return self._conn
+
+    def create(self, kind: str, params: Dict[str, Any], job_id: str = None) -> str:
+        """Registra un trabajo pendiente y devuelve su id"""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, updated_at, params) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, JOB_QUEUED, now, now, json.dumps(params, ensure_ascii=False))
+            )
+            self._db.commit()
+        return job_id
+
+    def claim(self, timeout: float = DEFAULT_TIMEOUT, max_attempts: int = DEFAULT_ATTEMPTS) -> Optional[Dict[str, Any]]:
+        """
+        Reclama el trabajo pendiente más antiguo (o uno en curso cuyo plazo
+        venció) y lo marca en curso con un plazo nuevo. Devuelve el trabajo
+        con su "claim", o None si no hay nada que hacer.
+        """
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with self._lock:
+            db = self._db
+            # BEGIN IMMEDIATE: dos procesos nunca reclaman el mismo trabajo
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    f"SELECT {_COLUMNS} FROM jobs WHERE (status = ? OR (status = ? AND lease_until < ?)) "
+                    "AND attempts < ? ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING, now, max_attempts)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ?, attempts = attempts + 1, "
+                        "lease_until = ?, claim = ? WHERE id = ?",
+                        (JOB_RUNNING, now, now + timeout, claim, row[0])
+                    )
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+        if row is None:
+            return None
+        job = self._row_to_job(row)
+        job["status"] = JOB_RUNNING
+        job["attempts"] += 1
+        job["claim"] = claim
+        return job
+
+    def expire(self, max_attempts: int = DEFAULT_ATTEMPTS) -> int:
+        """Da por fallidos los trabajos que agotaron sus intentos sin terminar"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, error = ?, claim = NULL "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (
+                    JOB_FAILED, now,
+                    f"Tiempo agotado tras {max_attempts} intento(s) (worker reiniciado o trabajo bloqueado)",
+                    JOB_RUNNING, now, max_attempts,
+                )
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def finish(
+        self,
+        job_id: str,
+        claim: str,
+        status: str,
+        result: Dict[str, Any] = None,
+        error: str = None
+    ) -> bool:
+        """
+        Registra el final de un intento. No hace nada (y devuelve False) si
+        el trabajo ya no pertenece a ese intento porque otro lo reclamó.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, result = ?, error = ?, "
+                "lease_until = NULL, claim = NULL WHERE id = ? AND claim = ?",
+                (
+                    status,
+                    time.time(),
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    job_id,
+                    claim,
+                )
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, claim: str) -> bool:
+        """
+        Devuelve a pendiente un trabajo reclamado que no llegó a ejecutarse,
+        sin gastar el intento. Como finish, solo actúa si el claim sigue vigente.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, attempts = MAX(attempts - 1, 0), "
+                "lease_until = NULL, claim = NULL WHERE id = ? AND claim = ?",
+                (JOB_QUEUED, time.time(), job_id, claim)
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    @staticmethod
+    def _row_to_job(row: tuple) -> Dict[str, Any]:
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "created_at": row[3],
+            "updated_at": row[4],
+            "params": json.loads(row[5]) if row[5] else {},
+            "result": json.loads(row[6]) if row[6] else None,
+            "error": row[7],
+            "attempts": row[8],
+        }
+
+
+def _run_mark_job(db_path: str, job_id: str, claim: str, params: Dict[str, Any]) -> None:
+    """Ejecuta un intento de marcado dentro del pool y registra su estado"""
+    store = JobStore(db_path)
+    try:
+        result = mark_image_as_ai(
+            params["image_path"],
+            params.get("prompt", "Imagen marcada manualmente"),
+            params.get("model", "Manual Marking System"),
+            params.get("author", "User"),
+        )
+    except Exception as e:
+        store.finish(job_id, claim, JOB_FAILED, error=str(e))
+        return
+    if result.get("success"):
+        store.finish(job_id, claim, JOB_DONE, result=result)
+    else:
+        store.finish(job_id, claim, JOB_FAILED, result=result, error=result.get("error"))
+
+
+class JobQueue:
+    """Reclama trabajos de marcado de SQLite y los ejecuta en un pool local"""
+
+    def __init__(
+        self,
+        db_path: str,
+        workers: int = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_attempts: int = DEFAULT_ATTEMPTS
+    ):
+        self.store = JobStore(db_path)
+        self.workers = workers or default_job_workers()
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self._executor = None
+        self._executor_pid = None
+        self._dispatcher_pid = None
+        self._in_flight = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # El pool se crea en el proceso que lo usa (nunca antes de un fork)
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+                self._in_flight = 0
+            return self._executor
+
+    def _drop_executor(self, executor: ProcessPoolExecutor) -> None:
+        # Un pool roto (un proceso murió) no acepta más trabajos: el siguiente
+        # dispatch crea otro. Los futures del roto ya terminaron con error y
+        # sus callbacks descuentan _in_flight, así que el contador no se toca.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def start(self) -> None:
+        """
+        Arranca el despachador de este proceso (idempotente). Al arrancar
+        retoma los trabajos pendientes y los de workers que ya no existen.
+        """
+        with self._lock:
+            if self._dispatcher_pid == os.getpid():
+                return
+            self._dispatcher_pid = os.getpid()
+        thread = threading.Thread(target=self._dispatch_loop, name="pmc-jobs", daemon=True)
+        thread.start()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            try:
+                self.dispatch()
+            except Exception:
+                # El hilo sigue vivo: el siguiente ciclo vuelve a intentarlo
+                dispatch_log.exception("Error en el despachador de trabajos")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def dispatch(self) -> int:
+        """Reclama trabajos mientras haya procesos libres; devuelve cuántos envió"""
+        self.store.expire(self.max_attempts)
+        executor = self._get_executor()
+        sent = 0
+        while True:
+            with self._lock:
+                if self._in_flight >= self.workers:
+                    return sent
+                self._in_flight += 1
+            job = self.store.claim(self.timeout, self.max_attempts)
+            if job is None:
+                with self._lock:
+                    self._in_flight -= 1
+                return sent
+            try:
+                future = executor.submit(_run_mark_job, self.store.db_path, job["id"], job["claim"], job["params"])
+            except Exception as e:
+                # No llegó al pool: se libera el hueco y el trabajo vuelve a la cola
+                with self._lock:
+                    self._in_flight -= 1
+                self.store.release(job["id"], job["claim"])
+                if isinstance(e, BrokenProcessPool):
+                    self._drop_executor(executor)
+                raise
+            future.add_done_callback(lambda f, job=job, executor=executor: self._on_done(job, executor, f))
+            sent += 1
+
+    def _on_done(self, job: Dict[str, Any], executor: ProcessPoolExecutor, future) -> None:
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+        # Solo hace falta si el proceso del pool murió antes de registrar nada
+        error = future.exception()
+        if error is not None:
+            self.store.finish(job["id"], job["claim"], JOB_FAILED, error=str(error))
+            if isinstance(error, BrokenProcessPool):
+                self._drop_executor(executor)
+        self._wake.set()
+
+    def submit_mark(
+        self,
+        image_path: str,
+        prompt: str,
+        model: str,
+        author: str,
+        job_id: str = None,
+        image: str = None
+    ) -> str:
+        """
+        Encola el marcado de una imagen ya guardada en disco y devuelve el id
+        del trabajo. El trabajo se crea con el archivo ya escrito, así ningún
+        despachador lo reclama antes de tiempo.
+        """
+        params = {
+            "image": image or os.path.basename(image_path),
+            "prompt": prompt,
+            "model": model,
+            "author": author,
+            "image_path": image_path,
+        }
+        job_id = self.store.create("mark", params, job_id)
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+
+_default_queue = None
+
+
+def get_job_queue(default_db: str = None) -> JobQueue:
+    """Cola por defecto configurada desde el entorno"""
+    global _default_queue
+    if _default_queue is None:
+        _default_queue = JobQueue(
+            os.getenv("PMC_JOBS_DB", default_db or DEFAULT_DB_PATH),
+            int(os.getenv("PMC_JOB_WORKERS", "0")) or None,
+            float(os.getenv("PMC_JOB_TIMEOUT", str(DEFAULT_TIMEOUT))),
+            int(os.getenv("PMC_JOB_ATTEMPTS", str(DEFAULT_ATTEMPTS))),
+        )
+    return _default_queue
@@ -0,0 +1,397 @@
+"""
+Cajas JUMBF (ISO 19566-5) para almacenar el manifest C2PA en binario.
+
+Estructura del almacén de manifests que se escribe:
+
+    jumb "c2pa"                      almacén de manifests
+      jumb "urn:uuid:..."            manifest
+        jumb "c2pa.assertions"       almacén de aserciones
+          jumb "<label>" -> cbor     una caja por aserción (datos en CBOR)
+                        [-> pmcf]    sus otros campos en CBOR, si los tiene
+        jumb "c2pa.claim"   -> cbor  claim (campos del manifest)
+        jumb "c2pa.signature" -> cbor
+
+El almacén se incrusta en JPEG (segmentos APP11) o PNG (chunk caBX) y se
+localiza al escanear la cabecera, sin decodificar EXIF ni texto.
+
+Incluye un codificador/decodificador CBOR mínimo (RFC 8949) para los tipos
+de JSON más bytes; si cbor2 está instalado se usa en su lugar.
+"""
+import base64
+import struct
+import uuid
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+# Intentar importar cbor2 (más rápido que el codificador incluido)
+try:
+    import cbor2
+    CBOR2_AVAILABLE = True
+except ImportError:
+    CBOR2_AVAILABLE = False
+
+# UUIDs C2PA: 4 caracteres + sufijo común (ISO/IEC 11578)
+_C2PA_UUID_SUFFIX = bytes.fromhex("00110010800000AA00389B71")
+UUID_MANIFEST_STORE = b"c2pa" + _C2PA_UUID_SUFFIX
+UUID_MANIFEST = b"c2ma" + _C2PA_UUID_SUFFIX
+UUID_ASSERTION_STORE = b"c2as" + _C2PA_UUID_SUFFIX
+UUID_CLAIM = b"c2cl" + _C2PA_UUID_SUFFIX
+UUID_SIGNATURE = b"c2cs" + _C2PA_UUID_SUFFIX
+UUID_CBOR = b"cbor" + _C2PA_UUID_SUFFIX
+
+# Campos de una aserción además de "data" (CBOR). Solo se escribe si hacen
+# falta para reconstruirla tal cual; los lectores C2PA ignoran la caja.
+FIELDS_BOX = b"pmcf"
+
+# Toggles de la caja de descripción: solicitable + con etiqueta
+_JUMD_TOGGLES = 0x03
+
+# Profundidad máxima al decodificar (evita recursión ilimitada con datos hostiles)
+_MAX_DEPTH = 64
+
+
+# --- CBOR ---------------------------------------------------------------------
+
+def _cbor_head(major: int, n: int, out: bytearray) -> None:
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out += bytes((major << 5 | 24, n))
+    elif n < 0x10000:
+        out.append(major << 5 | 25)
+        out += n.to_bytes(2, "big")
+    elif n < 0x100000000:
+        out.append(major << 5 | 26)
+        out += n.to_bytes(4, "big")
+    elif n < 0x10000000000000000:
+        out.append(major << 5 | 27)
+        out += n.to_bytes(8, "big")
+    else:
+        raise ValueError("Entero demasiado grande para CBOR")
+
+
+def _cbor_encode(obj: Any, out: bytearray) -> None:
+    if obj is None:
+        out.append(0xF6)
+    elif obj is True:
+        out.append(0xF5)
+    elif obj is False:
+        out.append(0xF4)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            _cbor_head(0, obj, out)
+        else:
+            _cbor_head(1, -1 - obj, out)
+    elif isinstance(obj, float):
+        out.append(0xFB)
+        out += struct.pack(">d", obj)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _cbor_head(2, len(obj), out)
+        out += obj
+    elif isinstance(obj, str):
+        encoded = obj.encode("utf-8")
+        _cbor_head(3, len(encoded), out)
+        out += encoded
+    elif isinstance(obj, (list, tuple)):
+        _cbor_head(4, len(obj), out)
+        for item in obj:
+            _cbor_encode(item, out)
+    elif isinstance(obj, dict):
+        _cbor_head(5, len(obj), out)
+        for key, value in obj.items():
+            _cbor_encode(key, out)
+            _cbor_encode(value, out)
+    else:
+        raise TypeError(f"Tipo no serializable en CBOR: {type(obj).__name__}")
+
+
+def _cbor_decode(data: bytes, pos: int, depth: int) -> Tuple[Any, int]:
+    if depth > _MAX_DEPTH:
+        raise ValueError("CBOR demasiado anidado")
+    if pos >= len(data):
+        raise ValueError("CBOR truncado")
+    initial = data[pos]
+    pos += 1
+    major, info = initial >> 5, initial & 0x1F
+
+    if major == 7:
+        if info == 20:
+            return False, pos
+        if info == 21:
+            return True, pos
+        if info in (22, 23):
+            return None, pos
+        float_formats = {25: ">e", 26: ">f", 27: ">d"}
+        if info in float_formats:
+            size = struct.calcsize(float_formats[info])
+            if pos + size > len(data):
+                raise ValueError("CBOR truncado")
+            return struct.unpack(float_formats[info], data[pos:pos + size])[0], pos + size
+        raise ValueError(f"Valor simple CBOR no soportado: {info}")
+
+    if info < 24:
+        n = info
+    elif info in (24, 25, 26, 27):
+        size = 1 << (info - 24)
+        if pos + size > len(data):
+            raise ValueError("CBOR truncado")
+        n = int.from_bytes(data[pos:pos + size], "big")
+        pos += size
+    else:
+        raise ValueError("CBOR de longitud indefinida no soportado")
+
+    if major == 0:
+        return n, pos
+    if major == 1:
+        return -1 - n, pos
+    if major in (2, 3):
+        if pos + n > len(data):
+            raise ValueError("CBOR truncado")
+        raw = bytes(data[pos:pos + n])
+        return (raw if major == 2 else raw.decode("utf-8")), pos + n
+    if major == 4:
+        items = []
+        for _ in range(n):
+            item, pos = _cbor_decode(data, pos, depth + 1)
+            items.append(item)
+        return items, pos
+    if major == 5:
+        result = {}
+        for _ in range(n):
+            key, pos = _cbor_decode(data, pos, depth + 1)
+            value, pos = _cbor_decode(data, pos, depth + 1)
+            result[key] = value
+        return result, pos
+    # major == 6: etiqueta semántica, se devuelve el valor etiquetado
+    return _cbor_decode(data, pos, depth + 1)
+
+
+def cbor_dumps(obj: Any) -> bytes:
+    """Serializa `obj` en CBOR"""
+    if CBOR2_AVAILABLE:
+        return cbor2.dumps(obj)
+    out = bytearray()
+    _cbor_encode(obj, out)
+    return bytes(out)
+
+
+def cbor_loads(data: bytes) -> Any:
+    """Decodifica un valor CBOR completo"""
+    if CBOR2_AVAILABLE:
+        return cbor2.loads(data)
+    value, pos = _cbor_decode(data, 0, 0)
+    if pos != len(data):
+        raise ValueError("Datos sobrantes tras el valor CBOR")
+    return value
+
+
+# --- Cajas JUMBF ----------------------------------------------------------------
+
+def box(tbox: bytes, payload: bytes) -> bytes:
+    """Serializa una caja ISO BMFF (LBox + TBox + contenido)"""
+    return struct.pack(">I4s", len(payload) + 8, tbox) + payload
+
+
+def iter_boxes(data: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    """Itera (tipo, contenido) de las cajas consecutivas de `data`"""
+    pos = 0
+    while pos + 8 <= len(data):
+        length, tbox = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if length == 1:
+            if pos + 16 > len(data):
+                raise ValueError("Caja JUMBF truncada")
+            length = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header = 16
+        elif length == 0:
+            length = len(data) - pos
+        if length < header or pos + length > len(data):
+            raise ValueError("Caja JUMBF truncada")
+        yield tbox, data[pos + header:pos + length]
+        pos += length
+
+
+def superbox(box_uuid: bytes, label: str, children: List[bytes]) -> bytes:
+    """Caja "jumb" con su descripción "jumd" y las cajas hijas"""
+    description = box(b"jumd", box_uuid + bytes((_JUMD_TOGGLES,)) + label.encode("utf-8") + b"\x00")
+    return box(b"jumb", description + b"".join(children))
+
+
+def parse_superbox(payload: bytes) -> Tuple[bytes, str, List[Tuple[bytes, bytes]]]:
+    """Devuelve (uuid, etiqueta, hijas) del contenido de una caja "jumb" """
+    boxes = list(iter_boxes(payload))
+    if not boxes or boxes[0][0] != b"jumd" or len(boxes[0][1]) < 17:
+        raise ValueError("Caja JUMBF sin descripción")
+    description = boxes[0][1]
+    box_uuid, toggles = description[:16], description[16]
+    label = ""
+    if toggles & 0x02:
+        label = description[17:].split(b"\x00", 1)[0].decode("utf-8")
+    return box_uuid, label, boxes[1:]
+
+
+def _cbor_superbox(box_uuid: bytes, label: str, value: Any) -> bytes:
+    return superbox(box_uuid, label, [box(b"cbor", cbor_dumps(value))])
+
+
+def _cbor_content(children: List[Tuple[bytes, bytes]]) -> Any:
+    for tbox, payload in children:
+        if tbox == b"cbor":
+            return cbor_loads(payload)
+    raise ValueError("Caja JUMBF sin contenido CBOR")
+
+
+# --- Almacén de manifests C2PA -----------------------------------------------------
+
+# Campos de la firma que van en base64 en JSON y como bytes en CBOR
+_SIGNATURE_BINARY_FIELDS = ("value",)
+_SIGNATURE_BINARY_LISTS = ("certificate_chain",)
+
+
+def _pack_signature(signature: Dict[str, Any]) -> Dict[str, Any]:
+    packed = dict(signature)
+    for field in _SIGNATURE_BINARY_FIELDS:
+        if isinstance(packed.get(field), str):
+            packed[field] = base64.b64decode(packed[field])
+    for field in _SIGNATURE_BINARY_LISTS:
+        if isinstance(packed.get(field), list):
+            packed[field] = [base64.b64decode(c) if isinstance(c, str) else c for c in packed[field]]
+    return packed
+
+
+def _unpack_signature(signature: Dict[str, Any]) -> Dict[str, Any]:
+    unpacked = dict(signature)
+    for field in _SIGNATURE_BINARY_FIELDS:
+        if isinstance(unpacked.get(field), bytes):
+            unpacked[field] = base64.b64encode(unpacked[field]).decode("ascii")
+    for field in _SIGNATURE_BINARY_LISTS:
+        if isinstance(unpacked.get(field), list):
+            unpacked[field] = [
+                base64.b64encode(c).decode("ascii") if isinstance(c, bytes) else c
+                for c in unpacked[field]
+            ]
+    return unpacked
+
+
+def build_manifest_store(manifest: Dict[str, Any], label: str = None) -> bytes:
+    """
+    Serializa el manifest en un almacén JUMBF C2PA. Las aserciones van en
+    cajas CBOR propias; el resto de campos forman el claim.
+
+    read_manifest_store devuelve exactamente el mismo dict: la firma cubre
+    su serialización canónica, así que cualquier campo perdido la rompería.
+    """
+    label = label or f"urn:uuid:{uuid.uuid4()}"
+    claim = {k: v for k, v in manifest.items() if k not in ("assertions", "signature")}
+
+    children = []
+    if "assertions" in manifest:
+        seen: Dict[str, int] = {}
+        assertion_boxes = []
+        for assertion in manifest["assertions"]:
+            name = assertion["label"]
+            # Las etiquetas repetidas se distinguen con el sufijo __N
+            count = seen.get(name, 0)
+            seen[name] = count + 1
+            box_label = name if count == 0 else f"{name}__{count}"
+            assertion_boxes.append(_assertion_box(box_label, assertion))
+        children.append(superbox(UUID_ASSERTION_STORE, "c2pa.assertions", assertion_boxes))
+    children.append(_cbor_superbox(UUID_CLAIM, "c2pa.claim", claim))
+    if "signature" in manifest:
+        children.append(_cbor_superbox(UUID_SIGNATURE, "c2pa.signature", _pack_signature(manifest["signature"])))
+    return superbox(UUID_MANIFEST_STORE, "c2pa", [superbox(UUID_MANIFEST, label, children)])
+
+
+def _assertion_name(box_label: str) -> str:
+    """Etiqueta de la aserción sin el sufijo __N de las repetidas"""
+    base, sep, suffix = box_label.rpartition("__")
+    return base if sep and suffix.isdigit() else box_label
+
+
+def _assertion_box(box_label: str, assertion: Dict[str, Any]) -> bytes:
+    children = []
+    if "data" in assertion:
+        children.append(box(b"cbor", cbor_dumps(assertion["data"])))
+    fields = {k: v for k, v in assertion.items() if k != "data"}
+    # Campos propios, sin "data" o con una etiqueta que ya acaba en __N
+    if fields.keys() != {"label"} or "data" not in assertion or _assertion_name(box_label) != assertion["label"]:
+        children.append(box(FIELDS_BOX, cbor_dumps(fields)))
+    return superbox(UUID_CBOR, box_label, children)
+
+
+def _read_assertion(box_label: str, children: List[Tuple[bytes, bytes]]) -> Dict[str, Any]:
+    payloads = {}
+    for tbox, payload in children:
+        if tbox in (b"cbor", FIELDS_BOX):
+            payloads.setdefault(tbox, payload)
+    if not payloads:
+        raise ValueError(f"Aserción {box_label} sin contenido CBOR")
+    if FIELDS_BOX in payloads:
+        assertion = cbor_loads(payloads[FIELDS_BOX])
+        if not isinstance(assertion, dict):
+            raise ValueError(f"Campos de la aserción {box_label} inválidos")
+    else:
+        assertion = {"label": _assertion_name(box_label)}
+    if b"cbor" in payloads:
+        assertion["data"] = cbor_loads(payloads[b"cbor"])
+    return assertion
+
+
+def is_manifest_store(data: bytes) -> bool:
+    """Indica si `data` es una caja JUMBF con un almacén de manifests C2PA"""
+    # jumb(8) + jumd(8) + uuid(16)
+    return len(data) >= 32 and data[4:8] == b"jumb" and data[12:16] == b"jumd" and data[16:32] == UUID_MANIFEST_STORE
+
+
+def find_manifest_store(boxes: List[bytes]) -> Optional[bytes]:
+    """Primera caja de `boxes` que sea un almacén C2PA (o None)"""
+    for data in boxes:
+        if is_manifest_store(data):
+            return data
+    return None
+
+
+def read_manifest_store(data: bytes) -> Dict[str, Any]:
+    """
+    Reconstruye el manifest activo (el último del almacén) con la misma
+    forma de dict que genera _build_c2pa_manifest más su "signature".
+    """
+    boxes = list(iter_boxes(data))
+    if len(boxes) != 1 or boxes[0][0] != b"jumb":
+        raise ValueError("No es una caja JUMBF")
+    store_uuid, _, manifests = parse_superbox(boxes[0][1])
+    if store_uuid != UUID_MANIFEST_STORE:
+        raise ValueError("La caja JUMBF no es un almacén C2PA")
+
+    active = None
+    for tbox, payload in manifests:
+        if tbox == b"jumb":
+            box_uuid, _, children = parse_superbox(payload)
+            if box_uuid == UUID_MANIFEST:
+                active = children
+    if active is None:
+        raise ValueError("Almacén C2PA sin manifests")
+
+    manifest: Dict[str, Any] = {}
+    assertions = None
+    signature = None
+    for tbox, payload in active:
+        if tbox != b"jumb":
+            continue
+        box_uuid, label, children = parse_superbox(payload)
+        if box_uuid == UUID_CLAIM:
+            manifest.update(_cbor_content(children))
+        elif box_uuid == UUID_SIGNATURE:
+            signature = _unpack_signature(_cbor_content(children))
+        elif box_uuid == UUID_ASSERTION_STORE:
+            assertions = []
+            for child_type, child in children:
+                if child_type != b"jumb":
+                    continue
+                _, assertion_label, assertion_children = parse_superbox(child)
+                assertions.append(_read_assertion(assertion_label, assertion_children))
+
+    if assertions is not None:
+        manifest["assertions"] = assertions
+    if signature is not None:
+        manifest["signature"] = signature
+    return manifest
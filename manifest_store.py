@@ -0,0 +1,296 @@
+"""
+Almacén de manifests de las imágenes marcadas.
+
+Dos implementaciones con la misma interfaz (save / lookup):
+
+- SidecarManifestStore (por defecto): un archivo <imagen>_manifest.json
+  junto a cada imagen, como hasta ahora.
+- SQLiteManifestStore: una base SQLite (WAL) indexada por la ruta de la
+  imagen, por el hash del contenido marcado y por instance_id, con índices
+  por modelo, autor y fecha. Como el sidecar, encuentra el manifest de una
+  ruta aunque la imagen haya perdido sus metadatos; el hash cubre las
+  imágenes que llegan como bytes subidos y conservan sus marcas.
+
+Configuración por variables de entorno:
+    PMC_MANIFEST_STORE  "sidecar" (por defecto) o "sqlite"
+    PMC_MANIFEST_DB     Ruta de la base SQLite (por defecto uploads/manifests.sqlite3
+                        junto a este módulo)
+
+Uso (exportar la base a archivos sidecar):
+    python manifest_store.py export [--dest DIRECTORIO]
+"""
+import os
+import sys
+import json
+import stat
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Iterator, List, Optional
+
+from c2pa_manifest import C2PAManifest
+from provenance_search import index_path
+
+# Junto al código, como la cola de trabajos: no depende del directorio actual
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads", "manifests.sqlite3")
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """
+    Escribe el archivo completo en un temporal del mismo directorio y lo
+    renombra, para que ningún lector vea nunca un archivo a medio escribir.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def manifest_path_for(image_path: str) -> str:
+    """Retorna la ruta del manifest sidecar para una imagen"""
+    base, _ = os.path.splitext(image_path)
+    return f"{base}_manifest.json"
+
+
+def sidecar_bytes(record: Dict[str, Any]) -> bytes:
+    """
+    Serializa un manifest sidecar. El manifest C2PA se copia con sus bytes
+    firmados, sin re-serializarlo.
+    """
+    record = dict(record)
+    c2pa_manifest = record.pop("c2pa_manifest", None)
+    content = json.dumps(record, indent=4, ensure_ascii=False).encode("utf-8")
+    if c2pa_manifest is not None:
+        content = (
+            content[:-2]
+            + b',\n    "c2pa_manifest": '
+            + C2PAManifest.coerce(c2pa_manifest).to_bytes()
+            + b"\n}"
+        )
+    return content
+
+
+class SidecarManifestStore:
+    """Un archivo JSON junto a cada imagen (comportamiento por defecto)"""
+
+    kind = "sidecar"
+
+    def save(
+        self,
+        image_path: str,
+        record: Dict[str, Any],
+        content_hash: str,
+        instance_id: str = None,
+        model: str = None,
+        author: str = None,
+        created_at: str = None
+    ) -> str:
+        """Guarda el manifest y devuelve dónde quedó"""
+        manifest_path = manifest_path_for(image_path)
+        atomic_write_bytes(manifest_path, sidecar_bytes(record))
+        return manifest_path
+
+    def lookup(
+        self,
+        image_path: Optional[str],
+        content_hash: Optional[Callable[[], str]]
+    ) -> Optional[Dict[str, Any]]:
+        """Manifest de la imagen, o None. El hash no se calcula nunca."""
+        if image_path is None:
+            return None
+        try:
+            with open(manifest_path_for(image_path), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+
+class SQLiteManifestStore:
+    """Manifests en SQLite indexados por ruta, hash de contenido e instance_id"""
+
+    kind = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Conexión perezosa, reabierta tras un fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifests ("
+                "content_hash TEXT PRIMARY KEY, instance_id TEXT, image TEXT, "
+                "model TEXT, author TEXT, created_at TEXT, stored_at REAL NOT NULL, "
+                "manifest BLOB NOT NULL)"
+            )
+            for column in ("image", "instance_id", "model", "author", "created_at"):
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS manifests_{column} ON manifests ({column})"
+                )
+            self._conn.commit()
+        return self._conn
+
+    def save(
+        self,
+        image_path: str,
+        record: Dict[str, Any],
+        content_hash: str,
+        instance_id: str = None,
+        model: str = None,
+        author: str = None,
+        created_at: str = None
+    ) -> str:
+        """Guarda (o reemplaza) el manifest del contenido y devuelve su ubicación"""
+        created_at = created_at or datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO manifests "
+                "(content_hash, instance_id, image, model, author, created_at, stored_at, manifest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    content_hash, instance_id, index_path(image_path), model, author,
+                    created_at, time.time(), sidecar_bytes(record),
+                )
+            )
+            self._db.commit()
+        return f"{self.db_path}#{content_hash[:16]}"
+
+    def lookup(
+        self,
+        image_path: Optional[str],
+        content_hash: Optional[Callable[[], str]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Manifest de la imagen, o None. Primero por ruta (el último guardado
+        para ella) y, si no hay, por hash del contenido. Sin `content_hash`
+        (la imagen no tiene marcas, así que no puede ser un contenido
+        marcado) el hash no se calcula.
+        """
+        row = None
+        with self._lock:
+            if image_path is not None:
+                row = self._db.execute(
+                    "SELECT manifest FROM manifests WHERE image = ? ORDER BY stored_at DESC LIMIT 1",
+                    (index_path(image_path),)
+                ).fetchone()
+        if row is None and content_hash is not None:
+            digest = content_hash()
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT manifest FROM manifests WHERE content_hash = ?", (digest,)
+                ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def find(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """Manifest por instance_id del manifest C2PA, o None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT manifest FROM manifests WHERE instance_id = ? ORDER BY stored_at DESC LIMIT 1",
+                (instance_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM manifests").fetchone()[0]
+
+    def _iter_rows(self, batch_size: int = 500) -> Iterator[tuple]:
+        # Por lotes ordenados por clave, sin retener el cerrojo entre lotes
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT content_hash, image, manifest FROM manifests "
+                    "WHERE content_hash > ? ORDER BY content_hash LIMIT ?",
+                    (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def export_sidecars(self, dest_dir: str = None) -> List[str]:
+        """
+        Escribe cada manifest como archivo sidecar: junto a su imagen o, con
+        dest_dir, en ese directorio. Devuelve las rutas escritas.
+        """
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        written = []
+        for content_hash, image, manifest in self._iter_rows():
+            if dest_dir:
+                base = os.path.splitext(os.path.basename(image or content_hash[:16]))[0]
+                path = os.path.join(dest_dir, f"{base}_{content_hash[:12]}_manifest.json")
+            else:
+                path = manifest_path_for(image)
+            atomic_write_bytes(path, bytes(manifest))
+            written.append(path)
+        return written
+
+
+_default_store = None
+
+
+def get_manifest_store():
+    """Almacén configurado por PMC_MANIFEST_STORE / PMC_MANIFEST_DB"""
+    global _default_store
+    kind = os.getenv("PMC_MANIFEST_STORE", "sidecar").strip().lower()
+    if kind == "sqlite":
+        db_path = os.getenv("PMC_MANIFEST_DB", DEFAULT_DB_PATH)
+        if not isinstance(_default_store, SQLiteManifestStore) or _default_store.db_path != db_path:
+            _default_store = SQLiteManifestStore(db_path)
+    elif kind == "sidecar":
+        if not isinstance(_default_store, SidecarManifestStore):
+            _default_store = SidecarManifestStore()
+    else:
+        raise ValueError(f"PMC_MANIFEST_STORE desconocido: {kind}")
+    return _default_store
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Herramientas del almacén de manifests")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Exportar la base SQLite a archivos sidecar")
+    export.add_argument("--db", default=os.getenv("PMC_MANIFEST_DB", DEFAULT_DB_PATH), help="Base SQLite")
+    export.add_argument("--dest", default=None, help="Directorio destino (por defecto, junto a cada imagen)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"❌ Base de manifests no encontrada: {args.db}", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    written = SQLiteManifestStore(args.db).export_sidecars(args.dest)
+    elapsed = time.perf_counter() - start
+    print(f"✓ {len(written)} manifests exportados en {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
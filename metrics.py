@@ -0,0 +1,558 @@
+"""
+Métricas de rendimiento: temporizadores por etapa y contadores.
+
+Pensado para dejarlo activo en producción: medir una etapa cuesta dos
+lecturas de perf_counter y una actualización bajo un cerrojo sin contención
+(unos 2 µs), y no se guarda nada por petición salvo un pequeño dict.
+
+- stage("nombre"): temporizador (histograma pmc_stage_seconds{stage=...})
+  que además suma su duración en el registro de la petición en curso.
+- inc("pmc_..._total", valor, etiqueta=...): contador.
+- set_gauge("pmc_...", valor): gauge del proceso.
+- begin_request() / end_request(): registro por petición (etapas, bytes,
+  origen de la detección) para la línea de log estructurada.
+- render(): formato de exposición de Prometheus para /metrics.
+
+Los valores se guardan por proceso. Con PMC_METRICS_DB (lo que hace
+web_app) cada proceso vuelca los suyos a un SQLite compartido, como el modo
+multiproceso de prometheus_client: un hilo los escribe cada FLUSH_INTERVAL
+segundos, y render() suma los de todos los workers de gunicorn y sus pools
+de procesos. Al salir, cada proceso pasa sus contadores e histogramas a unos
+totales retirados y borra sus filas, así la tabla no crece con cada worker
+reciclado y los ya terminados se siguen sumando. Las filas van por pid y
+hora de arranque: un pid reutilizado nunca pisa las de otro proceso. Los
+gauges se exponen por proceso (etiqueta "pid"). Sin PMC_METRICS_DB cada
+proceso expone solo sus valores, con la etiqueta "pid".
+
+Configuración por variables de entorno:
+    PMC_METRICS     "0" desactiva la instrumentación (por defecto activa)
+    PMC_METRICS_DB  SQLite compartido por todos los procesos (opcional)
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+import multiprocessing.util
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("PMC_METRICS", "1") != "0"
+
+# Límites (segundos) de los histogramas: de 100 µs a 10 s
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HELP = {
+    "pmc_stage_seconds": ("histogram", "Duración de cada etapa de detección/marcado"),
+    "pmc_request_seconds": ("histogram", "Duración de las peticiones HTTP"),
+    "pmc_requests_total": ("counter", "Peticiones HTTP por endpoint y código"),
+    "pmc_detections_total": ("counter", "Detecciones por origen que decidió el resultado"),
+    "pmc_bytes_read_total": ("counter", "Bytes de imagen leídos o recibidos"),
+    "pmc_cache_lookups_total": ("counter", "Consultas a la caché de detección"),
+    "pmc_cache_entries": ("gauge", "Entradas en la caché de detección en memoria"),
+    "pmc_cache_evictions_total": ("counter", "Entradas expulsadas de la caché de detección"),
+    "pmc_index_errors_total": ("counter", "Fallos al registrar una imagen marcada en los índices pHash/búsqueda"),
+}
+
+# Segundos entre volcados al SQLite compartido
+FLUSH_INTERVAL = 1.0
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_COUNTER, _HISTOGRAM, _GAUGE = "counter", "histogram", "gauge"
+
+# Identidad del proceso en el SQLite compartido: (pid, arranque en ns)
+_started = time.time_ns()
+# Fila de los totales de procesos ya terminados
+_RETIRED = (0, 0)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+_histograms: Dict[Tuple[str, Labels], list] = {}
+_gauges: Dict[Tuple[str, Labels], float] = {}
+# Series modificadas desde el último volcado: (tipo, clave)
+_dirty: set = set()
+
+# Registro de la petición en curso (funciona con hilos y con asyncio)
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("pmc_metrics_request", default=None)
+
+
+@lru_cache(maxsize=4096)
+def _normalized_key(name: str, items: tuple) -> Tuple[str, Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in items))
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Labels]:
+    # Las combinaciones de etiquetas se repiten: ordenarlas una sola vez
+    return _normalized_key(name, tuple(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Incrementa un contador (y el de la petición en curso, si la hay)"""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _dirty.add((_COUNTER, key))
+    if not _flusher_started:
+        _start_flusher()
+    record = _current.get()
+    if record is not None:
+        counters = record["counters"]
+        field = name if not labels else f"{name}:{','.join(str(v) for v in labels.values())}"
+        counters[field] = counters.get(field, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Fija el valor de un gauge de este proceso"""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+        _dirty.add((_GAUGE, key))
+    if not _flusher_started:
+        _start_flusher()
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Añade una observación a un histograma"""
+    if METRICS_ENABLED:
+        _observe(_key(name, labels), seconds)
+
+
+def _observe(key: Tuple[str, Labels], seconds: float) -> None:
+    index = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # [cuenta por bucket..., +Inf, suma]
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[index] += 1
+        histogram[-1] += seconds
+        _dirty.add((_HISTOGRAM, key))
+    if not _flusher_started:
+        _start_flusher()
+
+
+@lru_cache(maxsize=256)
+def _stage_key(name: str) -> Tuple[str, Labels]:
+    return _key("pmc_stage_seconds", {"stage": name})
+
+
+class _Stage:
+    __slots__ = ("name", "_key", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._key = _stage_key(name)
+
+    def __enter__(self) -> "_Stage":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not METRICS_ENABLED:
+            return
+        elapsed = time.perf_counter() - self._start
+        _observe(self._key, elapsed)
+        record = _current.get()
+        if record is not None:
+            stages = record["stages"]
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed
+
+
+def stage(name: str) -> _Stage:
+    """
+    Temporizador de una etapa:
+
+        with metrics.stage("exif"):
+            ...
+    """
+    return _Stage(name)
+
+
+def begin_request() -> None:
+    """Empieza el registro de una petición en el contexto actual"""
+    _current.set({"start": time.perf_counter(), "stages": {}, "counters": {}})
+
+
+def end_request() -> Optional[Dict[str, Any]]:
+    """
+    Cierra el registro de la petición y lo devuelve con la duración total y
+    las etapas en milisegundos (None si no se había empezado).
+    """
+    record = _current.get()
+    if record is None:
+        return None
+    _current.set(None)
+    return {
+        "duration_ms": round((time.perf_counter() - record["start"]) * 1000, 3),
+        "stages_ms": {k: round(v * 1000, 3) for k, v in record["stages"].items()},
+        "counters": record["counters"],
+    }
+
+
+# --- Volcado entre procesos --------------------------------------------------------
+
+class _SharedStore:
+    """
+    Valores de cada proceso en un SQLite compartido: una fila por proceso
+    (pid y arranque) y serie, más los totales retirados (pid 0)
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # El hilo de volcado y render() comparten la conexión
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Conexión perezosa, reabierta tras un fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Tablas sin la hora de arranque: sus valores se descartan (el
+            # servidor vacía la tabla al arrancar de todos modos)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(metric_values)")}
+            if columns and "started" not in columns:
+                self._conn.execute("DROP TABLE metric_values")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_values ("
+                "pid INTEGER NOT NULL, started INTEGER NOT NULL, kind TEXT NOT NULL, "
+                "name TEXT NOT NULL, labels TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (pid, started, kind, name, labels))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def write(self, pid: int, started: int, rows: list) -> None:
+        with self._lock:
+            self._upsert(pid, started, rows)
+            self._db.commit()
+
+    def _upsert(self, pid: int, started: int, rows: list) -> None:
+        self._db.executemany(
+            "INSERT INTO metric_values (pid, started, kind, name, labels, value) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(pid, started, kind, name, labels) DO UPDATE SET value = excluded.value",
+            [(pid, started) + row for row in rows]
+        )
+
+    def read(self) -> list:
+        with self._lock:
+            return self._db.execute("SELECT pid, kind, name, labels, value FROM metric_values").fetchall()
+
+    def retire(self, pid: int, started: int = None, before: int = None, rows: list = ()) -> None:
+        """
+        Suma los contadores e histogramas de un proceso terminado (tras
+        escribir sus últimas `rows`) a los totales retirados y borra todas
+        sus filas, gauges incluidos. Sin `started`, todos los procesos con
+        ese pid arrancados antes de `before`.
+        """
+        where, params = "pid = ?", [pid]
+        if started is not None:
+            where += " AND started = ?"
+            params.append(started)
+        if before is not None:
+            where += " AND started < ?"
+            params.append(before)
+        with self._lock:
+            db = self._db
+            # BEGIN IMMEDIATE: dos procesos no pueden sumar los mismos totales a la vez
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if rows:
+                    self._upsert(pid, started, rows)
+                totals = {
+                    (kind, name, labels): json.loads(value)
+                    for kind, name, labels, value in db.execute(
+                        "SELECT kind, name, labels, value FROM metric_values WHERE pid = ? AND started = ?",
+                        _RETIRED
+                    )
+                }
+                changed = set()
+                for kind, name, labels, value in db.execute(
+                    f"SELECT kind, name, labels, value FROM metric_values WHERE {where} AND kind != ?",
+                    params + [_GAUGE]
+                ).fetchall():
+                    key = (kind, name, labels)
+                    totals[key] = _add(kind, totals.get(key), json.loads(value))
+                    changed.add(key)
+                self._upsert(*_RETIRED, [key + (json.dumps(totals[key]),) for key in changed])
+                db.execute(f"DELETE FROM metric_values WHERE {where}", params)
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM metric_values")
+            self._db.commit()
+
+
+_store: Optional[_SharedStore] = None
+_store_lock = threading.Lock()
+# _flusher_started: ya se miró la configuración en este proceso;
+# _flusher_thread: ya hay hilo de volcado en este proceso
+_flusher_started = False
+_flusher_thread = False
+_exit_hook_registered = False
+
+
+def _shared_store() -> Optional[_SharedStore]:
+    global _store
+    db_path = os.getenv("PMC_METRICS_DB") or None
+    if db_path is None:
+        return None
+    if _store is None or _store.db_path != db_path:
+        _store = _SharedStore(db_path)
+    return _store
+
+
+def configure(db_path: Optional[str]) -> None:
+    """
+    Activa (o, con None, desactiva) el volcado a `db_path`. Se guarda en
+    PMC_METRICS_DB para que lo hereden los pools de procesos.
+    """
+    global _flusher_started
+    if db_path:
+        os.environ["PMC_METRICS_DB"] = db_path
+    else:
+        os.environ.pop("PMC_METRICS_DB", None)
+    with _store_lock:
+        _flusher_started = False
+
+
+def clear_shared(db_path: str) -> None:
+    """Borra los valores volcados (al arrancar el servidor, como con prometheus_client)"""
+    _SharedStore(db_path).clear()
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Retira los valores de un proceso terminado que no lo hizo al salir (un
+    worker que murió): sus contadores se siguen sumando, sus gauges no. Solo
+    las filas de antes de la llamada, por si el pid ya se reutilizó.
+    """
+    store = _shared_store()
+    if store is not None:
+        store.retire(pid, before=time.time_ns())
+
+
+def retire() -> None:
+    """
+    Pasa los valores de este proceso a los totales retirados del SQLite
+    compartido y empieza de cero (al salir un worker o un proceso del pool).
+    """
+    store = _shared_store()
+    if store is None:
+        return
+    with _lock:
+        rows = [(_COUNTER, name, json.dumps(labels), json.dumps(value)) for (name, labels), value in _counters.items()]
+        rows += [(_HISTOGRAM, name, json.dumps(labels), json.dumps(value)) for (name, labels), value in _histograms.items()]
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+        _dirty.clear()
+    try:
+        store.retire(os.getpid(), _started, rows=rows)
+    except sqlite3.Error:
+        # Al salir no hay reintento: se pierde como mucho el último intervalo
+        pass
+
+
+def _start_flusher() -> None:
+    global _flusher_started, _flusher_thread, _exit_hook_registered
+    with _store_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+        if _flusher_thread or _shared_store() is None:
+            return
+        _flusher_thread = True
+        threading.Thread(target=_flush_loop, name="pmc-metrics", daemon=True).start()
+        # atexit cubre los workers de gunicorn; los procesos de multiprocessing
+        # salen con os._exit y solo ejecutan sus finalizadores
+        multiprocessing.util.Finalize(None, _retire_at_exit, exitpriority=10)
+        if not _exit_hook_registered:
+            _exit_hook_registered = True
+            atexit.register(_retire_at_exit)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _retire_at_exit() -> None:
+    if _flusher_thread:
+        retire()
+
+
+def flush() -> None:
+    """Vuelca a PMC_METRICS_DB las series de este proceso que cambiaron"""
+    store = _shared_store()
+    if store is None:
+        return
+    with _lock:
+        dirty = list(_dirty)
+        _dirty.clear()
+        rows = []
+        for kind, key in dirty:
+            name, labels = key
+            if kind == _COUNTER:
+                value = _counters.get(key)
+            elif kind == _HISTOGRAM:
+                value = _histograms.get(key)
+            else:
+                value = _gauges.get(key)
+            if value is not None:
+                rows.append((kind, name, json.dumps(labels), json.dumps(value)))
+    if not rows:
+        return
+    try:
+        store.write(os.getpid(), _started, rows)
+    except sqlite3.Error:
+        # Las métricas no deben romper el servicio: se reintenta en el siguiente volcado
+        with _lock:
+            _dirty.update(dirty)
+
+
+def _after_fork_in_child() -> None:
+    # Los valores heredados son del padre (que ya los expone): el hijo
+    # empieza de cero y arranca su propio hilo de volcado
+    global _lock, _store, _store_lock, _flusher_started, _flusher_thread, _started
+    _lock = threading.Lock()
+    _started = time.time_ns()
+    _store = None
+    _store_lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _gauges.clear()
+    _dirty.clear()
+    _flusher_started = False
+    _flusher_thread = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _add(kind: str, total, value):
+    """Suma dos valores de un contador o de un histograma (total puede ser None)"""
+    if total is None:
+        return value
+    if kind == _COUNTER:
+        return total + value
+    return [a + b for a, b in zip(total, value)]
+
+
+def _aggregate(rows: list) -> Tuple[dict, dict, dict]:
+    """Suma contadores e histogramas de todos los procesos; gauges por pid"""
+    counters: Dict[Tuple[str, Labels], float] = {}
+    histograms: Dict[Tuple[str, Labels], list] = {}
+    gauges: Dict[Tuple[str, Labels], float] = {}
+    for pid, kind, name, labels, value in rows:
+        labels = tuple(tuple(item) for item in json.loads(labels))
+        value = json.loads(value)
+        if kind == _COUNTER:
+            key = (name, labels)
+            counters[key] = _add(kind, counters.get(key), value)
+        elif kind == _HISTOGRAM:
+            key = (name, labels)
+            histograms[key] = _add(kind, histograms.get(key), value)
+        else:
+            gauges[(name, labels + (("pid", str(pid)),))] = value
+    return counters, histograms, gauges
+
+
+# --- Exposición ----------------------------------------------------------------
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(extra: Dict[str, float] = None) -> str:
+    """
+    Todas las métricas en formato de exposición de Prometheus. `extra`
+    añade gauges de este proceso calculados fuera. Con PMC_METRICS_DB los
+    contadores e histogramas son la suma de todos los procesos.
+    """
+    pid = str(os.getpid())
+    store = _shared_store()
+    if store is not None:
+        flush()
+        counters, histograms, gauges = _aggregate(store.read())
+        process_labels: Labels = ()
+    else:
+        with _lock:
+            counters = dict(_counters)
+            histograms = {k: list(v) for k, v in _histograms.items()}
+            gauges = {(name, labels + (("pid", pid),)): v for (name, labels), v in _gauges.items()}
+        process_labels = (("pid", pid),)
+
+    lines = []
+    seen = set()
+
+    def header(name: str) -> None:
+        if name not in seen:
+            seen.add(name)
+            kind, help_text = _HELP.get(name, ("gauge", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name)
+        lines.append(f"{name}{_format_labels(labels + process_labels)} {_number(value)}")
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram[:-1]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),) + process_labels)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels + process_labels)} {_number(histogram[-1])}")
+        lines.append(f"{name}_count{_format_labels(labels + process_labels)} {cumulative}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name)
+        lines.append(f"{name}{_format_labels(labels)} {_number(value)}")
+
+    for name, value in sorted((extra or {}).items()):
+        header(name)
+        lines.append(f"{name}{_format_labels((('pid', pid),))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Pone a cero todas las métricas del proceso"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+        _dirty.clear()
@@ -0,0 +1,232 @@
+"""
+Índice de hashes perceptuales (pHash) de las imágenes marcadas.
+
+Permite reconocer una imagen marcada aunque una plataforma haya eliminado
+sus metadatos o la haya recodificado: se compara el contenido visual, no
+los bytes.
+
+pHash: escala de grises 32x32, DCT 2D, se toman los 8x8 coeficientes de
+baja frecuencia y cada bit indica si el coeficiente supera la mediana.
+Con NumPy la DCT es un producto de matrices; sin NumPy se usa la misma
+fórmula en Python puro (más lento, pero sin dependencias).
+
+Búsqueda por "multi-index hashing": el hash de 64 bits se divide en 4
+trozos de 16 bits indexados en SQLite. Si dos hashes están a distancia de
+Hamming <= d, al menos un trozo está a distancia <= d // 4, así que basta
+con consultar cada trozo con sus vecinos a esa distancia y filtrar.
+
+Una imagen casi uniforme (un color plano) no tiene pHash útil: sus
+coeficientes AC son ruido numérico y coincidiría con cualquier otra imagen
+plana. Esas imágenes no se indexan ni se buscan.
+
+Configuración por variables de entorno:
+    PMC_PHASH_DB            Ruta del archivo SQLite del índice (sin ella, desactivado)
+    PMC_PHASH_MAX_DISTANCE  Distancia de Hamming máxima para considerar coincidencia (por defecto 8)
+"""
+import io
+import os
+import math
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, Any, List, Optional
+
+from PIL import Image
+
+# Intentar importar numpy (DCT vectorizada)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+HASH_SIZE = 8
+SAMPLE_SIZE = 32
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+DEFAULT_MAX_DISTANCE = 8
+
+# Desviación típica mínima (niveles de gris de la muestra 32x32) para que
+# el pHash signifique algo
+MIN_STDDEV = 2.0
+
+# Variables por consulta en SQLite anteriores a 3.32 (SQLITE_MAX_VARIABLE_NUMBER)
+MAX_SQL_VARIABLES = 999
+
+
+@lru_cache(maxsize=1)
+def _dct_rows() -> List[List[float]]:
+    """Filas de la matriz DCT-II (solo las HASH_SIZE de baja frecuencia)"""
+    n = SAMPLE_SIZE
+    return [
+        [math.cos(math.pi * (2 * x + 1) * u / (2 * n)) for x in range(n)]
+        for u in range(HASH_SIZE)
+    ]
+
+
+def _low_frequencies(pixels: List[int]) -> List[float]:
+    """Coeficientes DCT 8x8 de baja frecuencia de una imagen 32x32"""
+    rows = _dct_rows()
+    n = SAMPLE_SIZE
+    if NUMPY_AVAILABLE:
+        d = np.asarray(rows)
+        x = np.asarray(pixels, dtype=np.float64).reshape(n, n)
+        return (d @ x @ d.T).ravel().tolist()
+    # D · X · Dᵀ en Python puro
+    image = [pixels[i * n:(i + 1) * n] for i in range(n)]
+    partial = [[sum(r[y] * image[y][x] for y in range(n)) for x in range(n)] for r in rows]
+    return [sum(p[x] * c[x] for x in range(n)) for p in partial for c in rows]
+
+
+def compute_phash(source) -> Optional[int]:
+    """
+    pHash de 64 bits de una imagen (ruta, bytes o stream), o None si la
+    imagen es casi uniforme. Decodifica los píxeles, pero en JPEG pide a
+    Pillow una versión reducida (draft).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img.draft("L", (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        small = img.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+        pixels = list(small.getdata())
+    mean = sum(pixels) / len(pixels)
+    if sum((p - mean) ** 2 for p in pixels) / len(pixels) < MIN_STDDEV ** 2:
+        return None
+    coefficients = _low_frequencies(pixels)
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def is_degenerate(phash: int) -> bool:
+    """Hash sin información (todos los bits iguales): no se busca"""
+    return phash in (0, (1 << 64) - 1)
+
+
+def _chunks(value: int) -> List[int]:
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNKS)]
+
+
+@lru_cache(maxsize=4)
+def _neighbour_masks(radius: int) -> List[int]:
+    """Máscaras XOR con hasta `radius` bits activos dentro de un trozo"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return masks
+
+
+def _to_signed(value: int) -> int:
+    # SQLite guarda enteros de 64 bits con signo
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class PHashIndex:
+    """Índice pHash en SQLite con búsqueda por multi-index hashing"""
+
+    def __init__(self, db_path: str, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Conexión perezosa, reabierta tras un fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS phash ("
+                "id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, "
+                "c0 INTEGER NOT NULL, c1 INTEGER NOT NULL, c2 INTEGER NOT NULL, c3 INTEGER NOT NULL, "
+                "image TEXT, instance_id TEXT, model TEXT, author TEXT, created_at REAL NOT NULL)"
+            )
+            for i in range(CHUNKS):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS phash_c{i} ON phash (c{i})")
+            self._conn.commit()
+        return self._conn
+
+    def add(self, phash: int, image: str = None, instance_id: str = None, model: str = None, author: str = None) -> None:
+        """Registra el pHash de una imagen marcada"""
+        c = _chunks(phash)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO phash (hash, c0, c1, c2, c3, image, instance_id, model, author, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (_to_signed(phash), c[0], c[1], c[2], c[3], image, instance_id, model, author, time.time())
+            )
+            self._db.commit()
+
+    def query(self, phash: int, max_distance: int = None) -> Optional[Dict[str, Any]]:
+        """Entrada más cercana a distancia <= max_distance (o None)"""
+        if is_degenerate(phash):
+            return None
+        max_distance = self.max_distance if max_distance is None else max_distance
+        masks = _neighbour_masks(max_distance // CHUNKS)
+        best = None
+        with self._lock:
+            for i, chunk in enumerate(_chunks(phash)):
+                probes = [chunk ^ mask for mask in masks]
+                rows = []
+                # Con distancias grandes hay miles de vecinos: por tandas
+                for start in range(0, len(probes), MAX_SQL_VARIABLES):
+                    batch = probes[start:start + MAX_SQL_VARIABLES]
+                    rows += self._db.execute(
+                        "SELECT hash, image, instance_id, model, author, created_at FROM phash "
+                        f"WHERE c{i} IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                for row in rows:
+                    distance = hamming(phash, _to_unsigned(row[0]))
+                    if distance <= max_distance and (best is None or distance < best["distance"]):
+                        best = {
+                            "distance": distance,
+                            "phash": f"{_to_unsigned(row[0]):016x}",
+                            "image": row[1],
+                            "instance_id": row[2],
+                            "model": row[3],
+                            "author": row[4],
+                            "indexed_at": row[5],
+                        }
+                if best is not None and best["distance"] == 0:
+                    break
+        return best
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM phash").fetchone()[0]
+
+
+_default_index = None
+
+
+def get_default_index() -> Optional[PHashIndex]:
+    """Índice configurado por PMC_PHASH_DB (None si no está configurado)"""
+    global _default_index
+    db_path = os.getenv("PMC_PHASH_DB")
+    if not db_path:
+        return None
+    if _default_index is None or _default_index.db_path != db_path:
+        _default_index = PHashIndex(
+            db_path,
+            int(os.getenv("PMC_PHASH_MAX_DISTANCE", str(DEFAULT_MAX_DISTANCE))),
+        )
+    return _default_index
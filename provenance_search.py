@@ -0,0 +1,307 @@
+"""
+Búsqueda de procedencia sobre las imágenes marcadas o detectadas como IA.
+
+Guarda en SQLite los campos que ya extrae detect_image_status_c2pa (modelo,
+prompt, fecha de creación, claim_generator y tipo de firma) para responder
+preguntas como "qué imágenes generó el modelo X la semana pasada" sin volver
+a analizar cada archivo.
+
+- Texto libre sobre los prompts con FTS5 (si el SQLite de Python no lo
+  incluye, se usa LIKE, mucho más lento en corpus grandes).
+- Rangos de fechas y filtros por modelo con índices compuestos que ya
+  devuelven las filas en el orden de la respuesta.
+- Paginación por cursor (fecha, id): cada página cuesta lo mismo sin
+  importar lo profunda que sea, a diferencia de OFFSET.
+
+Configuración por variables de entorno:
+    PMC_SEARCH_DB  Ruta del archivo SQLite del índice (sin ella, desactivado)
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+from datetime import date, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_COLUMNS = (
+    "image", "instance_id", "source", "model", "prompt",
+    "created_date", "claim_generator", "signature_type",
+)
+
+_MISSING = {"", "N/A"}
+
+
+def _clean(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value)
+    return None if value in _MISSING else value
+
+
+def _created_date(manifest: Dict[str, Any]) -> Optional[str]:
+    """Fecha de la acción c2pa.created de un manifest C2PA"""
+    for assertion in manifest.get("assertions", []):
+        if assertion.get("label") == "c2pa.actions":
+            for action in assertion.get("data", {}).get("actions", []):
+                if action.get("action") == "c2pa.created":
+                    return action.get("when")
+    return None
+
+
+def index_path(path: str) -> str:
+    """
+    Ruta con la que se indexa una imagen: absoluta y sin enlaces simbólicos,
+    para que el marcado y batch_detect --index escriban la misma fila.
+    """
+    return os.path.abspath(os.path.realpath(path))
+
+
+def fields_from_result(result: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Campos indexables de un resultado de detect_image_status_c2pa"""
+    details = result.get("details") or {}
+    c2pa_info = result.get("c2pa_info") or {}
+    metadata = result.get("metadata") or {}
+    source = result.get("source")
+
+    fields = {
+        "image": result.get("image"),
+        "instance_id": None,
+        "source": source,
+        "model": details.get("model", details.get("AI-Model")),
+        "prompt": details.get("prompt", details.get("AI-Prompt")),
+        "created_date": details.get("created_date"),
+        "claim_generator": details.get("claim_generator"),
+        "signature_type": c2pa_info.get("signature_type"),
+    }
+    if source == "c2pa_manifest":
+        fields["instance_id"] = metadata.get("instance_id")
+    elif source == "sidecar_manifest" and isinstance(details.get("c2pa_manifest"), dict):
+        # El sidecar lleva una copia del manifest C2PA firmado
+        manifest = details["c2pa_manifest"]
+        fields["instance_id"] = manifest.get("instance_id")
+        fields["created_date"] = _created_date(manifest)
+        fields["claim_generator"] = manifest.get("claim_generator")
+        fields["signature_type"] = manifest.get("signature", {}).get("type")
+    elif source == "phash_index":
+        fields["instance_id"] = details.get("instance_id")
+    return {k: _clean(v) for k, v in fields.items()}
+
+
+def _fts_query(text: str) -> Optional[str]:
+    # Cada palabra como término entre comillas (con prefijo): la sintaxis
+    # de FTS5 del usuario nunca llega a MATCH
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+def _date_bounds(date_from: str = None, date_to: str = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Límites [desde, hasta) sobre fechas ISO 8601, que se comparan como texto.
+    Una fecha sin hora en date_to incluye el día completo.
+    """
+    if date_to and len(date_to) == 10:
+        date_to = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+    return date_from or None, date_to or None
+
+
+def _encode_cursor(created_date: str, row_id: int) -> str:
+    return f"{row_id}:{created_date}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    row_id, _, created_date = cursor.partition(":")
+    try:
+        return created_date, int(row_id)
+    except ValueError:
+        raise ValueError(f"Cursor no válido: {cursor}")
+
+
+class ProvenanceIndex:
+    """Índice de procedencia en SQLite con FTS5 sobre los prompts"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.fts = False
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Conexión perezosa, reabierta tras un fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS provenance ("
+                "id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, image TEXT, instance_id TEXT, "
+                "source TEXT, model TEXT, prompt TEXT, created_date TEXT NOT NULL DEFAULT '', "
+                "claim_generator TEXT, signature_type TEXT, indexed_at REAL NOT NULL)"
+            )
+            # Cada índice termina en created_date (y el rowid implícito), el
+            # orden de la respuesta, así que la página sale del índice sin ordenar
+            for name, columns in (
+                ("created", "created_date"),
+                ("model", "model, created_date"),
+                ("generator", "claim_generator, created_date"),
+                ("signature", "signature_type, created_date"),
+                ("instance", "instance_id"),
+            ):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS provenance_{name} ON provenance ({columns})")
+            self.fts = self._create_fts(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _create_fts(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS provenance_fts "
+                "USING fts5(prompt, content='provenance', content_rowid='id')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite compilado sin FTS5
+            return False
+        conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS provenance_ai AFTER INSERT ON provenance BEGIN
+                INSERT INTO provenance_fts (rowid, prompt) VALUES (new.id, new.prompt);
+            END;
+            CREATE TRIGGER IF NOT EXISTS provenance_ad AFTER DELETE ON provenance BEGIN
+                INSERT INTO provenance_fts (provenance_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+            END;
+            CREATE TRIGGER IF NOT EXISTS provenance_au AFTER UPDATE OF prompt ON provenance BEGIN
+                INSERT INTO provenance_fts (provenance_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                INSERT INTO provenance_fts (rowid, prompt) VALUES (new.id, new.prompt);
+            END;
+        """)
+        return True
+
+    def ingest(self, result: Dict[str, Any]) -> bool:
+        """Indexa un resultado de detección; devuelve False si no es IA"""
+        return self.ingest_many([result]) == 1
+
+    def ingest_many(self, results: Iterable[Dict[str, Any]]) -> int:
+        """
+        Indexa resultados de detección en una sola transacción. Solo se
+        guardan los que son IA; una imagen ya indexada (misma ruta, o mismo
+        instance_id si no hay ruta) se actualiza, así que "path" debe venir
+        normalizada con index_path. Devuelve cuántos se indexaron.
+        """
+        rows = []
+        now = time.time()
+        for result in results:
+            if not result.get("ai_generated"):
+                continue
+            fields = fields_from_result(result)
+            key = result.get("path") or fields["instance_id"] or fields["image"]
+            if not key:
+                continue
+            values = [fields[c] for c in _COLUMNS]
+            values[_COLUMNS.index("created_date")] = fields["created_date"] or ""
+            rows.append([key] + values + [now])
+        if not rows:
+            return 0
+        assignments = ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS + ("indexed_at",))
+        with self._lock:
+            # ON CONFLICT ... DO UPDATE (no INSERT OR REPLACE): así se disparan
+            # los triggers que mantienen sincronizado el índice FTS
+            self._db.executemany(
+                f"INSERT INTO provenance (key, {', '.join(_COLUMNS)}, indexed_at) "
+                f"VALUES ({', '.join('?' * (len(_COLUMNS) + 2))}) "
+                f"ON CONFLICT(key) DO UPDATE SET {assignments}",
+                rows
+            )
+            self._db.commit()
+        return len(rows)
+
+    def search(
+        self,
+        query: str = None,
+        model: str = None,
+        claim_generator: str = None,
+        signature_type: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str = None
+    ) -> Dict[str, Any]:
+        """
+        Busca imágenes por texto del prompt, filtros exactos y rango de
+        fechas ISO 8601 [date_from, date_to); un date_to sin hora incluye ese
+        día. Resultados del más reciente al más antiguo; "next_cursor" pide
+        la página siguiente (None al final).
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where, params = [], []
+        for column, value in (
+            ("model", model),
+            ("claim_generator", claim_generator),
+            ("signature_type", signature_type),
+        ):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        date_from, date_to = _date_bounds(date_from, date_to)
+        if date_from:
+            where.append("created_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("created_date < ?")
+            params.append(date_to)
+        if cursor:
+            where.append("(created_date, id) < (?, ?)")
+            params.extend(_decode_cursor(cursor))
+
+        with self._lock:
+            db = self._db
+            if query:
+                if self.fts:
+                    match = _fts_query(query)
+                    if match:
+                        where.append("id IN (SELECT rowid FROM provenance_fts WHERE provenance_fts MATCH ?)")
+                        params.append(match)
+                else:
+                    for term in re.findall(r"\w+", query):
+                        where.append("prompt LIKE ?")
+                        params.append(f"%{term}%")
+            sql = (
+                f"SELECT id, {', '.join(_COLUMNS)}, indexed_at FROM provenance"
+                + (f" WHERE {' AND '.join(where)}" if where else "")
+                + " ORDER BY created_date DESC, id DESC LIMIT ?"
+            )
+            rows = db.execute(sql, params + [limit + 1]).fetchall()
+
+        items = []
+        for row in rows[:limit]:
+            item = dict(zip(_COLUMNS, row[1:-1]))
+            item["created_date"] = item["created_date"] or None
+            item["indexed_at"] = row[-1]
+            items.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_cursor(last[1 + _COLUMNS.index("created_date")], last[0])
+        return {"results": items, "next_cursor": next_cursor, "full_text": self.fts}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM provenance").fetchone()[0]
+
+
+_default_index = None
+
+
+def get_search_index() -> Optional[ProvenanceIndex]:
+    """Índice configurado por PMC_SEARCH_DB (None si no está configurado)"""
+    global _default_index
+    db_path = os.getenv("PMC_SEARCH_DB")
+    if not db_path:
+        return None
+    if _default_index is None or _default_index.db_path != db_path:
+        _default_index = ProvenanceIndex(db_path)
+    return _default_index
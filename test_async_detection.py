@@ -0,0 +1,142 @@
+"""
+Pruebas de la fachada asyncio (async_detection.py)
+
+Ejecutar con: python -m pytest test_async_detection.py
+"""
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import async_detection
+import detection_utils
+from async_detection import AsyncDetector, adetect_image_status_c2pa, adetect_many
+from detection_utils import detect_image_status_c2pa, mark_image_as_ai
+
+
+@pytest.fixture(autouse=True)
+def simulated_signature(monkeypatch):
+    # Con procesos (fork) los workers heredan el parche
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i, (ext, fmt) in enumerate([("png", "PNG"), ("jpg", "JPEG"), ("png", "PNG")]):
+        path = tmp_path / f"imagen{i}.{ext}"
+        Image.new("RGB", (32, 32), (40 * i, 90, 200)).save(path, fmt)
+        paths.append(str(path))
+    assert mark_image_as_ai(paths[0], "prompt", "modelo", "autor")["success"]
+    assert mark_image_as_ai(paths[1], "prompt", "modelo", "autor")["success"]
+    return paths
+
+
+async def _collect(aiter):
+    return [result async for result in aiter]
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_async_results_match_sync(images, kind):
+    detector = AsyncDetector(workers=2, concurrency=2, kind=kind)
+
+    async def run():
+        single = await detector.detect(images[0], detail="summary")
+        many = await _collect(detector.detect_many(images + [b"no es una imagen"]))
+        return single, many
+
+    try:
+        single, many = asyncio.run(run())
+    finally:
+        detector.shutdown()
+
+    assert single == detect_image_status_c2pa(images[0], detail="summary")
+    assert sorted(r["index"] for r in many) == [0, 1, 2, 3]
+    by_index = {r.pop("index"): r for r in many}
+    for index, path in enumerate(images):
+        assert by_index[index] == detect_image_status_c2pa(path, os.path.basename(path))
+    assert by_index[0]["ai_generated"] is True and by_index[2]["ai_generated"] is False
+    assert by_index[3]["ai_generated"] is False
+
+
+def test_module_functions_use_the_default_detector(images, monkeypatch):
+    monkeypatch.setenv("PMC_ASYNC_WORKERS", "2")
+    monkeypatch.setattr(async_detection, "_default_detector", None)
+
+    async def run():
+        single = await adetect_image_status_c2pa(images[1], "foto.jpg")
+        many = await _collect(adetect_many(images[:1], detail="summary"))
+        return single, many
+
+    try:
+        single, many = asyncio.run(run())
+        detector = async_detection.get_async_detector()
+        assert detector.workers == 2 and detector.kind == "thread"
+    finally:
+        async_detection.get_async_detector().shutdown()
+    assert single == detect_image_status_c2pa(images[1], "foto.jpg")
+    assert many[0].pop("index") == 0
+    assert many == [detect_image_status_c2pa(images[0], "imagen0.png", "summary")]
+
+
+def test_mark_many_reports_each_row(images):
+    detector = AsyncDetector(workers=2)
+    rows = [
+        {"path": images[2], "prompt": "p", "model": "m", "author": "a", "line": 1},
+        {"path": "", "line": 2},
+        {"path": "", "line": 3, "error": "JSON inválido: x"},
+    ]
+    try:
+        results = asyncio.run(_collect(detector.mark_many(rows)))
+    finally:
+        detector.shutdown()
+    by_line = {r["line"]: r for r in results}
+    assert by_line[1]["success"] is True
+    assert by_line[2]["success"] is False
+    assert by_line[3]["error"] == "JSON inválido: x"
+    assert detect_image_status_c2pa(images[2])["ai_generated"] is True
+
+
+def test_concurrency_is_bounded():
+    detector = AsyncDetector(workers=8, concurrency=2)
+    lock = threading.Lock()
+    running = [0, 0]  # en curso, máximo visto
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item
+
+    try:
+        results = asyncio.run(_collect(detector._map_unordered(work, range(10))))
+    finally:
+        detector.shutdown()
+    assert sorted(results) == list(range(10))
+    assert running[1] <= 2
+
+
+def test_shutdown_stops_the_executor(images):
+    detector = AsyncDetector(workers=2)
+    asyncio.run(detector.detect(images[0]))
+    executor = detector._executor
+    threads = list(executor._threads)
+    assert threads
+
+    detector.shutdown()
+    assert detector._executor is None
+    assert not any(t.is_alive() for t in threads)
+    with pytest.raises(RuntimeError):
+        executor.submit(int)
+
+    # Se puede volver a usar: crea un executor nuevo
+    result = asyncio.run(detector.detect(images[0]))
+    assert result["ai_generated"] is True
+    assert detector._executor is not executor
+    detector.shutdown()
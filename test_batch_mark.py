@@ -0,0 +1,53 @@
+"""
+Pruebas del marcado por lotes (batch_mark.py)
+
+Ejecutar con: python -m pytest test_batch_mark.py
+"""
+import os
+
+import batch_mark
+from batch_mark import load_mark_rows, mark_batch
+
+
+def test_malformed_jsonl_lines_are_reported_not_fatal(tmp_path):
+    manifest = tmp_path / "filas.jsonl"
+    manifest.write_text(
+        '{"path": "a.png", "prompt": "uno"}\n'
+        '{"path": "b.png"\n'
+        '\n'
+        '["c1.png"]\n'
+        '{"path": "d.png"}\n',
+        encoding="utf-8",
+    )
+    rows = list(load_mark_rows(str(manifest)))
+    assert [row["line"] for row in rows] == [1, 2, 4, 5]
+    assert rows[0] == {"line": 1, "path": str(tmp_path / "a.png"), "prompt": "uno"}
+    assert rows[1]["error"].startswith("JSON inválido") and rows[1]["path"] == ""
+    assert rows[2]["error"] == "La fila no es un objeto JSON"
+    assert "error" not in rows[3]
+
+    stats = mark_batch(rows, workers=1)
+    assert stats["total"] == 4 and stats["failed"] == 4
+    assert [failure["line"] for failure in stats["failures"]] == [1, 2, 4, 5]
+
+
+def _crashing_mark(path, **kwargs):
+    # Simula un proceso del pool que muere a mitad del marcado
+    if path.endswith("crash.png"):
+        os._exit(1)
+    return {"success": True}
+
+
+def test_broken_pool_reports_affected_rows_and_continues(monkeypatch):
+    monkeypatch.setattr(batch_mark, "mark_image_as_ai", _crashing_mark)
+    rows = [{"line": i, "path": f"{i}.png"} for i in range(1, 6)]
+    rows.insert(2, {"line": 99, "path": "crash.png"})
+    rows += [{"line": i, "path": f"{i}.png"} for i in range(6, 20)]
+
+    stats = mark_batch(rows, workers=2)
+    assert stats["total"] == len(rows)
+    failed = {failure["line"] for failure in stats["failures"]}
+    assert 99 in failed
+    assert all("terminó de forma abrupta" in failure["error"] for failure in stats["failures"])
+    # Las filas enviadas después de la caída se marcan en un pool nuevo
+    assert stats["succeeded"] == len(rows) - len(failed) and stats["succeeded"] >= 14
@@ -0,0 +1,41 @@
+"""
+Pruebas de la serialización canónica de manifests (c2pa_manifest.py)
+
+Ejecutar con: python -m pytest test_c2pa_manifest.py
+"""
+import json
+
+import pytest
+
+import c2pa_manifest
+from c2pa_manifest import C2PAManifest
+
+
+def _claim():
+    return {"title": "ñandú", "assertions": [{"data": {"score": 1e16, "ratio": 0.1}}], "count": 3}
+
+
+def test_claim_bytes_are_stdlib_canonical_json():
+    manifest = C2PAManifest(_claim())
+    expected = json.dumps(_claim(), sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert manifest.claim_bytes == expected
+    assert b"1e+16" in manifest.claim_bytes
+
+
+def test_claim_bytes_do_not_depend_on_orjson(monkeypatch):
+    with_orjson = C2PAManifest(_claim()).with_signature({"type": "simulated"}).to_bytes()
+    monkeypatch.setattr(c2pa_manifest, "ORJSON_AVAILABLE", False)
+    without_orjson = C2PAManifest(_claim()).with_signature({"type": "simulated"}).to_bytes()
+    assert with_orjson == without_orjson
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf")])
+def test_non_finite_floats_are_rejected(value):
+    with pytest.raises(ValueError):
+        C2PAManifest({"title": "x", "score": value}).claim_bytes
+
+
+def test_envelope_round_trip_verifies_stored_bytes():
+    signed = C2PAManifest(_claim()).with_signature({"type": "simulated"})
+    parsed = C2PAManifest.from_json(signed.to_bytes())
+    assert parsed.signed_bytes == signed.claim_bytes
@@ -0,0 +1,175 @@
+"""
+Pruebas de la firma y verificación C2PA (c2pa_signing.py)
+
+Ejecutar con: python -m pytest test_c2pa_signing.py
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import detection_utils
+from c2pa_manifest import C2PAManifest
+from c2pa_signing import (
+    SIGNATURE_INVALID,
+    SIGNATURE_UNTRUSTED,
+    SIGNATURE_VERIFIED,
+    ManifestSigner,
+    verify_manifest_signature,
+)
+from detection_utils import detect_image_status_c2pa, mark_image_as_ai
+from jumbf import build_manifest_store, read_manifest_store
+
+
+def _key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def _write_key(path) -> str:
+    path.write_bytes(_key().private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ))
+    return str(path)
+
+
+def _cert(name, key, issuer_name=None, issuer_key=None, ca=False, path_length=None, key_cert_sign=None, digital_signature=True):
+    """Certificado de prueba; sin emisor es autofirmado"""
+    now = datetime.now(timezone.utc)
+    key_cert_sign = ca if key_cert_sign is None else key_cert_sign
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer_name or name)]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=path_length if ca else None), critical=True)
+        .add_extension(x509.KeyUsage(
+            digital_signature=digital_signature, content_commitment=False, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=key_cert_sign,
+            crl_sign=False, encipher_only=False, decipher_only=False,
+        ), critical=True)
+    )
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+
+def _signed(key, chain):
+    manifest = C2PAManifest({"claim_generator": "test", "assertions": []})
+    return ManifestSigner(key, chain, "test").sign_manifest(manifest)
+
+
+def _anchors(tmp_path, monkeypatch, *certs):
+    path = tmp_path / "anchors.pem"
+    path.write_bytes(b"".join(c.public_bytes(serialization.Encoding.PEM) for c in certs))
+    monkeypatch.setenv("C2PA_TRUST_ANCHORS", str(path))
+
+
+@pytest.mark.parametrize("ext, fmt", [("png", "PNG"), ("jpg", "JPEG")])
+def test_key_only_signature_round_trip(tmp_path, monkeypatch, ext, fmt):
+    # Solo C2PA_PRIVATE_KEY: la firma lleva la clave pública y se verifica con ella
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", _write_key(tmp_path / "key.pem"))
+    monkeypatch.setattr(detection_utils, "C2PA_CERTIFICATE", None)
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    image = tmp_path / f"imagen.{ext}"
+    Image.new("RGB", (32, 32), "#3498db").save(image, fmt)
+
+    marked = mark_image_as_ai(str(image), "prompt", "modelo", "autor")
+    assert marked["success"] and marked["signature_type"] == "C2PA"
+
+    result = detect_image_status_c2pa(str(image))
+    assert result["source"] == "c2pa_manifest"
+    info = result["c2pa_info"]
+    assert info["signature_type"] == "C2PA"
+    assert info["trusted"] is False
+    # Firma correcta pero sin certificado: nunca es "valid"
+    assert info["valid"] is False and info["status"] == SIGNATURE_UNTRUSTED
+    assert info["hash_binding"] == "verified"
+    assert info["signer"].startswith("Clave sin certificado")
+    assert "certificate_chain" not in result["metadata"]["signature"]
+
+
+def test_self_signed_without_anchors_is_untrusted(monkeypatch):
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    key = _key()
+    result = verify_manifest_signature(_signed(key, [_cert("Firmante", key)]))
+    assert result["status"] == SIGNATURE_UNTRUSTED
+    assert result["valid"] is False and result["trusted"] is False
+
+
+def test_ca_chain_to_anchor_is_verified(tmp_path, monkeypatch):
+    root_key, inter_key, leaf_key = _key(), _key(), _key()
+    root = _cert("Raíz", root_key, ca=True, path_length=1)
+    inter = _cert("Intermedia", inter_key, "Raíz", root_key, ca=True, path_length=0)
+    leaf = _cert("Firmante", leaf_key, "Intermedia", inter_key)
+    _anchors(tmp_path, monkeypatch, root)
+    result = verify_manifest_signature(_signed(leaf_key, [leaf, inter]))
+    assert result["status"] == SIGNATURE_VERIFIED
+    assert result["valid"] is True and result["trusted"] is True
+
+
+def test_end_entity_cannot_issue(tmp_path, monkeypatch):
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    issuer_key, leaf_key = _key(), _key()
+    # Un certificado final (ca=False) aunque tenga keyCertSign
+    issuer = _cert("Final", issuer_key, key_cert_sign=True)
+    leaf = _cert("Firmante", leaf_key, "Final", issuer_key)
+    result = verify_manifest_signature(_signed(leaf_key, [leaf, issuer]))
+    assert result["status"] == SIGNATURE_INVALID and result["valid"] is False
+    assert "BasicConstraints" in result["reason"]
+
+
+def test_issuer_without_key_cert_sign(monkeypatch):
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    ca_key, leaf_key = _key(), _key()
+    ca = _cert("CA", ca_key, ca=True, key_cert_sign=False)
+    leaf = _cert("Firmante", leaf_key, "CA", ca_key)
+    result = verify_manifest_signature(_signed(leaf_key, [leaf, ca]))
+    assert result["status"] == SIGNATURE_INVALID
+    assert "keyCertSign" in result["reason"]
+
+
+def test_anchor_path_length_exceeded(tmp_path, monkeypatch):
+    root_key, inter_key, leaf_key = _key(), _key(), _key()
+    # La raíz (ancla) solo admite certificados finales debajo
+    root = _cert("Raíz", root_key, ca=True, path_length=0)
+    inter = _cert("Intermedia", inter_key, "Raíz", root_key, ca=True)
+    leaf = _cert("Firmante", leaf_key, "Intermedia", inter_key)
+    _anchors(tmp_path, monkeypatch, root)
+    result = verify_manifest_signature(_signed(leaf_key, [leaf, inter]))
+    assert result["status"] == SIGNATURE_INVALID
+    assert "pathLen=0" in result["reason"]
+
+
+def test_leaf_without_digital_signature(monkeypatch):
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    key = _key()
+    result = verify_manifest_signature(_signed(key, [_cert("Firmante", key, digital_signature=False)]))
+    assert result["status"] == SIGNATURE_INVALID
+    assert "digitalSignature" in result["reason"]
+
+
+def test_signature_survives_jumbf_with_extra_assertion_fields(monkeypatch):
+    monkeypatch.delenv("C2PA_TRUST_ANCHORS", raising=False)
+    key = _key()
+    manifest = C2PAManifest({
+        "claim_generator": "test",
+        "assertions": [
+            {"label": "c2pa.ingredient", "kind": "parentOf", "instance": 1, "data": {"title": "base.png"}},
+            {"label": "pmc.nota__2", "data": {"texto": "etiqueta con sufijo"}},
+        ],
+    })
+    signed = ManifestSigner(key, [_cert("Firmante", key)], "test").sign_manifest(manifest)
+
+    # Como en la detección: el manifest se reconstruye desde el almacén JUMBF
+    loaded = C2PAManifest(read_manifest_store(build_manifest_store(signed)))
+    assert loaded == signed
+    assert loaded.signed_bytes == signed.signed_bytes
+    result = verify_manifest_signature(loaded)
+    assert result["status"] == SIGNATURE_UNTRUSTED, result
@@ -0,0 +1,72 @@
+"""
+Pruebas de los niveles de detalle de la detección (detection_utils.py)
+
+Ejecutar con: python -m pytest test_detail_levels.py
+"""
+import pytest
+from PIL import Image
+
+import detection_utils
+from detection_utils import DETAIL_LEVELS, detect_image_status_c2pa, mark_image_as_ai
+
+BASE_KEYS = {"image", "exists", "format", "ai_generated", "source"}
+
+
+@pytest.fixture(autouse=True)
+def simulated_signature(monkeypatch):
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+
+
+@pytest.fixture(params=[("png", "PNG"), ("jpg", "JPEG")])
+def marked_image(tmp_path, request):
+    ext, fmt = request.param
+    path = tmp_path / f"imagen.{ext}"
+    Image.new("RGB", (32, 32), "#3498db").save(path, fmt)
+    result = mark_image_as_ai(str(path), "un gato en el espacio", "modelo", "autor")
+    assert result["success"], result
+    return str(path)
+
+
+def test_summary_keeps_only_documented_keys(marked_image):
+    full = detect_image_status_c2pa(marked_image, detail="full")
+    summary = detect_image_status_c2pa(marked_image, detail="summary")
+
+    assert set(summary) == BASE_KEYS | {"details", "c2pa_info"}
+    assert {k: summary[k] for k in BASE_KEYS} == {k: full[k] for k in BASE_KEYS}
+    assert summary["source"] == "c2pa_manifest"
+    # Modelo y fecha, sin el prompt ni el manifest
+    assert set(summary["details"]) <= set(detection_utils._SUMMARY_DETAILS)
+    assert summary["details"]["model"] == full["details"]["model"]
+    assert "prompt" not in summary["details"]
+    # Estado de la firma: validez, tipo y enlace de hash
+    assert set(summary["c2pa_info"]) <= set(detection_utils._SUMMARY_C2PA_INFO)
+    assert {"valid", "status", "signature_type", "hash_binding"} <= set(summary["c2pa_info"])
+    assert summary["c2pa_info"]["hash_binding"] == "verified"
+
+
+def test_full_and_assertions_levels(marked_image):
+    full = detect_image_status_c2pa(marked_image)
+    assert full == detect_image_status_c2pa(marked_image, detail="full")
+    assert BASE_KEYS | {"details", "c2pa_info", "metadata"} <= set(full)
+    assert full["metadata"]["assertions"]
+    assert "assertions" not in full
+
+    assertions = detect_image_status_c2pa(marked_image, detail="assertions")
+    assert set(assertions) == BASE_KEYS | {"details", "c2pa_info", "assertions"}
+    assert assertions["details"] == full["details"]
+    assert assertions["c2pa_info"] == full["c2pa_info"]
+    assert assertions["assertions"] == full["metadata"]["assertions"]
+
+
+def test_unmarked_image_at_every_level(tmp_path):
+    path = tmp_path / "limpia.png"
+    Image.new("RGB", (32, 32), "#3498db").save(path, "PNG")
+    for detail in DETAIL_LEVELS:
+        result = detect_image_status_c2pa(str(path), detail=detail)
+        assert result["ai_generated"] is False
+        assert result["c2pa_info"] is None
+
+
+def test_unknown_detail_raises(marked_image):
+    with pytest.raises(ValueError):
+        detect_image_status_c2pa(marked_image, detail="todo")
@@ -0,0 +1,66 @@
+"""
+Pruebas de la caché de detección (detection_cache.py)
+
+Ejecutar con: python -m pytest test_detection_cache.py
+"""
+import io
+
+from PIL import Image, ImageDraw
+
+from detection_cache import DetectionCache, detect_cached
+from manifest_store import get_manifest_store
+from phash_index import compute_phash, get_default_index
+
+
+def _artwork() -> Image.Image:
+    img = Image.new("RGB", (128, 128), "#2980b9")
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((10, 10, 80, 80), fill="#f1c40f")
+    draw.rectangle((70, 60, 120, 120), fill="#2c3e50")
+    return img
+
+
+def test_memory_hit_is_a_shallow_copy():
+    cache = DetectionCache(max_entries=4)
+    original = {"image": "a.png", "details": {"model": "m"}}
+    cache.put("k", original)
+    original["details"]["model"] = "cambiado"
+
+    first, second = cache.get("k"), cache.get("k")
+    assert first is not second and first["details"] == {"model": "m"}
+    first["image"] = "otra.png"
+    assert cache.get("k")["image"] == "a.png"
+
+
+def test_sqlite_store_write_invalidates_cached_none(tmp_path, monkeypatch):
+    monkeypatch.setenv("PMC_MANIFEST_STORE", "sqlite")
+    monkeypatch.setenv("PMC_MANIFEST_DB", str(tmp_path / "manifests.sqlite3"))
+    path = tmp_path / "imagen.png"
+    _artwork().save(path)
+    cache = DetectionCache(max_entries=16)
+    # Crear la base antes: su creación ya cambia la generación
+    get_manifest_store().count()
+
+    assert detect_cached(str(path), cache=cache)["source"] == "none"
+    assert detect_cached(str(path), cache=cache)["source"] == "none"
+    assert cache.stats()["hits"] == 1
+
+    # El manifest llega al almacén sin tocar la imagen
+    get_manifest_store().save(str(path), {"ai_generated": True, "model": "modelo"}, "0" * 64)
+    result = detect_cached(str(path), cache=cache)
+    assert result["source"] == "sidecar_manifest" and result["details"]["model"] == "modelo"
+
+
+def test_phash_index_write_invalidates_cached_none(tmp_path, monkeypatch):
+    monkeypatch.setenv("PMC_PHASH_DB", str(tmp_path / "phash.sqlite3"))
+    buf = io.BytesIO()
+    _artwork().save(buf, "JPEG", quality=80)
+    data = buf.getvalue()
+    cache = DetectionCache(max_entries=16)
+
+    assert detect_cached(data, "copia.jpg", cache=cache)["source"] == "none"
+    original = io.BytesIO()
+    _artwork().save(original, "PNG")
+    get_default_index().add(compute_phash(original.getvalue()), image="original.png")
+    result = detect_cached(data, "copia.jpg", cache=cache)
+    assert result["source"] == "phash_index" and result["details"]["image"] == "original.png"
@@ -0,0 +1,105 @@
+"""
+Pruebas del enlace duro con rango de exclusión (c2pa.hash.data)
+
+Ejecutar con: python -m pytest test_hash_binding.py
+"""
+import io
+
+import pytest
+from PIL import Image
+
+import detection_utils
+from detection_utils import (
+    _MAX_BINDING_ROUNDS,
+    _hash_assertion,
+    detect_image_status_c2pa,
+    mark_image_as_ai,
+    verify_c2pa_manifest,
+)
+from image_container import scan_image_header
+
+FORMATS = [("png", "PNG"), ("jpg", "JPEG")]
+
+
+@pytest.fixture(autouse=True)
+def simulated_signature(monkeypatch):
+    # Firma simulada: el enlace duro no depende de la clave configurada
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+
+
+@pytest.fixture
+def sign_calls(monkeypatch):
+    calls = []
+    sign = detection_utils._sign_manifest
+
+    def counting_sign(*args, **kwargs):
+        calls.append(1)
+        return sign(*args, **kwargs)
+
+    monkeypatch.setattr(detection_utils, "_sign_manifest", counting_sign)
+    return calls
+
+
+def _marked_image(tmp_path, ext, fmt) -> str:
+    path = tmp_path / f"imagen.{ext}"
+    Image.new("RGB", (64, 64), "#3498db").save(path, fmt)
+    result = mark_image_as_ai(str(path), "prompt", "modelo", "autor")
+    assert result["success"], result
+    return str(path)
+
+
+def _exclusion(path: str):
+    hash_data = _hash_assertion(verify_c2pa_manifest(path)["manifest"])
+    exclusion = hash_data["exclusions"][0]
+    return exclusion["start"], exclusion["length"]
+
+
+@pytest.mark.parametrize("ext, fmt", FORMATS)
+def test_freshly_marked_image_is_verified(tmp_path, ext, fmt):
+    path = _marked_image(tmp_path, ext, fmt)
+    result = detect_image_status_c2pa(path)
+    assert result["source"] == "c2pa_manifest"
+    assert result["c2pa_info"]["hash_binding"] == "verified"
+    start, length = _exclusion(path)
+    # La exclusión cubre exactamente el almacén JUMBF incrustado
+    with open(path, "rb") as f:
+        data = f.read()
+    assert scan_image_header(io.BytesIO(data))["jumbf"]
+    assert 0 < start < start + length <= len(data)
+
+
+@pytest.mark.parametrize("ext, fmt", FORMATS)
+def test_one_byte_change_outside_exclusion_is_mismatch(tmp_path, ext, fmt):
+    path = _marked_image(tmp_path, ext, fmt)
+    start, length = _exclusion(path)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    # Un byte de los datos de imagen (tras IDAT/SOS), fuera del rango excluido
+    offset = scan_image_header(io.BytesIO(bytes(data)))["data_offset"] + 12
+    assert not start <= offset < start + length
+    data[offset] ^= 0x01
+    with open(path, "wb") as f:
+        f.write(data)
+
+    result = verify_c2pa_manifest(path)
+    assert result["valid"] is False
+    assert result["hash_binding"] == "mismatch"
+
+
+@pytest.mark.parametrize("ext, fmt", FORMATS)
+def test_remarking_converges(tmp_path, sign_calls, ext, fmt):
+    path = _marked_image(tmp_path, ext, fmt)
+
+    sign_calls.clear()
+    result = mark_image_as_ai(path, "otro prompt más largo que el anterior", "otro modelo", "otro autor")
+    assert result["success"], result
+    assert 1 <= len(sign_calls) <= _MAX_BINDING_ROUNDS
+
+    with open(path, "rb") as f:
+        data = f.read()
+    # Se sustituye el almacén anterior: sigue habiendo uno solo
+    assert len(scan_image_header(io.BytesIO(data))["jumbf"]) == 1
+    verified = verify_c2pa_manifest(path)
+    assert verified["hash_binding"] == "verified"
+    start, length = _exclusion(path)
+    assert start + length <= len(data)
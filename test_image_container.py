@@ -0,0 +1,174 @@
+"""
+Pruebas del escáner de contenedores PNG/JPEG (image_container.py)
+
+Ejecutar con: python -m pytest test_image_container.py
+"""
+import io
+import struct
+
+from PIL import Image, PngImagePlugin
+
+from image_container import (
+    EXIF_HEADER,
+    PROBE_LIMIT,
+    jpeg_set_exif,
+    probe_image_header,
+    scan_image_header,
+)
+
+
+def _png_bytes(text=None) -> bytes:
+    info = PngImagePlugin.PngInfo()
+    for key, value in (text or {}).items():
+        info.add_text(key, value)
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), "#3498db").save(buf, "PNG", pnginfo=info)
+    return buf.getvalue()
+
+
+def _jpeg_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), "#3498db").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def _exif_with_description(description: str) -> bytes:
+    exif = Image.Exif()
+    exif[270] = description  # ImageDescription
+    return exif.tobytes()
+
+
+def _scan(data: bytes):
+    return scan_image_header(io.BytesIO(data))
+
+
+def _app_segment(code: int, payload: bytes) -> bytes:
+    return bytes((0xFF, code)) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def test_png_text_and_data_offset():
+    data = _png_bytes({"AI-Generated": "true"})
+    result = _scan(data)
+    assert result["format"] == "png"
+    assert result["text"] == {"AI-Generated": "true"}
+    assert data[result["data_offset"] + 4:result["data_offset"] + 8] == b"IDAT"
+
+
+def test_png_truncated_in_text_chunk():
+    data = _png_bytes({"AI-Generated": "true"})
+    cut = data.index(b"tEXt") + 6
+    result = _scan(data[:cut])
+    assert result["format"] == "png"
+    assert result["data_offset"] is None
+
+
+def test_png_without_iend():
+    data = _png_bytes({"AI-Generated": "true"})
+    # Sin IDAT ni IEND: termina al agotar el archivo, con el texto leído
+    result = _scan(data[:data.index(b"IDAT") - 4])
+    assert result["text"] == {"AI-Generated": "true"}
+    assert result["data_offset"] is None
+
+
+def test_jpeg_truncated_header():
+    data = jpeg_set_exif(_jpeg_bytes(), EXIF_HEADER + _exif_with_description("AI-Generated: true"))
+    for cut in (3, 5, data.index(EXIF_HEADER) + 4):
+        result = _scan(data[:cut])
+        assert result["format"] == "jpeg"
+        assert result["data_offset"] is None
+
+
+def test_jpeg_without_eoi():
+    data = _jpeg_bytes()
+    assert data.endswith(b"\xff\xd9")
+    result = _scan(data[:-2])
+    # SOS sigue presente: el escaneo se detiene ahí sin necesitar EOI
+    assert data[result["data_offset"]:result["data_offset"] + 2] == b"\xff\xda"
+
+
+def test_jpeg_multiple_app1_segments():
+    # Un APP1 XMP antes de dos EXIF: se usa el primer EXIF
+    xmp = _app_segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>")
+    first = _app_segment(0xE1, EXIF_HEADER + _exif_with_description("primero"))
+    second = _app_segment(0xE1, EXIF_HEADER + _exif_with_description("segundo"))
+    base = _jpeg_bytes()
+    data = base[:2] + xmp + first + second + base[2:]
+    result = _scan(data)
+    assert result["exif"] is not None
+    assert b"primero" in result["exif"]
+    assert b"segundo" not in result["exif"]
+
+
+def test_jpeg_segment_length_below_two_stops_scan():
+    base = _jpeg_bytes()
+    for bad_length in (0, 1):
+        data = base[:2] + b"\xff\xe1" + struct.pack(">H", bad_length) + base[2:]
+        result = _scan(data)
+        assert result["format"] == "jpeg"
+        assert result["exif"] is None
+        assert result["data_offset"] is None
+        probe = probe_image_header(io.BytesIO(data))
+        # La sonda no puede asegurar nada: deja decidir al escaneo completo
+        assert probe["marked"] is True
+        assert probe["header"] is None
+
+
+def test_probe_unmarked_and_marked():
+    clean = probe_image_header(io.BytesIO(_png_bytes()))
+    assert clean["format"] == "png" and clean["marked"] is False
+    marked = probe_image_header(io.BytesIO(_png_bytes({"AI-Generated": "true"})))
+    assert marked["marked"] is True
+    assert _scan(marked["header"])["text"] == {"AI-Generated": "true"}
+
+
+def test_probe_marker_past_limit_defers_to_full_scan():
+    # Un chunk de texto sin marcas que no cabe en el límite antes de la marca
+    data = _png_bytes({"Comment": "x" * 4096, "AI-Generated": "true"})
+    probe = probe_image_header(io.BytesIO(data), limit=1024)
+    assert probe["format"] == "png"
+    assert probe["marked"] is True
+    assert probe["header"] is None
+    assert _scan(data)["text"]["AI-Generated"] == "true"
+
+    # JPEG: segmentos APP2 de relleno y el EXIF marcado detrás
+    filler = _app_segment(0xE2, b"\x00" * 1000)
+    exif = _app_segment(0xE1, EXIF_HEADER + _exif_with_description("AI-Generated: true"))
+    base = _jpeg_bytes()
+    data = base[:2] + filler * 3 + exif + base[2:]
+    probe = probe_image_header(io.BytesIO(data), limit=2048)
+    assert probe["marked"] is True
+    assert probe["header"] is None
+    assert b"AI-Generated" in _scan(data)["exif"]
+
+
+def test_marker_past_probe_limit_is_detected():
+    from detection_utils import detect_image_status_c2pa
+
+    data = _png_bytes({"Comment": "x" * (PROBE_LIMIT + 1), "AI-Generated": "true"})
+    assert probe_image_header(io.BytesIO(data))["header"] is None
+    result = detect_image_status_c2pa(data, name="grande.png")
+    assert result["ai_generated"] is True
+
+
+def test_probe_truncated_segments():
+    # Chunk PNG con una longitud mayor que el archivo: no cabe en el límite
+    data = _png_bytes()
+    iend = data.index(b"IDAT") - 4
+    data = data[:iend] + struct.pack(">I4s", 0xFFFFFFF0, b"tEXt") + b"AI-Gen"
+    probe = probe_image_header(io.BytesIO(data))
+    assert probe["marked"] is True and probe["header"] is None
+
+    base = _jpeg_bytes()
+    exif = _app_segment(0xE1, EXIF_HEADER + _exif_with_description("AI-Generated: true"))
+    # Segmento cortado después de la marca: la sonda la ve en lo leído
+    cut = base[:2] + exif[:exif.index(b"AI-Generated") + 12]
+    probe = probe_image_header(io.BytesIO(cut))
+    assert probe["marked"] is True
+    assert probe["header"] == cut
+    # Cortado antes de la marca (o en mitad del campo de longitud): no hay
+    # nada que encontrar, y el escaneo completo coincide
+    for data in (base[:2] + exif[:40], base[:2] + exif[:3]):
+        probe = probe_image_header(io.BytesIO(data))
+        assert probe["marked"] is False
+        assert probe["header"] == data
+        assert b"AI-Generated" not in (_scan(data)["exif"] or b"")
@@ -0,0 +1,143 @@
+"""
+Pruebas de la cola de trabajos en SQLite (job_queue.py)
+
+Ejecutar con: python -m pytest test_job_queue.py
+"""
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+
+import detection_utils
+from job_queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobQueue, JobStore
+
+
+def _store(tmp_path) -> JobStore:
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_claim_takes_oldest_queued_job_once(tmp_path):
+    store = _store(tmp_path)
+    first = store.create("mark", {"image_path": "a.png"})
+    second = store.create("mark", {"image_path": "b.png"})
+    job = store.claim(timeout=60)
+    assert job["id"] == first and job["status"] == JOB_RUNNING and job["attempts"] == 1
+    assert store.claim(timeout=60)["id"] == second
+    assert store.claim(timeout=60) is None
+
+
+def test_expired_lease_is_reclaimed_and_stale_finish_ignored(tmp_path):
+    store = _store(tmp_path)
+    job_id = store.create("mark", {"image_path": "a.png"})
+    # El worker que lo reclamó desaparece: su plazo vence sin terminar
+    lost = store.claim(timeout=0)
+    time.sleep(0.01)
+    retry = store.claim(timeout=60)
+    assert retry["id"] == job_id and retry["attempts"] == 2
+    # El intento antiguo ya no puede escribir el resultado
+    assert store.finish(job_id, lost["claim"], JOB_FAILED, error="viejo") is False
+    assert store.finish(job_id, retry["claim"], JOB_DONE, result={"success": True}) is True
+    job = store.get(job_id)
+    assert job["status"] == JOB_DONE and job["result"] == {"success": True}
+
+
+def test_jobs_fail_after_max_attempts(tmp_path):
+    store = _store(tmp_path)
+    job_id = store.create("mark", {"image_path": "a.png"})
+    for _ in range(2):
+        assert store.claim(timeout=0, max_attempts=2) is not None
+        time.sleep(0.01)
+    assert store.claim(timeout=0, max_attempts=2) is None
+    assert store.expire(max_attempts=2) == 1
+    job = store.get(job_id)
+    assert job["status"] == JOB_FAILED and "Tiempo agotado" in job["error"]
+
+
+def test_old_schema_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+        "created_at REAL NOT NULL, updated_at REAL NOT NULL, params TEXT, result TEXT, error TEXT)"
+    )
+    conn.execute("INSERT INTO jobs VALUES ('x', 'mark', 'queued', 0, 0, '{}', NULL, NULL)")
+    conn.commit()
+    conn.close()
+    store = JobStore(path)
+    assert store.get("x")["status"] == JOB_QUEUED
+    assert store.claim(timeout=60)["id"] == "x"
+
+
+def _wait_for(queue: JobQueue, job_id: str, timeout: float = 30) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (JOB_DONE, JOB_FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"El trabajo {job_id} no terminó: {job}")
+
+
+def test_queue_recovers_from_a_killed_pool_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+    image = tmp_path / "imagen.png"
+    Image.new("RGB", (16, 16), "#3498db").save(image)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=1)
+
+    first = queue.store.create("mark", {"image_path": str(image)})
+    assert queue.dispatch() == 1
+    assert _wait_for(queue, first)["status"] == JOB_DONE
+    # El estado se escribe antes de que el future termine: esperar a su callback
+    deadline = time.time() + 30
+    while queue._in_flight and time.time() < deadline:
+        time.sleep(0.01)
+    assert queue._in_flight == 0
+
+    # Muere el proceso del pool: el executor queda roto
+    executor = queue._executor
+    for process in list(executor._processes.values()):
+        process.kill()
+    with pytest.raises(BrokenProcessPool):
+        executor.submit(os.getpid).result(timeout=30)
+
+    # El envío falla, pero el trabajo vuelve a la cola sin gastar intento
+    second = queue.store.create("mark", {"image_path": str(image)})
+    with pytest.raises(BrokenProcessPool):
+        queue.dispatch()
+    job = queue.get(second)
+    assert job["status"] == JOB_QUEUED and job["attempts"] == 0
+    assert queue._in_flight == 0 and queue._executor is None
+
+    # El siguiente dispatch crea un pool nuevo y el trabajo termina
+    assert queue.dispatch() == 1
+    assert _wait_for(queue, second)["status"] == JOB_DONE
+    assert queue._executor is not executor
+    queue._executor.shutdown()
+
+
+def test_dispatcher_logs_errors_and_keeps_running(tmp_path, monkeypatch, caplog):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=1)
+    calls = []
+
+    def dispatch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return 0
+
+    monkeypatch.setattr(queue, "dispatch", dispatch)
+    with caplog.at_level(logging.ERROR, logger="pmc.jobs"):
+        queue.start()
+        deadline = time.time() + 10
+        while len(calls) < 2 and time.time() < deadline:
+            queue._wake.set()
+            time.sleep(0.01)
+    # El hilo sobrevive al error y vuelve a despachar
+    assert len(calls) >= 2
+    record = next(r for r in caplog.records if r.name == "pmc.jobs")
+    assert "despachador" in record.getMessage()
+    assert "database is locked" in str(record.exc_info[1])
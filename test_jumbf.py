@@ -0,0 +1,234 @@
+"""
+Pruebas de las cajas JUMBF y el códec CBOR (jumbf.py)
+
+Ejecutar con: python -m pytest test_jumbf.py
+"""
+import base64
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+import jumbf
+from jumbf import (
+    box,
+    build_manifest_store,
+    cbor_dumps,
+    cbor_loads,
+    iter_boxes,
+    parse_superbox,
+    read_manifest_store,
+    superbox,
+)
+from image_container import (
+    JPEG_APP11,
+    PNG_JUMBF_CHUNK,
+    jpeg_embed_jumbf,
+    png_embed_chunks,
+    scan_image_header,
+)
+
+
+@pytest.fixture
+def builtin_cbor(monkeypatch):
+    # El códec incluido, aunque cbor2 esté instalado
+    monkeypatch.setattr(jumbf, "CBOR2_AVAILABLE", False)
+
+
+def _manifest(assertion_size=16):
+    return {
+        "claim_generator": "PMC/1.0",
+        "title": "AI Generated Image",
+        "format": "image/png",
+        "assertions": [
+            {"label": "c2pa.actions", "data": {"actions": [{"action": "c2pa.created"}]}},
+            {"label": "c2pa.actions", "data": {"actions": [{"action": "c2pa.edited"}]}},
+            {"label": "stds.schema-org.CreativeWork", "data": {"text": "x" * assertion_size}},
+        ],
+        "signature": {
+            "type": "C2PA",
+            "algorithm": "ES256",
+            "value": base64.b64encode(b"\x01" * 64).decode("ascii"),
+            "certificate_chain": [base64.b64encode(b"\x30\x82" + b"\x00" * 300).decode("ascii")],
+        },
+    }
+
+
+def _image_bytes(fmt: str) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), "#3498db").save(buf, fmt)
+    return buf.getvalue()
+
+
+# --- CBOR ---------------------------------------------------------------------
+
+@pytest.mark.parametrize("value", [
+    0, 23, 24, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1,
+    -1, -24, -25, -256, -257, -2**32, -2**64,
+    b"", b"\x00\xff", bytes(range(256)) * 2,
+    "", "a", "ñandú ✓", "x" * 70000,
+    {}, {"a": 1, "b": -2}, {"n": {"m": {"k": b"v"}}},
+    [], [1, [2, [3, [b"x", "y"]]]], [[], [[]], {"k": [-1, "x"]}],
+    True, False, None, 1.5, -0.25,
+])
+def test_cbor_round_trip(builtin_cbor, value):
+    assert cbor_loads(cbor_dumps(value)) == value
+
+
+@pytest.mark.parametrize("value, encoded", [
+    # Vectores del apéndice A de RFC 8949
+    (0, "00"), (23, "17"), (24, "1818"), (1000, "1903e8"), (1000000, "1a000f4240"),
+    (-1, "20"), (-100, "3863"), (-1000, "3903e7"),
+    (b"\x01\x02\x03\x04", "4401020304"), ("IETF", "6449455446"),
+    ([1, [2, 3], [4, 5]], "8301820203820405"), ({"a": 1, "b": [2, 3]}, "a26161016162820203"),
+])
+def test_cbor_known_encodings(builtin_cbor, value, encoded):
+    assert cbor_dumps(value).hex() == encoded
+    assert cbor_loads(bytes.fromhex(encoded)) == value
+
+
+def test_cbor_rejects_unsupported_values(builtin_cbor):
+    with pytest.raises(ValueError):
+        cbor_dumps(2**64)
+    with pytest.raises(TypeError):
+        cbor_dumps({1, 2})
+
+
+def test_cbor_truncated_values_raise(builtin_cbor):
+    encoded = cbor_dumps({"a": [1, 2**40, b"bytes", "texto"], "b": 1.5})
+    for cut in range(len(encoded)):
+        with pytest.raises(ValueError):
+            cbor_loads(encoded[:cut])
+
+
+@pytest.mark.parametrize("data", [
+    bytes.fromhex("0001"),          # datos sobrantes
+    bytes.fromhex("5f"),            # longitud indefinida
+    bytes.fromhex("f8"),            # valor simple no soportado
+    bytes.fromhex("62c328"),        # UTF-8 inválido
+    bytes.fromhex("81") * 100 + b"\x00",  # anidamiento excesivo
+])
+def test_cbor_corrupt_values_raise(builtin_cbor, data):
+    with pytest.raises(ValueError):
+        cbor_loads(data)
+
+
+# --- Cajas JUMBF ----------------------------------------------------------------
+
+def test_box_round_trip():
+    data = box(b"abcd", b"uno") + box(b"efgh", b"") + struct.pack(">I4sQ", 1, b"xlbx", 16 + 3) + b"dos"
+    assert list(iter_boxes(data)) == [(b"abcd", b"uno"), (b"efgh", b""), (b"xlbx", b"dos")]
+    tail = struct.pack(">I4s", 0, b"rest") + b"hasta el final"
+    assert list(iter_boxes(tail)) == [(b"rest", b"hasta el final")]
+
+
+@pytest.mark.parametrize("data", [
+    struct.pack(">I4s", 20, b"abcd") + b"corta",   # LBox mayor que los datos
+    struct.pack(">I4s", 4, b"abcd"),               # LBox menor que la cabecera
+    struct.pack(">I4s", 1, b"abcd") + b"\x00" * 4,  # XLBox truncado
+])
+def test_truncated_boxes_raise(data):
+    with pytest.raises(ValueError):
+        list(iter_boxes(data))
+
+
+def test_superbox_without_description_raises():
+    with pytest.raises(ValueError):
+        parse_superbox(box(b"cbor", b"\xa0"))
+
+
+def test_manifest_store_round_trip():
+    manifest = _manifest()
+    store = build_manifest_store(manifest, label="urn:uuid:prueba")
+    assert read_manifest_store(store) == manifest
+    # Etiqueta del manifest y sufijo de las aserciones repetidas
+    _, _, manifests = parse_superbox(list(iter_boxes(store))[0][1])
+    _, label, children = parse_superbox(manifests[0][1])
+    assert label == "urn:uuid:prueba"
+    labels = [parse_superbox(child)[1] for _, child in parse_superbox(children[0][1])[2]]
+    assert labels == ["c2pa.actions", "c2pa.actions__1", "stds.schema-org.CreativeWork"]
+
+
+def test_manifest_store_round_trip_is_lossless():
+    manifest = _manifest()
+    manifest["assertions"] += [
+        # Campos propios además de label/data
+        {"label": "c2pa.ingredient", "kind": "parentOf", "instance": 2, "data": {"title": "base.png"}},
+        # Etiqueta que ya acaba en __N, sin "data" y repetida
+        {"label": "pmc.nota__3", "data": None},
+        {"label": "pmc.sin_datos", "kind": "vacía"},
+        {"label": "pmc.nota__3", "data": [1.5, -0.0, "ñ"]},
+    ]
+    store = build_manifest_store(manifest)
+    assert read_manifest_store(store) == manifest
+    # Solo las que no se reconstruyen con label + data llevan caja de campos
+    # (la segunda "pmc.nota__3" va como "pmc.nota__3__1", que no es ambigua)
+    assert store.count(jumbf.FIELDS_BOX) == 3
+
+    # Sin aserciones no se inventa una lista vacía
+    bare = {k: v for k, v in manifest.items() if k != "assertions"}
+    assert read_manifest_store(build_manifest_store(bare)) == bare
+
+
+def test_truncated_or_corrupt_manifest_store_raises():
+    store = build_manifest_store(_manifest())
+    for cut in (4, 8, 40, len(store) // 2, len(store) - 1):
+        with pytest.raises(ValueError):
+            read_manifest_store(store[:cut])
+    # Un almacén con otro UUID no es C2PA
+    other = superbox(b"\x00" * 16, "otro", [])
+    with pytest.raises(ValueError):
+        read_manifest_store(other)
+    # CBOR del claim corrupto: 0x5f (longitud indefinida)
+    claim_cbor = cbor_dumps({k: v for k, v in _manifest().items() if k not in ("assertions", "signature")})
+    with pytest.raises(ValueError):
+        read_manifest_store(store.replace(claim_cbor, b"\x5f" + claim_cbor[1:]))
+
+
+# --- Incrustación en JPEG (APP11) y PNG (caBX) -------------------------------------
+
+def test_app11_split_and_reassembly_of_large_store():
+    manifest = _manifest(assertion_size=200 * 1024)
+    store = build_manifest_store(manifest)
+    assert len(store) > 3 * 0xFFFF
+
+    data, (start, length) = jpeg_embed_jumbf(_image_bytes("JPEG"), store)
+
+    # Segmentos APP11 consecutivos, ninguno mayor que el máximo de JPEG
+    segments = []
+    pos = start
+    while pos < start + length:
+        marker, code, size = struct.unpack(">BBH", data[pos:pos + 4])
+        assert (marker, code) == (0xFF, JPEG_APP11)
+        segments.append(data[pos + 4:pos + 2 + size])
+        pos += 2 + size
+    assert pos == start + length
+    # El primer segmento lleva 65525 bytes de la caja; los demás repiten su cabecera (8)
+    first = 0xFFFF - 2 - 8
+    assert len(segments) == 1 + -(-(len(store) - first) // (first - 8))
+    assert [struct.unpack(">L", s[4:8])[0] for s in segments] == list(range(1, len(segments) + 1))
+
+    header = scan_image_header(io.BytesIO(data))
+    assert header["jumbf"] == [store]
+    assert read_manifest_store(header["jumbf"][0]) == manifest
+    Image.open(io.BytesIO(data)).load()
+
+    # Volver a incrustar sustituye el almacén en lugar de duplicarlo
+    smaller = build_manifest_store(_manifest())
+    again, _ = jpeg_embed_jumbf(data, smaller)
+    assert scan_image_header(io.BytesIO(again))["jumbf"] == [smaller]
+
+
+def test_png_cabx_embed_and_read():
+    manifest = _manifest()
+    store = build_manifest_store(manifest)
+    data, (start, length) = png_embed_chunks(_image_bytes("PNG"), PNG_JUMBF_CHUNK, [store])
+
+    assert data[start + 4:start + 8] == PNG_JUMBF_CHUNK
+    assert length == 12 + len(store)
+    header = scan_image_header(io.BytesIO(data))
+    assert header["jumbf"] == [store]
+    assert header["data_offset"] == start + length
+    assert read_manifest_store(header["jumbf"][0]) == manifest
+    Image.open(io.BytesIO(data)).load()
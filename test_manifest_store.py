@@ -0,0 +1,55 @@
+"""
+Pruebas del almacén de manifests en SQLite (manifest_store.py)
+
+Ejecutar con: python -m pytest test_manifest_store.py
+"""
+import io
+
+import pytest
+from PIL import Image
+
+import detection_utils
+from detection_utils import detect_image_status_c2pa, mark_image_as_ai
+from image_container import probe_image_header
+
+
+@pytest.fixture(autouse=True)
+def sqlite_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+    monkeypatch.setenv("PMC_MANIFEST_STORE", "sqlite")
+    monkeypatch.setenv("PMC_MANIFEST_DB", str(tmp_path / "manifests.sqlite3"))
+
+
+@pytest.mark.parametrize("ext, fmt", [("png", "PNG"), ("jpg", "JPEG")])
+def test_stripped_image_is_resolved_by_path(tmp_path, ext, fmt):
+    path = tmp_path / f"imagen.{ext}"
+    Image.new("RGB", (32, 32), "#3498db").save(path, fmt)
+    assert mark_image_as_ai(str(path), "prompt", "modelo", "autor")["success"]
+    assert not list(tmp_path.glob("*_manifest.json"))
+
+    # Recodificar con PIL descarta el texto, EXIF y el almacén JUMBF
+    with Image.open(path) as img:
+        img.load()
+    img.save(path, fmt)
+    with open(path, "rb") as f:
+        assert not probe_image_header(f)["marked"]
+
+    result = detect_image_status_c2pa(str(path))
+    assert result["ai_generated"] is True
+    assert result["source"] == "sidecar_manifest"
+    assert result["details"]["model"] == "modelo"
+
+
+def test_unmarked_upload_skips_content_hash(monkeypatch):
+    calls = []
+    hash_image_source = detection_utils.hash_image_source
+    monkeypatch.setattr(
+        detection_utils, "hash_image_source",
+        lambda *args, **kwargs: calls.append(1) or hash_image_source(*args, **kwargs),
+    )
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), "#e74c3c").save(buf, "PNG")
+
+    result = detect_image_status_c2pa(buf.getvalue(), "subida.png")
+    assert result["source"] == "none"
+    assert calls == []
@@ -0,0 +1,123 @@
+"""
+Pruebas de las métricas compartidas entre procesos (metrics.py)
+
+Ejecutar con: python -m pytest test_metrics.py
+"""
+import os
+import time
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import metrics
+from detection_cache import DetectionCache
+from web_app import config_from_env, create_app
+
+
+@pytest.fixture
+def shared_db(tmp_path, monkeypatch):
+    monkeypatch.delenv("PMC_METRICS_DB", raising=False)
+    db_path = str(tmp_path / "metrics.sqlite3")
+    metrics.reset()
+    metrics.configure(db_path)
+    yield db_path
+    metrics.configure(None)
+    metrics.reset()
+
+
+def _detect_in_pool(n: int) -> None:
+    metrics.inc("pmc_detections_total", source="c2pa_manifest")
+    with metrics.stage("detect"):
+        pass
+
+
+def _lines(text: str, prefix: str):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_pool_processes_are_aggregated(shared_db):
+    metrics.inc("pmc_detections_total", source="c2pa_manifest")
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as executor:
+        list(executor.map(_detect_in_pool, range(4)))
+
+    text = metrics.render()
+    # Una sola serie, sin etiqueta pid: la suma del proceso y el pool
+    assert _lines(text, "pmc_detections_total") == ['pmc_detections_total{source="c2pa_manifest"} 5']
+    assert _lines(text, 'pmc_stage_seconds_count{stage="detect"}') == ['pmc_stage_seconds_count{stage="detect"} 4']
+
+
+def _stored_pids(db_path: str) -> set:
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT pid FROM metric_values")}
+
+
+def test_exited_pool_processes_are_retired(shared_db):
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as executor:
+        list(executor.map(_detect_in_pool, range(4)))
+    # Al salir, los procesos del pool pasan sus valores a los totales (pid 0)
+    assert _stored_pids(shared_db) == {0}
+    assert _lines(metrics.render(), "pmc_detections_total") == ['pmc_detections_total{source="c2pa_manifest"} 4']
+
+
+def test_reused_pid_does_not_overwrite_a_dead_worker(shared_db):
+    store = metrics._shared_store()
+    row = ("counter", "pmc_requests_total", "[]")
+    # Un worker que murió sin retirarse: gunicorn lo notifica (child_exit)
+    store.write(4242, 1, [row + ("5",)])
+    metrics.mark_process_dead(4242)
+    assert _stored_pids(shared_db) == {0}
+
+    # Otro proceso recibe después el mismo pid: sus filas no pisan los totales
+    store.write(4242, time.time_ns(), [row + ("2",)])
+    assert _lines(metrics.render(), "pmc_requests_total") == ["pmc_requests_total 7"]
+    store.retire(4242)
+    assert _lines(metrics.render(), "pmc_requests_total") == ["pmc_requests_total 7"]
+
+    # Un proceso que se retira dos veces no suma dos veces
+    metrics.inc("pmc_requests_total")
+    metrics.retire()
+    metrics.retire()
+    metrics.inc("pmc_requests_total")
+    assert _lines(metrics.render(), "pmc_requests_total") == ["pmc_requests_total 9"]
+
+
+def test_cache_evictions_are_a_counter(shared_db):
+    cache = DetectionCache(max_entries=1)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"image": key})
+
+    text = metrics.render()
+    assert "# TYPE pmc_cache_evictions_total counter" in text
+    assert _lines(text, "pmc_cache_evictions_total") == ["pmc_cache_evictions_total 2"]
+    # Los gauges siguen siendo por proceso y desaparecen con él
+    assert _lines(text, "pmc_cache_entries") == [f'pmc_cache_entries{{pid="{os.getpid()}"}} 1']
+    metrics.mark_process_dead(os.getpid())
+    metrics.reset()
+    assert not _lines(metrics.render(), "pmc_cache_entries")
+
+
+def test_per_process_render_without_shared_db(monkeypatch):
+    monkeypatch.delenv("PMC_METRICS_DB", raising=False)
+    metrics.reset()
+    metrics.inc("pmc_requests_total", endpoint="/detect")
+    assert _lines(metrics.render(), "pmc_requests_total")[0].endswith(f'pid="{os.getpid()}"}} 1')
+    metrics.reset()
+
+
+def test_request_log_is_opt_in(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("PMC_REQUEST_LOG", raising=False)
+    monkeypatch.delenv("PMC_METRICS_DB", raising=False)
+    assert config_from_env()["REQUEST_LOG"] is False
+    app = create_app({"UPLOAD_FOLDER": str(tmp_path), "METRICS_DB": str(tmp_path / "metrics.sqlite3")})
+    try:
+        assert app.test_client().get("/metrics").status_code == 200
+        assert '"event": "request"' not in capsys.readouterr().err
+        monkeypatch.setenv("PMC_REQUEST_LOG", "1")
+        assert config_from_env()["REQUEST_LOG"] is True
+    finally:
+        metrics.configure(None)
+        metrics.reset()
@@ -0,0 +1,124 @@
+"""
+Pruebas del índice pHash (phash_index.py)
+
+Ejecutar con: python -m pytest test_phash_index.py
+"""
+import io
+import logging
+import sqlite3
+
+import pytest
+from PIL import Image, ImageDraw
+
+import detection_utils
+import metrics
+from detection_utils import detect_image_status_c2pa, mark_image_as_ai
+from phash_index import PHashIndex, compute_phash, get_default_index, hamming
+
+
+def _artwork(variant: int = 0) -> Image.Image:
+    """Imagen con degradado y formas: contenido visual suficiente para el pHash"""
+    img = Image.new("RGB", (256, 256))
+    draw = ImageDraw.Draw(img)
+    for y in range(256):
+        color = (y, 128 - y // 2, 255 - y) if variant == 0 else (255 - y, y, (y * 3) % 256)
+        draw.line([(0, y), (255, y)], fill=color)
+    if variant == 0:
+        draw.ellipse((40, 40, 160, 160), fill="#f1c40f")
+        draw.rectangle((150, 120, 240, 230), fill="#2c3e50")
+    else:
+        draw.polygon([(20, 230), (128, 20), (236, 230)], fill="#27ae60")
+        draw.ellipse((160, 10, 250, 100), fill="#8e44ad")
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, **kwargs) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setenv("PMC_PHASH_DB", str(tmp_path / "phash.sqlite3"))
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+    return get_default_index()
+
+
+def test_near_duplicate_matches_and_other_image_does_not(tmp_path):
+    index = PHashIndex(str(tmp_path / "phash.sqlite3"))
+    original = compute_phash(_encode(_artwork(), "PNG"))
+    index.add(original, image="original.png", model="modelo")
+
+    # Reducida y recomprimida como haría una red social
+    copy = compute_phash(_encode(_artwork().resize((180, 180)), "JPEG", quality=60))
+    match = index.query(copy)
+    assert match is not None and match["image"] == "original.png"
+    assert match["distance"] == hamming(original, copy) <= index.max_distance
+
+    assert index.query(compute_phash(_encode(_artwork(1), "PNG"))) is None
+
+
+def test_large_distance_query_stays_under_sqlite_variable_limit(tmp_path):
+    index = PHashIndex(str(tmp_path / "phash.sqlite3"))
+    phash = compute_phash(_encode(_artwork(), "PNG"))
+    index.add(phash, image="original.png")
+    # Límite de SQLite antiguos; con distancia 16 hay 2517 vecinos por trozo
+    index._db.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    match = index.query(phash ^ 0b1011, max_distance=16)
+    assert match["image"] == "original.png" and match["distance"] == 3
+
+
+@pytest.mark.parametrize("color", ["#000000", "#ffffff", "#3498db"])
+def test_flat_images_have_no_phash(color):
+    assert compute_phash(_encode(Image.new("RGB", (64, 64), color), "PNG")) is None
+
+
+def test_degenerate_hashes_are_not_looked_up(tmp_path):
+    index = PHashIndex(str(tmp_path / "phash.sqlite3"))
+    index.add(0, image="negra.png")
+    index.add((1 << 64) - 1, image="blanca.png")
+    assert index.query(0) is None
+    assert index.query((1 << 64) - 1) is None
+
+
+def test_stripped_copy_is_detected_by_phash(tmp_path, index):
+    marked = tmp_path / "marcada.png"
+    _artwork().save(marked)
+    assert mark_image_as_ai(str(marked), "prompt", "modelo", "autor")["success"]
+    assert index.count() == 1
+
+    # Sin metadatos, en otro formato y tamaño
+    copy = _encode(_artwork().resize((200, 200)), "JPEG", quality=70)
+    result = detect_image_status_c2pa(copy, "copia.jpg")
+    assert result["source"] == "phash_index"
+    assert result["details"]["image"] == "marcada.png"
+
+    assert detect_image_status_c2pa(_encode(_artwork(1), "PNG"), "otra.png")["source"] == "none"
+
+
+def test_flat_images_are_not_indexed(tmp_path, index):
+    marked = tmp_path / "plana.png"
+    Image.new("RGB", (64, 64), "#000000").save(marked)
+    assert mark_image_as_ai(str(marked), "prompt", "modelo", "autor")["success"]
+    assert index.count() == 0
+    flat = _encode(Image.new("RGB", (64, 64), "#000000"), "PNG")
+    assert detect_image_status_c2pa(flat, "otra_plana.png")["source"] == "none"
+
+
+def test_index_failure_is_logged_and_counted(tmp_path, index, monkeypatch, caplog):
+    def broken_add(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(index, "add", broken_add)
+    metrics.reset()
+    marked = tmp_path / "marcada.png"
+    _artwork().save(marked)
+    with caplog.at_level(logging.WARNING, logger="pmc.detection"):
+        result = mark_image_as_ai(str(marked), "prompt", "modelo", "autor")
+    # El índice es auxiliar: el marcado sigue siendo correcto
+    assert result["success"]
+    assert any("pHash" in r.getMessage() and "database is locked" in r.getMessage() for r in caplog.records)
+    errors = [line for line in metrics.render().splitlines() if line.startswith("pmc_index_errors_total{")]
+    assert len(errors) == 1 and 'index="phash"' in errors[0] and errors[0].endswith(" 1")
+    metrics.reset()
@@ -0,0 +1,47 @@
+"""
+Pruebas de las claves del índice de procedencia (provenance_search.py)
+
+Ejecutar con: python -m pytest test_provenance_index.py
+"""
+import os
+
+import pytest
+from PIL import Image
+
+import batch_detect
+import detection_utils
+from detection_utils import mark_image_as_ai
+from provenance_search import get_search_index, index_path
+
+
+@pytest.fixture
+def search_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("PMC_SEARCH_DB", str(tmp_path / "search.sqlite3"))
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+    return get_search_index()
+
+
+def test_index_path_is_absolute_and_resolves_links(tmp_path, monkeypatch):
+    real = tmp_path / "real"
+    real.mkdir()
+    os.symlink(real, tmp_path / "enlace")
+    monkeypatch.chdir(tmp_path)
+    assert index_path("enlace/a.png") == str(real / "a.png")
+    assert index_path(str(real / "a.png")) == str(real / "a.png")
+
+
+def test_mark_and_batch_index_share_one_row(tmp_path, monkeypatch, search_db, capsys):
+    images = tmp_path / "imagenes"
+    images.mkdir()
+    os.symlink(images, tmp_path / "enlace")
+    Image.new("RGB", (32, 32), "#3498db").save(images / "a.png")
+
+    # Marcado por el enlace simbólico, detección por una ruta relativa
+    assert mark_image_as_ai(str(tmp_path / "enlace" / "a.png"), "un gato", "modelo", "autor")["success"]
+    assert search_db.count() == 1
+    monkeypatch.chdir(tmp_path)
+    assert batch_detect.main(["imagenes", "--workers", "1", "--index"]) == 0
+
+    assert search_db.count() == 1
+    # La salida NDJSON conserva la ruta relativa
+    assert '"path": "imagenes' in capsys.readouterr().out
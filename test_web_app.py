@@ -0,0 +1,120 @@
+"""
+Pruebas de los endpoints /detect/batch y /search (web_app.py)
+
+Ejecutar con: python -m pytest test_web_app.py
+"""
+import io
+import json
+
+import pytest
+from PIL import Image
+
+import detection_utils
+from detection_utils import mark_image_as_ai
+from web_app import create_app
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_utils, "C2PA_PRIVATE_KEY", None)
+    monkeypatch.delenv("PMC_SEARCH_DB", raising=False)
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def client(upload_folder):
+    app = create_app({"UPLOAD_FOLDER": str(upload_folder), "METRICS_DB": "", "BATCH_WORKERS": 2})
+    app.testing = True
+    return app.test_client()
+
+
+def _png(color: str = "#3498db") -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _marked(folder, name: str, prompt: str = "un gato astronauta", model: str = "modelo") -> str:
+    path = folder / name
+    path.write_bytes(_png())
+    assert mark_image_as_ai(str(path), prompt, model, "autor")["success"]
+    return str(path)
+
+
+def _ndjson(response):
+    return sorted((json.loads(line) for line in response.get_data(as_text=True).splitlines()), key=lambda r: r["index"])
+
+
+def test_detect_batch_files_and_paths(client, upload_folder):
+    _marked(upload_folder, "marcada.png")
+    (upload_folder / "limpia.png").write_bytes(_png("#e74c3c"))
+
+    response = client.post(
+        "/detect/batch?detail=summary",
+        data={"files": (io.BytesIO(_png("#2ecc71")), "subida.png"), "paths": ["marcada.png", "limpia.png", "../fuera.png"]},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    results = _ndjson(response)
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert results[0]["image"] == "subida.png" and results[0]["ai_generated"] is False
+    assert results[1]["ai_generated"] is True and results[1]["source"] == "c2pa_manifest"
+    assert results[2]["ai_generated"] is False
+    assert results[3]["error"] == "Ruta no permitida"
+
+
+def test_detect_batch_json_paths(client, upload_folder):
+    _marked(upload_folder, "marcada.png")
+    response = client.post("/detect/batch", json={"paths": ["marcada.png"], "detail": "summary"})
+    assert response.status_code == 200
+    [result] = _ndjson(response)
+    assert result["image"] == "marcada.png" and result["ai_generated"] is True
+
+
+@pytest.mark.parametrize("body", [
+    {"paths": "marcada.png"},
+    {"paths": ["a.png", 1]},
+    {"paths": {"a": "b"}},
+    ["marcada.png"],
+])
+def test_detect_batch_rejects_malformed_paths(client, body):
+    response = client.post("/detect/batch", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_detect_batch_limits(client):
+    assert client.post("/detect/batch", json={"paths": []}).status_code == 400
+    assert client.post("/detect/batch", json={"paths": ["a.png"], "detail": "todo"}).status_code == 400
+    client.application.config["BATCH_MAX_ITEMS"] = 2
+    assert client.post("/detect/batch", json={"paths": ["a.png"] * 3}).status_code == 413
+
+
+def test_search_not_configured(client):
+    assert client.get("/search?q=gato").status_code == 503
+
+
+def test_search_finds_marked_images(client, upload_folder, tmp_path, monkeypatch):
+    monkeypatch.setenv("PMC_SEARCH_DB", str(tmp_path / "search.sqlite3"))
+    _marked(upload_folder, "gato.png", "un gato astronauta", "modelo-a")
+    _marked(upload_folder, "perro.png", "un perro pintor", "modelo-b")
+
+    response = client.get("/search?q=gato")
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [item["image"] for item in page["results"]] == ["gato.png"]
+    assert page["next_cursor"] is None
+
+    page = client.get("/search?model=modelo-b").get_json()
+    assert [item["image"] for item in page["results"]] == ["perro.png"]
+
+    first = client.get("/search?limit=1").get_json()
+    assert len(first["results"]) == 1 and first["next_cursor"]
+    second = client.get(f"/search?limit=1&cursor={first['next_cursor']}").get_json()
+    assert len(second["results"]) == 1
+    assert second["results"][0]["image"] != first["results"][0]["image"]
+
+    assert client.get("/search?limit=muchos").status_code == 400
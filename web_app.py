@@ -1,45 +1,200 @@
 import os
+import sys
 import json
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from detection_utils import detect_image_status_c2pa, mark_image_as_ai
+import uuid
+import logging
+from typing import Dict, Any
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from flask import (
+    Blueprint, Flask, Response, current_app, render_template, request, jsonify,
+    send_from_directory, stream_with_context
+)
+import metrics
+from detection_utils import DETAIL_LEVELS, mark_image_as_ai
+from detection_cache import default_cache, detect_cached
+from batch_detect import detect_named, imap_unordered_bounded
+from job_queue import JOB_QUEUED, JOB_RUNNING, JobQueue, get_job_queue
+from provenance_search import DEFAULT_PAGE_SIZE, get_search_index
 from werkzeug.utils import secure_filename
 
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+bp = Blueprint("pmc", __name__)
 
-@app.get("/")
+request_log = logging.getLogger("pmc.requests")
+
+
+def config_from_env() -> Dict[str, Any]:
+    """
+    Configuración de la aplicación a partir de variables de entorno:
+        PMC_MAX_UPLOAD_MB    Tamaño máximo de subida en MB (por defecto 16)
+        PMC_UPLOAD_FOLDER    Carpeta de subidas (por defecto ./uploads)
+        PMC_BATCH_WORKERS    Procesos para /detect/batch (por defecto: nº de CPUs)
+        PMC_BATCH_MAX_ITEMS  Imágenes máximas por petición a /detect/batch (por defecto 500)
+        PMC_REQUEST_LOG      "1" activa una línea de log JSON por petición en stderr (por defecto desactivada)
+        PMC_METRICS_DB       SQLite donde todos los procesos vuelcan sus métricas para /metrics
+                             (por defecto metrics.sqlite3 en la carpeta de subidas; vacío = por proceso)
+    """
+    upload_folder = os.getenv("PMC_UPLOAD_FOLDER", UPLOAD_FOLDER)
+    return {
+        "MAX_CONTENT_LENGTH": int(float(os.getenv("PMC_MAX_UPLOAD_MB", "16")) * 1024 * 1024),
+        "UPLOAD_FOLDER": upload_folder,
+        "BATCH_WORKERS": int(os.getenv("PMC_BATCH_WORKERS", str(os.cpu_count() or 1))),
+        "BATCH_MAX_ITEMS": int(os.getenv("PMC_BATCH_MAX_ITEMS", "500")),
+        "REQUEST_LOG": os.getenv("PMC_REQUEST_LOG", "0") == "1",
+        "METRICS_DB": os.getenv("PMC_METRICS_DB", os.path.join(upload_folder, "metrics.sqlite3")),
+    }
+
+
+def create_app(config: Dict[str, Any] = None) -> Flask:
+    """Factoría de la aplicación Flask (usada por wsgi.py y por el servidor de desarrollo)"""
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    # Antes de crear los pools: los procesos hijos heredan PMC_METRICS_DB
+    metrics.configure(app.config["METRICS_DB"] or None)
+    app.register_blueprint(bp)
+    if app.config["REQUEST_LOG"]:
+        _configure_request_log()
+    return app
+
+
+def _configure_request_log() -> None:
+    # Una línea JSON por petición en stderr (el errorlog de gunicorn)
+    if not request_log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_log.addHandler(handler)
+        request_log.setLevel(logging.INFO)
+        request_log.propagate = False
+
+
+def _upload_folder() -> str:
+    return current_app.config["UPLOAD_FOLDER"]
+
+
+def _is_truthy(value: str) -> bool:
+    return str(value or "").lower() in ("1", "true", "yes", "on")
+
+
+def _job_queue() -> JobQueue:
+    queue = get_job_queue(os.path.join(_upload_folder(), "jobs.sqlite3"))
+    # Retoma los trabajos pendientes aunque este worker aún no haya encolado nada
+    queue.start()
+    return queue
+
+
+# Pool de procesos para /detect/batch, creado de forma perezosa en cada
+# worker (nunca antes del fork de gunicorn)
+_batch_executor = None
+_batch_executor_pid = None
+
+
+def _get_batch_executor() -> ProcessPoolExecutor:
+    global _batch_executor, _batch_executor_pid
+    if _batch_executor is None or _batch_executor_pid != os.getpid():
+        _batch_executor = ProcessPoolExecutor(max_workers=current_app.config["BATCH_WORKERS"])
+        _batch_executor_pid = os.getpid()
+    return _batch_executor
+
+
+def _resolve_server_path(path: str) -> str:
+    """Resuelve una ruta del servidor dentro de la carpeta de subidas (o None)"""
+    root = os.path.realpath(_upload_folder())
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        return None
+    return full
+
+
+def _detail_level(payload: Dict[str, Any] = None) -> str:
+    """Nivel de detalle pedido (`detail` en la query, el formulario o el JSON)"""
+    detail = request.values.get("detail") or (payload or {}).get("detail") or "full"
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"detail debe ser uno de: {', '.join(DETAIL_LEVELS)}")
+    return detail
+
+
+@bp.before_app_request
+def _begin_request_metrics():
+    metrics.begin_request()
+
+
+@bp.after_app_request
+def _end_request_metrics(response):
+    record = metrics.end_request()
+    if record is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.observe("pmc_request_seconds", record["duration_ms"] / 1000, endpoint=endpoint)
+    metrics.inc("pmc_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    if current_app.config["REQUEST_LOG"] and request_log.isEnabledFor(logging.INFO):
+        # En las respuestas en streaming (/detect/batch) solo cubre hasta el primer byte
+        request_log.info(json.dumps({
+            "event": "request",
+            "method": request.method,
+            "path": request.path,
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "bytes_in": request.content_length or 0,
+            **record,
+        }, ensure_ascii=False))
+    return response
+
+
+@bp.get("/")
 def index():
     return render_template("index.html")
 
 
-@app.get("/test-images")
+@bp.get("/test-images")
 def test_images():
     """Página de prueba para verificar carga de imágenes"""
     return render_template("test_images.html")
 
 
-@app.post("/mark-as-ai")
+@bp.post("/mark-as-ai")
 def mark_as_ai():
-    """Endpoint para marcar una imagen como generada por IA"""
+    """
+    Endpoint para marcar una imagen como generada por IA.
+    Con `async=1` (formulario o query string) encola el marcado y responde
+    202 con el id del trabajo, consultable en /jobs/<id>.
+    """
     file = request.files.get("file")
     if not file or not file.filename:
         return jsonify({"error": "No se proporcionó imagen"}), 400
     
-    # Guardar archivo temporalmente
     filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, f"mark_{filename}")
-    file.save(temp_path)
+    
+    # Obtener parámetros opcionales
+    prompt = request.form.get("prompt", "Imagen marcada manualmente")
+    model = request.form.get("model", "Manual Marking System")
+    author = request.form.get("author", "User")
+    
+    if _is_truthy(request.values.get("async")):
+        job_id = uuid.uuid4().hex
+        # Nombre único por trabajo: varios trabajos pueden subir el mismo archivo
+        temp_path = os.path.join(_upload_folder(), f"mark_{job_id[:8]}_{filename}")
+        with metrics.stage("upload_save"):
+            file.save(temp_path)
+        _job_queue().submit_mark(temp_path, prompt, model, author, job_id=job_id, image=filename)
+        return jsonify({
+            "job_id": job_id,
+            "status": JOB_QUEUED,
+            "status_url": f"/jobs/{job_id}",
+            "result_url": f"/jobs/{job_id}/result"
+        }), 202
+    
+    # Guardar archivo temporalmente
+    temp_path = os.path.join(_upload_folder(), f"mark_{filename}")
+    with metrics.stage("upload_save"):
+        file.save(temp_path)
     
     try:
-        # Obtener parámetros opcionales
-        prompt = request.form.get("prompt", "Imagen marcada manualmente")
-        model = request.form.get("model", "Manual Marking System")
-        author = request.form.get("author", "User")
-        
         # Marcar imagen
         result = mark_image_as_ai(temp_path, prompt, model, author)
         
@@ -48,48 +203,187 @@ def mark_as_ai():
         return jsonify({"error": str(e), "success": False}), 500
 
 
-@app.post("/detect")
+@bp.get("/jobs/<job_id>")
+def job_status(job_id):
+    """Estado de un trabajo de marcado asíncrono"""
+    job = _job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    job.pop("result", None)
+    # La ruta del archivo en el servidor no se expone
+    job["params"].pop("image_path", None)
+    return jsonify(job)
+
+
+@bp.get("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Resultado de un trabajo: 202 mientras sigue pendiente"""
+    job = _job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+        return jsonify({"job_id": job_id, "status": job["status"]}), 202
+    result = job["result"] or {"success": False, "error": job["error"]}
+    return jsonify(result)
+
+
+@bp.post("/detect")
 def detect():
-    """Endpoint para detectar si una imagen es generada por IA"""
+    """
+    Endpoint para detectar si una imagen es generada por IA. `detail`
+    (summary, assertions o full, por defecto) recorta la respuesta.
+    """
+    try:
+        detail = _detail_level()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     # Opción 1: botón de ejemplos
     sample = request.form.get("sample")
     if sample in {"gato1", "gato2", "gato3"}:
         # Buscar en carpeta uploads
-        image_path = os.path.join(UPLOAD_FOLDER, f"{sample}.jpg")
+        image_path = os.path.join(_upload_folder(), f"{sample}.jpg")
         if os.path.exists(image_path):
-            return jsonify(detect_image_status_c2pa(image_path))
+            return jsonify(detect_cached(image_path, detail=detail))
         # Fallback: buscar en raíz con diferentes extensiones
         for ext in ['.png', '.jpg', '.jpeg']:
             image_path = os.path.join(os.path.dirname(__file__), f"{sample}{ext}")
             if os.path.exists(image_path):
-                return jsonify(detect_image_status_c2pa(image_path))
+                return jsonify(detect_cached(image_path, detail=detail))
         return jsonify({"error": f"Imagen {sample} no encontrada"}), 404
 
-    # Opción 2: archivo subido
+    # Opción 2: archivo subido (se analiza en memoria, sin pasar por disco)
     file = request.files.get("file")
     if file and file.filename:
-        filename = secure_filename(file.filename)
-        temp_path = os.path.join(UPLOAD_FOLDER, f"detect_{filename}")
-        file.save(temp_path)
-        try:
-            result = detect_image_status_c2pa(temp_path)
-        finally:
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
-        return jsonify(result)
+        with metrics.stage("upload_read"):
+            data = file.read()
+        metrics.inc("pmc_bytes_read_total", len(data), stage="upload")
+        return jsonify(detect_cached(data, name=secure_filename(file.filename), detail=detail))
 
     return jsonify({"error": "No se proporcionó imagen"}), 400
 
 
-@app.route("/uploads/<path:filename>")
+@bp.post("/detect/batch")
+def detect_batch():
+    """
+    Detección de muchas imágenes en una sola petición. Acepta varios
+    archivos en `files` (multipart) o una lista de rutas del servidor
+    (`paths`, relativas a la carpeta de subidas) y responde en NDJSON: una
+    línea por imagen según van terminando, con su `index` en la petición.
+    `detail` funciona como en /detect.
+    """
+    files = [f for f in request.files.getlist("files") + request.files.getlist("file") if f.filename]
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "El cuerpo JSON debe ser un objeto"}), 400
+    paths = payload.get("paths") or request.form.getlist("paths")
+    # Un string se recorrería carácter a carácter
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return jsonify({"error": "paths debe ser una lista de rutas"}), 400
+    try:
+        detail = _detail_level(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    total = len(files) + len(paths)
+    if total == 0:
+        return jsonify({"error": "No se proporcionaron imágenes"}), 400
+    max_items = current_app.config["BATCH_MAX_ITEMS"]
+    if total > max_items:
+        return jsonify({"error": f"Máximo {max_items} imágenes por petición"}), 413
+
+    # Las rutas fuera de la carpeta de subidas se rechazan individualmente
+    resolved = [(index, path, _resolve_server_path(path))
+                for index, path in enumerate(paths, start=len(files))]
+
+    # Werkzeug cierra los archivos subidos al terminar la vista, así que se
+    # leen antes de empezar a responder (ya están acotados por MAX_CONTENT_LENGTH)
+    uploads = [(index, secure_filename(file.filename), file.read()) for index, file in enumerate(files)]
+
+    def items():
+        yield from uploads
+        for index, path, full_path in resolved:
+            if full_path is not None:
+                yield index, os.path.basename(path), full_path
+
+    def generate():
+        for index, path, full_path in resolved:
+            if full_path is None:
+                error = {"index": index, "image": os.path.basename(path), "error": "Ruta no permitida"}
+                yield json.dumps(error, ensure_ascii=False) + "\n"
+        # Como mucho 2 imágenes pendientes por worker: si el cliente lee
+        # despacio, no se envían más al pool (back-pressure)
+        workers = current_app.config["BATCH_WORKERS"]
+        for result in imap_unordered_bounded(
+            _get_batch_executor(), partial(detect_named, detail=detail), items(), workers * 2
+        ):
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@bp.get("/search")
+def search():
+    """
+    Búsqueda de procedencia sobre las imágenes indexadas (PMC_SEARCH_DB).
+    Parámetros: q (texto del prompt), model, claim_generator, signature_type,
+    from / to (fechas ISO 8601), limit y cursor (valor de `next_cursor`).
+    """
+    index = get_search_index()
+    if index is None:
+        return jsonify({"error": "Búsqueda no configurada (PMC_SEARCH_DB)"}), 503
+    args = request.args
+    try:
+        page = index.search(
+            query=args.get("q"),
+            model=args.get("model"),
+            claim_generator=args.get("claim_generator"),
+            signature_type=args.get("signature_type"),
+            date_from=args.get("from"),
+            date_to=args.get("to"),
+            limit=int(args.get("limit", DEFAULT_PAGE_SIZE)),
+            cursor=args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
+
+
+@bp.get("/cache/stats")
+def cache_stats():
+    """Contadores de la caché de detección"""
+    return jsonify(default_cache.stats())
+
+
+@bp.get("/metrics")
+def metrics_endpoint():
+    """
+    Métricas en formato de exposición de Prometheus: la suma de todos los
+    workers y sus pools de procesos (ver PMC_METRICS_DB)
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/uploads/<path:filename>")
 def serve_upload(filename):
     """Servir archivos desde la carpeta uploads"""
-    return send_from_directory(UPLOAD_FOLDER, filename, mimetype='image/jpeg')
+    return send_from_directory(_upload_folder(), filename, mimetype='image/jpeg')
+
+
+# Aplicación por defecto: `flask --app web_app run`, `web_app:app` y wsgi.py
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Servidor de desarrollo. En producción: gunicorn -c gunicorn.conf.py wsgi:app
+    if app.config["METRICS_DB"]:
+        metrics.clear_shared(app.config["METRICS_DB"])
+    app.run(
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5000")),
+        debug=os.getenv("PMC_DEBUG", "1") == "1"
+    )
 
 
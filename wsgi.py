@@ -0,0 +1,12 @@
+"""
+Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+En Windows (sin gunicorn) puede usarse waitress:
+
+    waitress-serve --listen=0.0.0.0:5000 wsgi:app
+
+Es la misma aplicación que web_app:app (creada una sola vez al importar).
+"""
+from web_app import app